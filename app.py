@@ -10,12 +10,25 @@ if hasattr(st, "secrets"):
             os.environ[key] = value
 
 from streamlit_feedback import streamlit_feedback
-from core.retrieval import get_rag_chain
-from langchain_core.messages import HumanMessage, AIMessage
+from core.warmup import WARMUP, pipeline_stats
+from domain.config import METRICS_PORT, SERVICE_URL, CORPORA
 import time
 import json
 import datetime
 import uuid
+import contextlib
+
+# --- MODEL WARM-UP ---
+# Embedder, reranker, FAISS index and LLM client load on a background thread
+# (once per process) while the login page renders; with SERVICE_URL set they
+# live in the query service instead
+if not SERVICE_URL:
+    WARMUP.start()
+
+# Prometheus scrape endpoint for the per-stage latency histograms (METRICS_PORT=0 disables it)
+if METRICS_PORT:
+    from core.telemetry import start_metrics_server
+    start_metrics_server(METRICS_PORT)
 
 # --- LOGGING SETUP ---
 def log_event(session_id, event_type, data=None):
@@ -103,15 +116,31 @@ if not check_password():
 
 # --- CHAT STATE INIT ---
 # Initialize chat history state
+# Only a few recent chats (and their last messages) stay in the session; older
+# ones spill to the local chat store, so per-session memory stays bounded
+@st.cache_resource
+def get_chat_store():
+    from core.chat_store import ChatStore
+    return ChatStore()
+
+def new_chat():
+    return {
+        "messages": [],
+        "title": f"Chat {datetime.datetime.now().strftime('%H:%M')}",
+        "opened": time.time(),
+    }
+
+def compact_chats():
+    from core.chat_store import compact_session
+    compact_session(st.session_state.chats, st.session_state.current_chat_id,
+                    st.session_state.session_id, get_chat_store())
+
 if "chats" not in st.session_state:
     st.session_state.chats = {}
 
 if "current_chat_id" not in st.session_state:
     new_chat_id = str(uuid.uuid4())
-    st.session_state.chats[new_chat_id] = {
-        "messages": [],
-        "title": f"Chat {datetime.datetime.now().strftime('%H:%M')}"
-    }
+    st.session_state.chats[new_chat_id] = new_chat()
     st.session_state.current_chat_id = new_chat_id
 
 if "session_id" not in st.session_state:
@@ -120,6 +149,31 @@ if "session_id" not in st.session_state:
 def get_current_chat():
     return st.session_state.chats[st.session_state.current_chat_id]
 
+def fetch_snippets(chunk_ids):
+    """Source snippets for messages that store only chunk_id references."""
+    if SERVICE_URL:
+        from core.api import fetch_snippets as fetch_from_service
+        return fetch_from_service(SERVICE_URL, chunk_ids)
+    if not WARMUP.ready:
+        return {}
+    from core.api import docstore_snippets
+    return docstore_snippets(WARMUP.components["vectorstore"], chunk_ids)
+
+def source_heading(number, src):
+    corpus = f"{src['corpus']}, " if src.get("corpus") and len(CORPORA) > 1 else ""
+    return f"**Source {number} ({corpus}Reg: {src.get('regulation_id', 'N/A')}, Page: {src.get('page', 'N/A')}):**"
+
+def render_message(message):
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("sources"):
+            from core.api import source_snippets
+            with st.expander("View Source Regulations"):
+                snippets = source_snippets(message["sources"], fetch_snippets)
+                for idx, (src, snippet) in enumerate(zip(message["sources"], snippets)):
+                    st.markdown(source_heading(idx + 1, src))
+                    st.text(snippet + "...")
+
 # --- SIDEBAR & DISCLAIMER ---
 with st.sidebar:
     st.header("Mumbai DCPR 2034 Chat Assistant")
@@ -142,8 +196,14 @@ with st.sidebar:
     st.markdown("---")
     if st.button("Clear Chat History", use_container_width=True):
         get_current_chat()["messages"] = []
+        get_current_chat().pop("memory", None)
+        get_current_chat().pop("spilled", None)
+        get_chat_store().delete_chat(st.session_state.session_id, st.session_state.current_chat_id)
         st.rerun()
 
+    if not SERVICE_URL and not WARMUP.ready:
+        st.caption("⏳ Loading models in the background...")
+
 # --- MAIN APP UI ---
 st.image("assets/heading.png", width="stretch")
 
@@ -157,124 +217,174 @@ with st.sidebar:
     st.markdown("---")
     if st.button("➕ New Chat", use_container_width=True):
         new_chat_id = str(uuid.uuid4())
-        st.session_state.chats[new_chat_id] = {
-            "messages": [],
-            "title": f"Chat {datetime.datetime.now().strftime('%H:%M')}"
-        }
+        st.session_state.chats[new_chat_id] = new_chat()
         st.session_state.current_chat_id = new_chat_id
+        compact_chats()
         st.rerun()
     
     st.markdown("### Recent Chats")
     # Display chat history buttons
     for chat_id, chat_data in list(st.session_state.chats.items())[::-1]: # Reverse order
-        # Simple title based on first message or timestamp
-        if len(chat_data["messages"]) > 0:
-            title = chat_data["messages"][0]["content"][:20] + "..."
-        else:
-            title = chat_data["title"]
-            
-        if st.button(title, key=chat_id, use_container_width=True, 
+        # Title: the first question, or the creation time
+        if st.button(chat_data["title"], key=chat_id, use_container_width=True,
                      type="primary" if chat_id == st.session_state.current_chat_id else "secondary"):
             st.session_state.current_chat_id = chat_id
+            chat_data["opened"] = time.time()
             st.rerun()
 
-# Load RAG Chain
-@st.cache_resource
-def load_chain():
-    return get_rag_chain()
+    # Chats spilled to the chat store come back into the session when opened
+    for chat_id, title in get_chat_store().list_chats(st.session_state.session_id):
+        if st.button(title, key=chat_id, use_container_width=True):
+            chat_data = get_chat_store().load_chat(st.session_state.session_id, chat_id)
+            chat_data["opened"] = time.time()
+            st.session_state.chats[chat_id] = chat_data
+            st.session_state.current_chat_id = chat_id
+            compact_chats()
+            st.rerun()
 
-try:
-    rag_chain = load_chain()
-except Exception as e:
-    st.error(f"Error loading RAG chain: {e}")
+if WARMUP.state == "failed":
+    st.error(f"Error loading RAG chain: {WARMUP.error}")
     st.stop()
 
 # Display chat messages from history on app rerun
 current_chat = get_current_chat()
-for n, message in enumerate(current_chat["messages"]):
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-        
-        # If it was an assistant message, show the sources if preserved in history (optional complexity)
-        # For simplicity, we just show sources immediately after generation below. 
-        # But if we wanted persistent sources, we'd need to store them in session_state.messages.
-        if message.get("sources"):
-             with st.expander("View Source Regulations"):
-                for idx, src in enumerate(message["sources"]):
-                     st.markdown(f"**Source {idx+1} (Reg: {src.get('regulation_id', 'N/A')}):**")
-                     st.text(src.get('text', '')[:300] + "...")
+if current_chat.get("spilled"):
+    # Older messages live in the chat store; read only when asked for, never kept in the session
+    if st.button(f"Show {current_chat['spilled']} earlier messages"):
+        for message in get_chat_store().earlier_messages(
+            st.session_state.session_id, st.session_state.current_chat_id, current_chat["spilled"]
+        ):
+            render_message(message)
+for message in current_chat["messages"]:
+    render_message(message)
 
 # React to user input
 if prompt := st.chat_input("Ask a question about Mumbai Development Control Regulations..."):
     # Display user message
     st.chat_message("user").markdown(prompt)
+    if not current_chat["messages"] and not current_chat.get("spilled"):
+        current_chat["title"] = prompt[:20] + "..."
     current_chat["messages"].append({"role": "user", "content": prompt})
 
     # Generate response
     with st.chat_message("assistant"):
-        with st.spinner("Analyzing regulations..."):
-            try:
-                # Log the question start
-                log_event(st.session_state.session_id, "user_query", {"input": prompt})
-                
-                # Format history for LangChain
-                chat_history = []
-                for msg in current_chat["messages"][:-1]: # Exclude the just added user message
-                    if msg["role"] == "user":
-                        chat_history.append(HumanMessage(content=msg["content"]))
-                    elif msg["role"] == "assistant":
-                        chat_history.append(AIMessage(content=msg["content"]))
-
-                response = rag_chain.invoke({"input": prompt, "chat_history": chat_history})
-                answer = response["answer"]
-                documents = response["context"]
-                
-                # Display answer
-                st.markdown(answer)
-                
-                # Process sources for display & storage
-                sources_data = []
-                with st.expander("View Source Regulations"):
-                    for i, doc in enumerate(documents):
-                        # Extract metadata safely
-                        reg_id = doc.metadata.get('regulation_id', 'N/A')
-                        page = doc.metadata.get('page_number', 'N/A')
-                        snippet = doc.page_content
-                        
-                        st.markdown(f"**Source {i+1} (Reg: {reg_id}, Page: {page}):**")
-                        st.text(snippet[:400] + "...")
-                        
-                        sources_data.append({
-                            "regulation_id": reg_id,
-                            "page": page,
-                            "text": snippet
-                        })
-                
-                # Log the answer
-                log_event(st.session_state.session_id, "ai_response", {"answer": answer, "sources_count": len(sources_data)})
-                
-                # Save to history
-                current_chat["messages"].append({
-                    "role": "assistant", 
-                    "content": answer,
-                    "sources": sources_data
-                })
-                
-                # Trigger feedback
-                # Note: streamlit_feedback works best when it's the last element. 
-                # We can't easily embed it *inside* the chat loop for *historical* messages easily without complications.
-                # So we usually show it for the *latest* response or use a specific key.
-                
-            except Exception as e:
-                st.error(f"Error: {e}")
-                log_event(st.session_state.session_id, "error", {"error_message": str(e)})
+        # Placeholders fill in as the chain streams: sources as soon as
+        # retrieval finishes, answer tokens as they are generated
+        answer_placeholder = st.empty()
+        cache_placeholder = st.empty()
+        sources_placeholder = st.empty()
+        # Only the first question after a restart can arrive before the warm-up is done
+        answer_placeholder.markdown(
+            "_Analyzing regulations..._" if SERVICE_URL or WARMUP.ready else "_Loading models..._"
+        )
+        request_trace = None
+        try:
+            # Log the question start
+            log_event(st.session_state.session_id, "user_query", {"input": prompt})
+            history = current_chat["messages"][:-1]  # Exclude the just added user message
+
+            if SERVICE_URL:
+                # Thin client: retrieval, generation and the conversation memory run in the
+                # query service (core/service.py), which shares one copy of the models
+                from core.api import stream_query
+                tracing = contextlib.nullcontext()
+                events = stream_query(SERVICE_URL, prompt, history, current_chat.get("memory"),
+                                      st.session_state.session_id)
+            else:
+                rag_chain = WARMUP.wait()
+                answer_placeholder.markdown("_Analyzing regulations..._")
+                from langchain_core.messages import HumanMessage, AIMessage
+                from core.api import chain_events, history_messages
+                from core.telemetry import trace
+                from core.memory import ConversationMemory
+
+                # Format history for LangChain; the memory bounds what is sent
+                # (recent turns verbatim, older ones as a running summary)
+                memory = ConversationMemory.from_state(current_chat.get("memory"))
+                chat_history = history_messages(history)
+                # One trace per question: per-stage spans, LLM tokens and cache events
+                tracing = trace(session_id=st.session_state.session_id)
+                events = chain_events(
+                    rag_chain.stream({"input": prompt, "chat_history": memory.history(chat_history)})
+                )
+
+            answer = ""
+            cached = False
+            sources_data = []
+            service_reply = {}
+            with tracing as request_trace:
+                for event in events:
+                    if "sources" in event:
+                        # Display & storage
+                        sources_data = event["sources"]
+                        with sources_placeholder.container():
+                            with st.expander("View Source Regulations"):
+                                for i, src in enumerate(sources_data):
+                                    st.markdown(source_heading(i + 1, src))
+                                    st.text(src["snippet"] + "...")
+                    if "answer" in event:
+                        answer += event["answer"]
+                        answer_placeholder.markdown(answer + "▌")
+                    if event.get("cached"):
+                        cached = True
+                    if event.get("done"):
+                        # The service's last line: the updated memory and the request's trace
+                        service_reply = event
+
+                # Display final answer
+                answer_placeholder.markdown(answer)
+
+                if SERVICE_URL:
+                    current_chat["memory"] = service_reply.get("memory")
+                else:
+                    # Every few turns, fold the older turns into the running summary;
+                    # a failed fold only delays it (history() stays bounded meanwhile)
+                    try:
+                        memory.update(chat_history + [HumanMessage(content=prompt), AIMessage(content=answer)],
+                                      WARMUP.components["llm"])
+                    except Exception as e:
+                        log_event(st.session_state.session_id, "memory_error", {"error_message": str(e)})
+                    current_chat["memory"] = memory.state()
+
+            if cached:
+                cache_placeholder.caption("⚡ Answered from cache")
+
+            # Log the answer
+            log_event(st.session_state.session_id, "ai_response", {
+                "answer": answer,
+                "sources_count": len(sources_data),
+                "cached": cached,
+                **({"coalesced": service_reply.get("coalesced")} if SERVICE_URL else pipeline_stats()),
+                "trace": request_trace.record() if request_trace else service_reply.get("trace"),
+            })
+
+            # Save to history: the sources as chunk_id references, snippets go to the shared cache
+            from core.api import source_refs
+            current_chat["messages"].append({
+                "role": "assistant",
+                "content": answer,
+                "sources": source_refs(sources_data)
+            })
+            compact_chats()
+
+            # Trigger feedback
+            # Note: streamlit_feedback works best when it's the last element. 
+            # We can't easily embed it *inside* the chat loop for *historical* messages easily without complications.
+            # So we usually show it for the *latest* response or use a specific key.
+
+        except Exception as e:
+            st.error(f"Error: {e}")
+            log_event(st.session_state.session_id, "error", {
+                "error_message": str(e),
+                "trace": request_trace.record() if request_trace else None,
+            })
 
 # Feedback for the LATEST assistant message (outside the loop to ensure it renders at bottom)
 if len(current_chat["messages"]) > 0 and current_chat["messages"][-1]["role"] == "assistant":
     feedback = streamlit_feedback(
         feedback_type="thumbs",
         optional_text_label="[Optional] Please provide explanation",
-        key=f"feedback_{len(current_chat['messages'])}",
+        key=f"feedback_{current_chat.get('spilled', 0) + len(current_chat['messages'])}",
     )
     
     if feedback:
@@ -0,0 +1,146 @@
+# bench/chunking.py
+"""
+Chunker comparison: splits the same parsed text with each chunker and reports
+index size, redundant text, embedding cost, tables split across chunks and
+how many chunks the golden set's regulations are spread over.
+
+    python -m bench.chunking --output chunking.json
+    python -m bench.chunking --embed               # also time embedding every chunk
+
+The parsed text comes from `--source` (a markdown file), or else is rebuilt
+from the local index by joining its chunks in chunk_id order with the
+splitter overlap removed (exact for an index built by the recursive chunker).
+
+Metrics per chunker:
+    chunks, chars            size of what gets embedded and stored
+    redundancy               chunk chars / source chars - 1 (repeated overlap)
+    est_embedding_tokens     CHARS_PER_TOKEN estimate of the embedder's input
+    split_tables             source tables not contained whole in one chunk
+    chunks_per_regulation    mean / max chunks each regulation id maps to
+    golden_chunks_needed     mean chunks covering a golden question's expected
+                             regulations (what the reranker has to surface)
+    golden_fit_top_n         share of golden questions whose expected
+                             regulations fit in RERANKER_TOP_N chunks
+"""
+import json
+import time
+import math
+import argparse
+
+import numpy as np
+
+from domain.config import CHUNK_SIZE, CHARS_PER_TOKEN, RERANKER_TOP_N
+from core.chunking import CHUNKERS, markdown_blocks
+from core.context_packer import overlap_length
+from core.metadata_extraction import MetadataExtractor, RegulationMap
+from bench.pipeline import GOLDEN_SET_PATH, load_golden_set
+
+
+def index_text() -> str:
+    """The parsed text, rebuilt from the chunks of the local index."""
+    from core.docstore import load_faiss
+    from core.vectorstore import PendingEmbeddings
+    from domain.config import VECTOR_DB_PATH
+
+    vectorstore = load_faiss(VECTOR_DB_PATH, PendingEmbeddings())
+    docs = [vectorstore.docstore.search(_id) for _id in vectorstore.index_to_docstore_id.values()]
+    docs.sort(key=lambda doc: doc.metadata.get("chunk_id", 0))
+    text = ""
+    for doc in docs:
+        piece = doc.page_content
+        text += piece[overlap_length(text, piece):] if text else piece
+    return text
+
+
+def _normalized(text: str) -> str:
+    return " ".join(text.split())
+
+
+def measure(name: str, text: str, golden_set, embed: bool) -> dict:
+    started = time.perf_counter()
+    chunks = CHUNKERS[name]().split(text)
+    split_seconds = time.perf_counter() - started
+    texts = [chunk.text for chunk in chunks]
+    chars = sum(len(chunk) for chunk in texts)
+
+    normalized = [_normalized(chunk) for chunk in texts]
+    tables = [_normalized(block) for kind, block in markdown_blocks(text) if kind == "table"]
+    split_tables = sum(not any(table in chunk for chunk in normalized) for table in tables)
+
+    extractor = MetadataExtractor()
+    regulation_map = RegulationMap.from_sections(
+        [(i, extractor.extract(chunk)[1]) for i, chunk in enumerate(texts)]
+    )
+    spread = [len(chunk_ids) for chunk_ids in regulation_map.chunks.values()]
+    needed = []
+    for item in golden_set:
+        chunk_ids = set()
+        for regulation_id in item["expected"]:
+            chunk_ids.update(regulation_map.chunks.get(regulation_id, []))
+        needed.append(len(chunk_ids))
+
+    report = {
+        "chunks": len(texts),
+        "chars": chars,
+        "redundancy": round(chars / max(len(text), 1) - 1, 4),
+        "mean_chunk_chars": round(chars / max(len(texts), 1), 1),
+        "max_chunk_chars": max(map(len, texts), default=0),
+        "est_embedding_tokens": sum(math.ceil(len(chunk) / CHARS_PER_TOKEN) for chunk in texts),
+        "split_seconds": round(split_seconds, 3),
+        "tables": len(tables),
+        "split_tables": split_tables,
+        "regulations": len(spread),
+        "chunks_per_regulation": {
+            "mean": round(float(np.mean(spread)), 2) if spread else 0.0,
+            "max": max(spread, default=0),
+        },
+        "golden_chunks_needed": round(float(np.mean(needed)), 2) if needed else 0.0,
+        "golden_fit_top_n": round(float(np.mean([0 < n <= RERANKER_TOP_N for n in needed])), 4) if needed else 0.0,
+    }
+    if embed:
+        from core.warmup import load_embeddings
+        embeddings = load_embeddings()
+        embeddings.embed_documents(texts[:8])   # Untimed: model initialisation
+        started = time.perf_counter()
+        embeddings.embed_documents(texts)
+        report["embed_seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def run(text: str, chunkers, golden_set, embed: bool) -> dict:
+    report = {
+        "source_chars": len(text),
+        "chunk_size": CHUNK_SIZE,
+        "chunkers": {name: measure(name, text, golden_set, embed) for name in chunkers},
+    }
+    baseline, *others = chunkers
+    for name in others:
+        before, after = report["chunkers"][baseline], report["chunkers"][name]
+        report[f"{name}_vs_{baseline}"] = {
+            key: round(after[key] / before[key] - 1, 4)
+            for key in ("chunks", "chars", "est_embedding_tokens", "golden_chunks_needed", "embed_seconds")
+            if before.get(key)
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="Parsed markdown to split (default: rebuilt from the local index)")
+    parser.add_argument("--chunkers", nargs="+", default=["recursive", "structure"], choices=sorted(CHUNKERS),
+                        help="The first one is the baseline for the relative changes")
+    parser.add_argument("--golden-set", default=GOLDEN_SET_PATH)
+    parser.add_argument("--embed", action="store_true", help="Also time embedding all chunks (loads the embedder)")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.source:
+        with open(args.source, encoding="utf-8") as f:
+            source = f.read()
+    else:
+        source = index_text()
+    report = run(source, args.chunkers, load_golden_set(args.golden_set), args.embed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
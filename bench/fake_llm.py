@@ -0,0 +1,115 @@
+# bench/fake_llm.py
+"""
+Fake Anthropic Messages API for load tests: answers POST /v1/messages (plain
+or streamed) with the deterministic StubChatModel replies, after a simulated
+network + generation delay, so the query service can be load-tested with the
+real ChatAnthropic client and no API key or spend.
+
+    python -m bench.fake_llm --port 8100 --latency 0.8 --token-delay 0.01
+    LLM_BASE_URL=http://localhost:8100 ANTHROPIC_API_KEY=fake python -m core.service
+
+GET /stats returns the number of calls served, to count the upstream LLM
+calls a load test caused (see bench/load.py).
+"""
+import re
+import json
+import asyncio
+import argparse
+from collections import Counter
+
+from aiohttp import web
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from core.stub_llm import StubChatModel
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def to_messages(body: dict) -> list:
+    """An Anthropic request body -> the LangChain messages StubChatModel reads."""
+    messages = [SystemMessage(content=_text(body["system"]))] if body.get("system") else []
+    for message in body.get("messages", []):
+        cls = HumanMessage if message["role"] == "user" else AIMessage
+        messages.append(cls(content=_text(message["content"])))
+    return messages
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class FakeAnthropic:
+    def __init__(self, latency: float, token_delay: float):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.model = StubChatModel()
+        self.stats = Counter()
+
+    async def messages(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        messages = to_messages(body)
+        text = self.model.respond(messages)
+        usage = StubChatModel._usage(messages, text)
+        self.stats["requests"] += 1
+        message_id = f"msg_fake_{self.stats['requests']}"
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            # Generation time of the whole reply
+            await asyncio.sleep(self.token_delay * usage["output_tokens"])
+            return web.json_response({
+                "id": message_id, "type": "message", "role": "assistant", "model": body.get("model"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": usage["input_tokens"], "output_tokens": usage["output_tokens"]},
+            })
+
+        self.stats["streamed"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(_sse("message_start", {"type": "message_start", "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": body.get("model"),
+            "content": [], "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 0},
+        }}))
+        await response.write(_sse("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+        }))
+        # Word by word, keeping the whitespace, like StubChatModel's own stream
+        for token in re.findall(r"\S+\s*|\s+", text):
+            await asyncio.sleep(self.token_delay)
+            await response.write(_sse("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token},
+            }))
+        await response.write(_sse("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        await response.write(_sse("message_delta", {
+            "type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": usage["output_tokens"]},
+        }))
+        await response.write(_sse("message_stop", {"type": "message_stop"}))
+        return response
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+
+def create_app(latency: float = 0.8, token_delay: float = 0.01) -> web.Application:
+    fake = FakeAnthropic(latency, token_delay)
+    app = web.Application()
+    app.router.add_post("/v1/messages", fake.messages)
+    app.router.add_get("/stats", fake.get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds per generated word")
+    args = parser.parse_args()
+    web.run_app(create_app(args.latency, args.token_delay), host=args.host, port=args.port)
@@ -0,0 +1,179 @@
+# bench/index.py
+"""
+Vector index benchmark: builds every FAISS_INDEX_TYPE (core/ann_index.py)
+from the exact index ingestion saved, and reports for each its recall@k
+against exact search, query latency p50/p95, build time and size. Filtered
+recall is measured too, with random pre-filter masks keeping `--selectivity`
+of the chunks, since most questions with a self-query filter search that way.
+As in serving, masks keeping at most ANN_EXACT_FILTER_SHARE of the chunks
+search the exact index instead; `--no-exact-filter` shows the index alone.
+
+    python -m bench.index --output index.json
+    python -m bench.index --scale 20 --types flat hnsw ivf_sq8     # a corpus 20x today's
+    python -m bench.index --queries golden                        # embed the golden questions
+
+`--scale N` adds N-1 noisy copies of every chunk vector, to see where the
+approximate indexes start to pay off. Queries are corpus vectors with noise
+added (`--queries sample`, no embedding model needed) or the golden-set
+questions embedded with EMBEDDING_MODEL. The search-time knobs come from
+domain/config.py (HNSW_EF_SEARCH, IVF_NPROBE); `--ef-search` / `--nprobe`
+override them to trace the recall-latency curve of one build.
+"""
+import os
+import json
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import faiss
+
+from domain.config import VECTOR_DB_PATH, EMBEDDING_MODEL, FAISS_INDEX_TYPE, ANN_EXACT_FILTER_SHARE
+from core.docstore import FAISS_FILE
+from core.ann_index import (
+    INDEX_TYPES, build_index, configure, exact_vectors, filtered_index, index_spec, search_parameters
+)
+
+GOLDEN_SET_PATH = os.path.join(os.path.dirname(__file__), "golden_set.jsonl")
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def scaled_corpus(vectors: np.ndarray, scale: int, noise: float, rng) -> np.ndarray:
+    """`vectors` plus `scale - 1` noisy copies of each (noise relative to the mean vector norm)."""
+    if scale <= 1:
+        return vectors
+    sigma = noise * float(np.linalg.norm(vectors, axis=1).mean()) / np.sqrt(vectors.shape[1])
+    copies = [vectors] + [vectors + rng.normal(0, sigma, vectors.shape).astype(np.float32)
+                          for _ in range(scale - 1)]
+    return np.ascontiguousarray(np.concatenate(copies), dtype=np.float32)
+
+
+def sample_queries(vectors: np.ndarray, n: int, noise: float, rng) -> np.ndarray:
+    rows = rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)
+    sigma = noise * float(np.linalg.norm(vectors, axis=1).mean()) / np.sqrt(vectors.shape[1])
+    return np.ascontiguousarray(vectors[rows] + rng.normal(0, sigma, (len(rows), vectors.shape[1])), dtype=np.float32)
+
+
+def golden_queries(path: str = GOLDEN_SET_PATH) -> np.ndarray:
+    from core.warmup import load_embeddings
+
+    with open(path) as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+    return np.array(load_embeddings().embed_documents(questions), dtype=np.float32)
+
+
+def random_masks(n: int, selectivity: float, count: int, rng) -> List[np.ndarray]:
+    return [rng.random(n) < selectivity for _ in range(count)]
+
+
+def search(index, queries: np.ndarray, k: int, masks=None, exact_index=None):
+    """
+    Top-k rows per query and per-query seconds, one query at a time like the
+    retriever (filtered ones routed to `exact_index` like PrefilteredFAISS).
+    """
+    rows, seconds = [], []
+    for i, query in enumerate(queries):
+        params, searched = None, index
+        if masks is not None:
+            mask = masks[i % len(masks)]
+            searched = filtered_index(index, exact_index, int(mask.sum()))
+            # The bitmap must stay referenced until the search returns
+            bitmap = np.packbits(mask, bitorder="little")
+            params = search_parameters(searched, faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)))
+        started = time.perf_counter()
+        _, indices = searched.search(query[None, :], k, params=params)
+        seconds.append(time.perf_counter() - started)
+        rows.append([int(row) for row in indices[0] if row != -1])
+    return rows, seconds
+
+
+def recall_at_k(rows: List[List[int]], exact_rows: List[List[int]], k: int) -> float:
+    """Mean share of the exact top k that the index also returned in its top k."""
+    shares = [len(set(found[:k]) & set(exact[:k])) / len(exact[:k]) for found, exact in zip(rows, exact_rows) if exact]
+    return float(np.mean(shares)) if shares else 0.0
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, index_types: List[str], ks: List[int],
+             selectivities: List[float], metric, rng, ef_search=None, nprobe=None,
+             exact_filter: bool = True) -> Dict[str, dict]:
+    k = max(ks)
+    exact = build_index(vectors, "flat", metric)
+    masks = {s: random_masks(len(vectors), s, len(queries), rng) for s in selectivities}
+    exact_rows = {None: search(exact, queries, k)[0]}
+    for s in selectivities:
+        exact_rows[s] = search(exact, queries, k, masks[s])[0]
+
+    results = {}
+    for index_type in index_types:
+        print(f"Building {index_type} ({index_spec(index_type, len(vectors))})...")
+        started = time.perf_counter()
+        index = build_index(vectors, index_type, metric)
+        build_seconds = time.perf_counter() - started
+        configure(index, **{key: value for key, value in (("ef_search", ef_search), ("nprobe", nprobe)) if value})
+
+        rows, seconds = search(index, queries, k)
+        result = {
+            "spec": index_spec(index_type, len(vectors)),
+            "build_seconds": round(build_seconds, 3),
+            "size_mb": round(len(faiss.serialize_index(index)) / 2**20, 3),
+            "latency_ms": {"p50": round(_percentile(seconds, 50) * 1000, 4),
+                           "p95": round(_percentile(seconds, 95) * 1000, 4)},
+            "recall": {f"@{cut}": round(recall_at_k(rows, exact_rows[None], cut), 4) for cut in ks},
+            "filtered": {},
+        }
+        for s in selectivities:
+            rows, seconds = search(index, queries, k, masks[s], exact if exact_filter else None)
+            result["filtered"][str(s)] = {
+                "recall": {f"@{cut}": round(recall_at_k(rows, exact_rows[s], cut), 4) for cut in ks},
+                "latency_ms_p50": round(_percentile(seconds, 50) * 1000, 4),
+            }
+        results[index_type] = result
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=os.path.join(VECTOR_DB_PATH, FAISS_FILE), help="Exact index from ingestion")
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=list(INDEX_TYPES))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 10, 30], help="Cut-offs for recall@k")
+    parser.add_argument("--scale", type=int, default=1, help="Corpus size as a multiple of the ingested one")
+    parser.add_argument("--queries", choices=["sample", "golden"], default="sample")
+    parser.add_argument("--sample", type=int, default=200, help="Queries drawn from the corpus (--queries sample)")
+    parser.add_argument("--noise", type=float, default=0.2, help="Relative noise of scaled copies and sampled queries")
+    parser.add_argument("--selectivity", type=float, nargs="*", default=[0.5, 0.2, 0.02],
+                        help="Shares of chunks the filtered searches keep")
+    parser.add_argument("--no-exact-filter", action="store_true",
+                        help="Search selective filters on the index itself, not the exact one")
+    parser.add_argument("--ef-search", type=int, help="Override HNSW_EF_SEARCH")
+    parser.add_argument("--nprobe", type=int, help="Override IVF_NPROBE")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    flat_index = faiss.read_index(args.index)
+    vectors = scaled_corpus(exact_vectors(flat_index), args.scale, args.noise, rng)
+    if args.queries == "golden":
+        queries = golden_queries()
+        if flat_index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            faiss.normalize_L2(queries)
+    else:
+        queries = sample_queries(vectors, args.sample, args.noise, rng)
+
+    report = {
+        "embedding_model": EMBEDDING_MODEL,
+        "configured_index_type": FAISS_INDEX_TYPE,
+        "exact_filter_share": None if args.no_exact_filter else ANN_EXACT_FILTER_SHARE,
+        "chunks": int(len(vectors)),
+        "dimensions": int(vectors.shape[1]),
+        "queries": int(len(queries)),
+        "indexes": evaluate(vectors, queries, args.types, sorted(args.k), args.selectivity,
+                            flat_index.metric_type, rng, args.ef_search, args.nprobe, not args.no_exact_filter),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
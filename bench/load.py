@@ -0,0 +1,124 @@
+# bench/load.py
+"""
+Load test for the query service (core/service.py): `--users` concurrent
+clients ask golden-set questions over HTTP until `--requests` have been
+answered, and the report gives throughput, end-to-end and first-token latency
+quantiles, and how many requests were coalesced or answered from the cache.
+
+    python -m bench.fake_llm --latency 0.8 &
+    LLM_BASE_URL=http://localhost:8100 ANTHROPIC_API_KEY=fake python -m core.service &
+    python -m bench.load --users 32 --requests 300 --llm-url http://localhost:8100 --output load.json
+
+`--distinct` limits the questions to the first N of the golden set, so more
+of them arrive while an identical one is in flight (peak-hour repeats). With
+`--llm-url` the fake LLM server's call count gives the upstream LLM calls
+per request. The service's answer cache persists, so remove `cache/` before
+a run for cold numbers.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import aiohttp
+import numpy as np
+
+GOLDEN_SET_PATH = os.path.join(os.path.dirname(__file__), "golden_set.jsonl")
+
+
+def _quantiles(values) -> dict:
+    if not values:
+        return {}
+    return {f"p{int(q * 100)}": round(float(np.quantile(values, q)), 3) for q in (0.5, 0.95, 0.99)}
+
+
+async def ask(session: aiohttp.ClientSession, url: str, question: str) -> dict:
+    started = time.perf_counter()
+    result = {"first_token": None, "coalesced": False, "cached": False}
+    async with session.post(f"{url}/query", json={"input": question, "messages": []}) as response:
+        if response.status != 200:
+            return {**result, "status": "rejected" if response.status == 503 else "error"}
+        async for line in response.content:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if "error" in event:
+                return {**result, "status": "error"}
+            if "answer" in event and result["first_token"] is None:
+                result["first_token"] = time.perf_counter() - started
+            if event.get("cached"):
+                result["cached"] = True
+            if event.get("done"):
+                result["coalesced"] = event["coalesced"]
+    return {**result, "status": "ok", "seconds": time.perf_counter() - started}
+
+
+async def _llm_calls(session: aiohttp.ClientSession, llm_url: str) -> int:
+    async with session.get(f"{llm_url}/stats") as response:
+        return (await response.json()).get("requests", 0)
+
+
+async def run(url: str, questions, users: int, total: int, llm_url: str = None, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    remaining = total
+    results = []
+
+    async def user(session):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            try:
+                results.append(await ask(session, url, rng.choice(questions)))
+            except aiohttp.ClientError:
+                results.append({"status": "error"})
+
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=users)) as session:
+        llm_before = await _llm_calls(session, llm_url) if llm_url else None
+        started = time.perf_counter()
+        await asyncio.gather(*(user(session) for _ in range(users)))
+        seconds = time.perf_counter() - started
+        llm_after = await _llm_calls(session, llm_url) if llm_url else None
+
+    ok = [r for r in results if r["status"] == "ok"]
+    statuses = Counter(r["status"] for r in results)
+    report = {
+        "users": users,
+        "requests": len(results),
+        "distinct_questions": len(set(questions)),
+        "seconds": round(seconds, 2),
+        "throughput_rps": round(len(ok) / seconds, 2),
+        "status": dict(statuses),
+        "latency_seconds": _quantiles([r["seconds"] for r in ok]),
+        "first_token_seconds": _quantiles([r["first_token"] for r in ok if r["first_token"] is not None]),
+        "coalesced": round(sum(r["coalesced"] for r in ok) / max(len(ok), 1), 4),
+        "cached": round(sum(r["cached"] for r in ok) / max(len(ok), 1), 4),
+    }
+    if llm_url:
+        report["llm_calls"] = llm_after - llm_before
+        report["llm_calls_per_request"] = round(report["llm_calls"] / max(len(ok), 1), 3)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="Query service")
+    parser.add_argument("--llm-url", help="Fake LLM server, to count upstream LLM calls")
+    parser.add_argument("--users", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Questions asked in total")
+    parser.add_argument("--distinct", type=int, help="Only ask the first N golden questions")
+    parser.add_argument("--golden-set", default=GOLDEN_SET_PATH)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    with open(args.golden_set) as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+    report = asyncio.run(run(args.url.rstrip("/"), questions[:args.distinct], args.users, args.requests,
+                             args.llm_url and args.llm_url.rstrip("/")))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
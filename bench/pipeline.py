@@ -0,0 +1,382 @@
+# bench/pipeline.py
+"""
+Offline pipeline benchmark: runs the golden question set through the chain from
+core/retrieval.py, with the deterministic StubChatModel standing in for Claude,
+and reports per-stage p50/p95 latency, recall@k / MRR of the retrieved chunks
+against the expected regulation ids, and peak memory. Questions answered by a
+direct regulation lookup are scored apart ("lookup_quality"): their candidates
+come from the same regulation map that defines relevance here.
+
+    python -m bench.pipeline --output pipeline.json
+    python -m bench.pipeline --baseline pipeline.json    # exit 1 on regressions
+    python -m bench.pipeline --policy fixed --output fixed.json   # vs. the adaptive default
+
+The "cost" section reports, per question, the cross-encoder pairs scored, the
+chunks passed to the answer prompt and the answer LLM's input tokens, which
+the retrieval policy (core/retrieval_policy.py) trades against quality.
+
+Stages (nested runs include their children):
+    rephrase              follow-up rewriting
+    query_constructor     self-query filter construction (inside retrieval)
+    retrieval             hybrid FAISS + BM25 search or direct regulation lookup
+    rerank                cross-encoder reranking of the retrieved candidates
+    retrieve_and_rerank   both, as the chain sees them (the speculative chain
+                          may skip the two above)
+    generate              answer generation (near zero with the stub)
+    total                 the whole chain call
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
+
+from domain.config import (
+    CHUNKER, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL, RERANKER_MODEL, RERANKER_BACKEND,
+    RERANKER_TOP_N, HYBRID_FETCH_K, RRF_K, RETRIEVAL_POLICY
+)
+from core.warmup import load_embeddings, load_index, load_reranker_model
+from core.stub_llm import StubChatModel
+from core.answer_cache import AnswerCache
+from core.reranker import RERANKER_STATS
+from core.retrieval import get_rag_chain
+from core.retrieval_policy import ADAPTIVE_STATS, RetrievalPolicy
+from core.telemetry import trace
+
+GOLDEN_SET_PATH = os.path.join(os.path.dirname(__file__), "golden_set.jsonl")
+
+# run name -> stage
+STAGE_RUNS = {
+    "rephrase_question": "rephrase",
+    "query_constructor": "query_constructor",
+    "HybridSelfQueryRetriever": "retrieval",
+    "ContextualCompressionRetriever": "rerank",
+    "retrieve_documents": "retrieve_and_rerank",
+    "answer_question": "generate",
+}
+STAGES = ["rephrase", "query_constructor", "retrieval", "rerank", "retrieve_and_rerank", "generate", "total"]
+
+
+class StageRecorder(BaseCallbackHandler):
+    """
+    Times the chain's named runs and keeps the documents the retrievers return.
+    With tracemalloc running it also tracks each stage's peak traced memory.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.documents: Dict[str, list] = {}
+        self.peak_bytes: Dict[str, int] = defaultdict(int)
+        self._open: Dict[UUID, tuple] = {}
+        self._lock = threading.Lock()
+        self._start_bytes = 0
+        if tracemalloc.is_tracing():
+            self._start_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+    def _memory(self):
+        # Fold the peak since the last event into the whole call and every open
+        # stage, then restart it
+        if not tracemalloc.is_tracing():
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes["total"] = max(self.peak_bytes["total"], peak - self._start_bytes)
+        for stage, _, start_bytes in self._open.values():
+            self.peak_bytes[stage] = max(self.peak_bytes[stage], peak - start_bytes)
+        tracemalloc.reset_peak()
+        return current
+
+    def _start(self, name, run_id):
+        stage = STAGE_RUNS.get(name)
+        if stage is None:
+            return
+        with self._lock:
+            current = self._memory()
+            self._open[run_id] = (stage, time.perf_counter(), current)
+
+    def _end(self, run_id, documents=None):
+        with self._lock:
+            if run_id not in self._open:
+                return
+            self._memory()
+            stage, started, _ = self._open.pop(run_id)
+            self.seconds[stage] += time.perf_counter() - started
+            if documents is not None:
+                self.documents[stage] = list(documents)
+
+    def finish(self):
+        """Fold in the memory used after the last stage ended."""
+        with self._lock:
+            self._memory()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, name=None, **kwargs):
+        self._start(name or (serialized or {}).get("name"), run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, name=None, **kwargs):
+        self._start(name or (serialized or {}).get("name"), run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+def load_golden_set(path: str = GOLDEN_SET_PATH) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _history(item: dict):
+    messages = []
+    for message in item.get("chat_history", []):
+        cls = HumanMessage if message["role"] == "user" else AIMessage
+        messages.append(cls(content=message["content"]))
+    return messages
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+# --- QUALITY ---
+def relevant_chunks(vectorstore, expected: List[str]) -> Dict[str, set]:
+    """expected regulation id -> chunk_ids belonging to it (from the regulation map)."""
+    return {regulation_id: set(vectorstore.regulation_map.chunks.get(regulation_id, [])) for regulation_id in expected}
+
+
+def recall_at_k(documents, relevant: Dict[str, set], k: int) -> float:
+    """Share of the expected regulations with at least one chunk in the top k."""
+    chunk_ids = {doc.metadata.get("chunk_id") for doc in documents[:k]}
+    return sum(bool(chunks & chunk_ids) for chunks in relevant.values()) / max(len(relevant), 1)
+
+
+def reciprocal_rank(documents, relevant: Dict[str, set]) -> float:
+    wanted = set().union(*relevant.values()) if relevant else set()
+    for rank, doc in enumerate(documents, start=1):
+        if doc.metadata.get("chunk_id") in wanted:
+            return 1.0 / rank
+    return 0.0
+
+
+# --- RUN ---
+def _invoke(chain, item, recorder, speculative):
+    inputs = {"input": item["question"], "chat_history": _history(item)}
+    config = {"callbacks": [recorder]}
+    started = time.perf_counter()
+    if speculative:
+        response = asyncio.run(chain.ainvoke(inputs, config=config))
+    else:
+        response = chain.invoke(inputs, config=config)
+    recorder.seconds["total"] = time.perf_counter() - started
+    recorder.finish()
+    # The compression retriever's time includes the search it wraps
+    recorder.seconds["rerank"] = max(recorder.seconds["rerank"] - recorder.seconds["retrieval"], 0.0)
+    return response
+
+
+def run(golden_set, repeats, ks, speculative, llm_latency, policy=RETRIEVAL_POLICY):
+    embeddings = load_embeddings()
+    vectorstore = load_index()
+    reranker_model = load_reranker_model()
+    llm = StubChatModel(latency=llm_latency)
+
+    cache_dir = tempfile.mkdtemp(prefix="bench-answers-")
+
+    def fresh_chain(name):
+        # A new chain (and empty answer cache) per pass, so no pass is served from cache
+        answer_cache = AnswerCache(embeddings, "bench", path=os.path.join(cache_dir, f"{name}.sqlite"))
+        return get_rag_chain(
+            speculative, embeddings=embeddings, vectorstore=vectorstore, llm=llm,
+            reranker_model=reranker_model, answer_cache=answer_cache, retrieval_policy=RetrievalPolicy(policy),
+        )
+
+    # Untimed pass: lazy model initialisation should not skew the first question
+    warmup_chain = fresh_chain("warmup")
+    _invoke(warmup_chain, golden_set[0], StageRecorder(), speculative)
+
+    latencies = defaultdict(list)
+    quality = {"search": defaultdict(list), "lookup": defaultdict(list)}
+    cost = defaultdict(list)
+    questions = []
+    adaptive_before = dict(ADAPTIVE_STATS)
+    for repeat in range(repeats):
+        chain = fresh_chain(f"pass-{repeat}")
+        for item in golden_set:
+            recorder = StageRecorder()
+            scored_before = RERANKER_STATS["scored_pairs"]
+            with trace() as question_trace:
+                response = _invoke(chain, item, recorder, speculative)
+            for stage in STAGES:
+                latencies[stage].append(recorder.seconds.get(stage, 0.0) * 1000)
+            if repeat:
+                continue
+
+            # Quality and cost are deterministic: measured on the first pass only
+            # (each pass starts with an empty reranker score cache)
+            relevant = relevant_chunks(vectorstore, item["expected"])
+            context = response["context"]
+            cost["reranked_pairs"].append(RERANKER_STATS["scored_pairs"] - scored_before)
+            cost["context_chunks"].append(len(context))
+            cost["answer_input_tokens"].append(question_trace.record()["tokens"].get("answer_llm", {}).get("input", 0))
+            ranked = [("rerank", context)]
+            if "retrieval" in recorder.documents:
+                # The speculative chain may answer without running the retriever
+                ranked.append(("retrieval", recorder.documents["retrieval"]))
+            # Direct lookups draw their candidates from the regulation map that also
+            # defines relevance here, so their recall is reported apart
+            route = "lookup" if question_trace.record()["events"].get("regulation_lookup", {}).get("direct") else "search"
+            scores = quality[route]
+            for stage, documents in ranked:
+                for k in ks:
+                    scores[f"{stage}_recall@{k}"].append(recall_at_k(documents, relevant, k))
+                scores[f"{stage}_mrr"].append(reciprocal_rank(documents, relevant))
+            questions.append({
+                "id": item["id"],
+                "expected": item["expected"],
+                "route": route,
+                "context_chunk_ids": [doc.metadata.get("chunk_id") for doc in context],
+                "rerank_mrr": scores["rerank_mrr"][-1],
+            })
+        if not repeat:
+            adaptive = {key: ADAPTIVE_STATS[key] - adaptive_before.get(key, 0) for key in ADAPTIVE_STATS}
+
+    # Separate pass for memory: tracemalloc slows everything down
+    tracemalloc.start()
+    peaks = defaultdict(list)
+    chain = fresh_chain("memory")
+    for item in golden_set:
+        recorder = StageRecorder()
+        _invoke(chain, item, recorder, speculative)
+        for stage, peak in recorder.peak_bytes.items():
+            peaks[stage].append(peak)
+    tracemalloc.stop()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {
+        "config": {
+            "chunker": CHUNKER,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embedding_model": EMBEDDING_MODEL,
+            "reranker_model": RERANKER_MODEL,
+            "reranker_backend": RERANKER_BACKEND,
+            "reranker_top_n": RERANKER_TOP_N,
+            "hybrid_fetch_k": HYBRID_FETCH_K,
+            "rrf_k": RRF_K,
+            "retrieval_policy": policy,
+            "speculative": speculative,
+            "llm_latency": llm_latency,
+            "chunks": vectorstore.n_rows,
+        },
+        "questions": len(golden_set),
+        "repeats": repeats,
+        "stages": {},
+        # Questions answered by hybrid search; direct regulation lookups separately
+        "quality": {name: round(float(np.mean(values)), 4) for name, values in quality["search"].items()},
+        "lookup_quality": {name: round(float(np.mean(values)), 4) for name, values in quality["lookup"].items()},
+        "routes": {route: len(scores["rerank_mrr"]) for route, scores in quality.items()},
+        "cost": {
+            **{f"{name}_mean": round(float(np.mean(values)), 2) for name, values in cost.items()},
+            **{f"{name}_p95": round(_percentile(values, 95), 2) for name, values in cost.items()},
+            # Early exits and trimmed contexts over the golden set
+            "adaptive": adaptive,
+        },
+        "memory": {
+            # Python / NumPy heap only (tracemalloc does not see torch's allocator)
+            "peak_traced_mb": {stage: round(max(values) / 2**20, 2) for stage, values in peaks.items()},
+            "max_rss_mb": _max_rss_mb(),
+        },
+        "per_question": questions,
+    }
+    for stage in STAGES:
+        report["stages"][stage] = {
+            "p50_ms": round(_percentile(latencies[stage], 50), 2),
+            "p95_ms": round(_percentile(latencies[stage], 95), 2),
+        }
+    return report
+
+
+def _max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # KiB on Linux, bytes on macOS
+    divisor = 2**20 if sys.platform == "darwin" else 2**10
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+# --- REGRESSIONS ---
+def compare(report: dict, baseline: dict, latency_tolerance: float, quality_tolerance: float,
+            cost_tolerance: float) -> List[str]:
+    """Human-readable regressions of `report` against `baseline`."""
+    regressions = []
+    for stage, timings in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95_ms")
+        # Sub-millisecond stages are all noise
+        if before and before >= 1.0 and timings["p95_ms"] > before * (1 + latency_tolerance):
+            regressions.append(f"{stage} p95 {before} ms -> {timings['p95_ms']} ms")
+    for section, label in (("quality", ""), ("lookup_quality", "lookup ")):
+        for name, value in report.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if before is not None and value < before - quality_tolerance:
+                regressions.append(f"{label}{name} {before} -> {value}")
+    # Reranked pairs, context chunks and answer input tokens per question
+    for name, value in report.get("cost", {}).items():
+        before = baseline.get("cost", {}).get(name)
+        if name.endswith("_mean") and before and value > before * (1 + cost_tolerance):
+            regressions.append(f"{name} {before} -> {value}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden-set", default=GOLDEN_SET_PATH)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the golden set (at least 1)")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, RERANKER_TOP_N], help="Cut-offs for recall@k")
+    parser.add_argument("--speculative", action="store_true", help="Benchmark the async speculative chain")
+    parser.add_argument("--policy", choices=["adaptive", "fixed"], default=RETRIEVAL_POLICY,
+                        help="Retrieval policy (default RETRIEVAL_POLICY)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM sleeps per call")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="Earlier report to check for regressions (exit 1 if any)")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="Allowed relative p95 increase")
+    parser.add_argument("--quality-tolerance", type=float, default=0.02, help="Allowed absolute recall / MRR drop")
+    parser.add_argument("--cost-tolerance", type=float, default=0.1, help="Allowed relative increase of a mean cost")
+    args = parser.parse_args()
+    # Quality and cost are measured on the first timed pass
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    report = run(load_golden_set(args.golden_set), args.repeats, args.k, args.speculative, args.llm_latency, args.policy)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.latency_tolerance, args.quality_tolerance,
+                                  args.cost_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
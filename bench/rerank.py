@@ -0,0 +1,100 @@
+# bench/rerank.py
+"""
+Reranker backend benchmark: latency and top-N agreement against the
+full-precision torch model, on the local FAISS index (CPU only).
+
+    python -m bench.rerank --backends torch int8 onnx --output rerank.json
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from domain.config import EMBEDDING_MODEL, RERANKER_MODEL, RERANKER_BATCH_SIZE, RERANKER_MAX_LENGTH, RERANKER_TOP_N
+from core.vectorstore import load_vectorstore
+from core.reranker import FastCrossEncoder, BACKENDS
+
+QUESTIONS = [
+    "What is the base FSI for residential buildings in the Island City?",
+    "Explain Regulation 33(7) for cessed buildings.",
+    "What are the side margins for a building on a 12 m road?",
+    "What is a habitable room?",
+    "How is TDR loaded on plots in the suburbs?",
+    "What incentive FSI is allowed under 33(10) slum rehabilitation?",
+    "What is the fungible compensatory area for commercial buildings?",
+    "Minimum plot area for cluster redevelopment under 33(9)?",
+    "Parking requirements for residential buildings",
+    "What does Table 12 say about road width and FSI?",
+]
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run(backends, pool_size, top_n, batch_size, max_length, repeats):
+    vectorstore = load_vectorstore(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL))
+    pools = [(q, vectorstore.similarity_search(q, k=pool_size)) for q in QUESTIONS]
+
+    rankings, report = {}, {
+        "model": RERANKER_MODEL,
+        "pool_size": pool_size,
+        "top_n": top_n,
+        "batch_size": batch_size,
+        "max_length": max_length,
+        "backends": {},
+    }
+    for backend in backends:
+        started = time.perf_counter()
+        model = FastCrossEncoder(backend=backend, batch_size=batch_size, max_length=max_length)
+        load_seconds = time.perf_counter() - started
+
+        # One untimed pass so lazy initialisation does not skew the first query
+        model.score([(QUESTIONS[0], pools[0][1][0].page_content)])
+
+        latencies, rankings[backend] = [], []
+        for question, docs in pools:
+            pairs = [(question, doc.page_content) for doc in docs]
+            for _ in range(repeats):
+                started = time.perf_counter()
+                scores = model.score(pairs)
+                latencies.append((time.perf_counter() - started) * 1000)
+            rankings[backend].append(list(np.argsort(scores)[::-1][:top_n]))
+
+        report["backends"][backend] = {
+            "load_seconds": round(load_seconds, 3),
+            "rerank_ms_p50": round(_percentile(latencies, 50), 2),
+            "rerank_ms_p95": round(_percentile(latencies, 95), 2),
+        }
+
+    # Agreement is measured against the full-precision torch ranking
+    if "torch" in rankings:
+        for backend in backends:
+            overlap = [
+                len(set(a) & set(b)) / top_n
+                for a, b in zip(rankings["torch"], rankings[backend])
+            ]
+            exact = [a == b for a, b in zip(rankings["torch"], rankings[backend])]
+            report["backends"][backend][f"top{top_n}_overlap"] = round(float(np.mean(overlap)), 4)
+            report["backends"][backend][f"top{top_n}_same_order"] = round(float(np.mean(exact)), 4)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--pool-size", type=int, default=20, help="Candidates scored per question")
+    parser.add_argument("--top-n", type=int, default=RERANKER_TOP_N)
+    parser.add_argument("--batch-size", type=int, default=RERANKER_BATCH_SIZE)
+    parser.add_argument("--max-length", type=int, default=RERANKER_MAX_LENGTH)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run(args.backends, args.pool_size, args.top_n, args.batch_size, args.max_length, args.repeats)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
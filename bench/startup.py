@@ -0,0 +1,89 @@
+# bench/startup.py
+"""
+Startup benchmark: cold import time of the heavy modules and time to a ready
+RAG chain, background warm-up (core.warmup) vs. loading everything in turn.
+Every measurement runs in a fresh interpreter so nothing is already imported.
+
+    python -m bench.startup --output startup.json
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+MODULES = [
+    "core.warmup",                     # All app.py imports before the login page renders
+    "faiss",
+    "langchain_anthropic",
+    "sentence_transformers",
+    "core.vectorstore",
+    "core.retrieval",
+]
+
+
+def _child(code: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    # The report is the last line; loaders print progress before it
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_seconds(module: str) -> float:
+    code = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started}))\n"
+    )
+    return round(_child(code)["seconds"], 3)
+
+
+def warmup_report() -> dict:
+    code = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        "from core.warmup import WARMUP\n"
+        "WARMUP.start()\n"
+        "visible = time.perf_counter() - started\n"
+        "WARMUP.wait()\n"
+        "report = dict(WARMUP.report, total_seconds=time.perf_counter() - started, login_visible_seconds=visible)\n"
+        "print(json.dumps(report))\n"
+    )
+    return _child(code)
+
+
+def sequential_seconds() -> float:
+    code = (
+        "import json, time\n"
+        "started = time.perf_counter()\n"
+        "from core.retrieval import get_rag_chain\n"
+        "get_rag_chain()\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started}))\n"
+    )
+    return round(_child(code)["seconds"], 3)
+
+
+def run(repeats):
+    report = {
+        "imports": {module: min(import_seconds(module) for _ in range(repeats)) for module in MODULES},
+        "warmup": [warmup_report() for _ in range(repeats)],
+        "sequential_seconds": [sequential_seconds() for _ in range(repeats)],
+    }
+    totals = [warmup["total_seconds"] for warmup in report["warmup"]]
+    report["warmup_total_seconds_min"] = round(min(totals), 3)
+    report["sequential_seconds_min"] = min(report["sequential_seconds"])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run(args.repeats)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
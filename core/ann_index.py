@@ -0,0 +1,141 @@
+# core/ann_index.py
+import os
+import json
+import math
+from typing import Optional
+
+import numpy as np
+import faiss
+
+from domain.config import (
+    FAISS_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, IVF_NLIST, IVF_NPROBE,
+    PQ_M, PQ_NBITS, ANN_INDEX_FILE, ANN_EXACT_FILTER_SHARE
+)
+from core.docstore import FAISS_FILE, write_index
+
+# index type -> faiss.index_factory template. Only types that accept an
+# IDSelector, since every filtered search is a pre-filtered one (IndexPQ is not)
+INDEX_TYPES = {
+    "flat": "Flat",
+    "hnsw": "HNSW{m}",
+    "hnsw_sq8": "HNSW{m},SQ8",
+    "sq8": "SQ8",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}x{pq_nbits}",
+}
+
+_MIN_POINTS_PER_LIST = 39   # faiss' k-means guideline
+
+
+def index_spec(index_type: str, n: int) -> str:
+    """The faiss.index_factory string for `index_type` over `n` vectors (IVF / PQ sizes adapt to small corpora)."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}; expected one of {sorted(INDEX_TYPES)}.")
+    nlist = IVF_NLIST or int(4 * math.sqrt(n))
+    return INDEX_TYPES[index_type].format(
+        m=HNSW_M,
+        nlist=max(1, min(nlist, n // _MIN_POINTS_PER_LIST)),
+        pq_m=PQ_M,
+        # 2**nbits centroids per sub-quantizer need at least as many training points
+        pq_nbits=max(1, min(PQ_NBITS, int(math.log2(max(n, 2))))),
+    )
+
+
+def configure(index, ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE):
+    """Applies the search-time knobs (HNSW efSearch, IVF nprobe) from domain.config."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    return index
+
+
+def search_parameters(index, selector=None):
+    """SearchParameters of the right subtype for `index` (IVF indexes reject the base class)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def filtered_index(index, exact_index, allowed: int):
+    """
+    The index for a search pre-filtered to `allowed` rows: the exact one when
+    the filter keeps at most ANN_EXACT_FILTER_SHARE of them. HNSW / IVF miss
+    neighbours when few rows pass, and exact search over those few is cheap.
+    """
+    if exact_index is not None and allowed <= ANN_EXACT_FILTER_SHARE * index.ntotal:
+        return exact_index
+    return index
+
+
+def build_index(vectors: np.ndarray, index_type: str, metric=faiss.METRIC_L2):
+    """An `index_type` index over `vectors`, in the same row order (rows stay FAISS ids)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], index_spec(index_type, len(vectors)), metric)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure(index)
+
+
+def exact_vectors(index) -> np.ndarray:
+    """All vectors of an exact (flat) index, in row order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _meta_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _stamp(exact_path: str) -> str:
+    stat = os.stat(exact_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def save_ann_index(flat_index, folder_path: str, index_type: str = FAISS_INDEX_TYPE):
+    """
+    Builds and saves the serving index in `folder_path`, next to the exact one
+    (which ingestion keeps for incremental updates and as the recall baseline).
+    With index_type "flat" any old one is removed.
+    """
+    path, exact_path = os.path.join(folder_path, ANN_INDEX_FILE), os.path.join(folder_path, FAISS_FILE)
+    if index_type == "flat":
+        for stale in (path, _meta_path(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        return None
+    index = build_index(exact_vectors(flat_index), index_type, flat_index.metric_type)
+    # Renamed into place: serving processes may have the old one mapped
+    write_index(index, path)
+    with open(_meta_path(path) + ".tmp", "w") as f:
+        json.dump({"index_type": index_type, "spec": index_spec(index_type, flat_index.ntotal),
+                   "exact_index": _stamp(exact_path)}, f)
+    os.replace(_meta_path(path) + ".tmp", _meta_path(path))
+    return index
+
+
+def load_ann_index(flat_index, folder_path: str, index_type: str = FAISS_INDEX_TYPE) -> Optional[object]:
+    """
+    The serving index for `index_type`: the one saved in `folder_path` if it was
+    built from the exact index there as it is now, else one built in memory
+    from it. None for "flat" (serve the exact index).
+    """
+    if index_type == "flat":
+        return None
+    path, exact_path = os.path.join(folder_path, ANN_INDEX_FILE), os.path.join(folder_path, FAISS_FILE)
+    meta = {}
+    if os.path.exists(_meta_path(path)):
+        with open(_meta_path(path)) as f:
+            meta = json.load(f)
+    fresh = meta.get("spec") == index_spec(index_type, flat_index.ntotal) and meta.get("exact_index") == _stamp(exact_path)
+    if fresh and os.path.exists(path):
+        return configure(faiss.read_index(path))
+    print(f"{index_type} index missing or stale, building from the exact index...")
+    return build_index(exact_vectors(flat_index), index_type, flat_index.metric_type)
@@ -0,0 +1,231 @@
+# core/answer_cache.py
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+from contextlib import closing
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.runnables.utils import AddableDict
+
+from domain.config import (
+    ANSWER_CACHE_PATH, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY
+)
+from core.telemetry import TracedCounter, span
+
+# Answer cache hits / misses (per process)
+ANSWER_CACHE_STATS = TracedCounter("answer_cache")
+
+
+def index_fingerprint(*index_dirs: str) -> str:
+    """Changes whenever any file of the vector store (any of its shards) is rewritten."""
+    digest = hashlib.sha256()
+    for index_dir in index_dirs:
+        for root, dirs, files in os.walk(index_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, index_dir)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def _normalize(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+def cache_key(question: str, structured_query, rules=None) -> str:
+    """
+    What a cached answer must match exactly: the resolved filter, the
+    regulations / tables the question names (direct lookups bypass the
+    filter) and every number in it, so "33(7)" never serves "33(9)" and
+    "12 m road" never serves "18 m road" however similar the embeddings.
+    """
+    regulation_ids = sorted(rules.regulation_ids(question)) if rules is not None else []
+    numbers = sorted(set(re.findall(r"\d+(?:\.\d+)?", question.replace(",", ""))))
+    return f"{structured_query.filter!r}|{','.join(regulation_ids)}|{','.join(numbers)}"
+
+
+class AnswerCache:
+    """
+    Persistent (SQLite) cache of final answers.
+
+    Entries are keyed by `cache_key` (resolved metadata filter, named
+    regulations and numbers) and matched on the standalone question: first
+    exactly, then by cosine similarity of its embedding against the other
+    entries with the same key.
+    The whole cache is dropped when the FAISS index fingerprint changes.
+    """
+
+    def __init__(self, embeddings, fingerprint: str, path: str = ANSWER_CACHE_PATH,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.embeddings = embeddings
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity = similarity
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " filter_key TEXT NOT NULL,"
+                " question TEXT NOT NULL,"
+                " embedding BLOB NOT NULL,"
+                " answer TEXT NOT NULL,"
+                " chunk_ids TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_hit REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answers_filter ON answers (filter_key, question)")
+
+            row = conn.execute("SELECT value FROM meta WHERE key = 'index_fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                if row is not None:
+                    print("Vector store was rebuilt, clearing answer cache...")
+                conn.execute("DELETE FROM answers")
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_fingerprint', ?)",
+                    (fingerprint,),
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _embed(self, question: str) -> np.ndarray:
+        with span("embedding", source="answer_cache"):
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question: str, filter_key: str) -> Optional[Tuple[str, List]]:
+        """Returns (answer, chunk_ids) for a live matching entry, else None."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+
+            row = conn.execute(
+                "SELECT id, answer, chunk_ids FROM answers WHERE filter_key = ? AND question = ?",
+                (filter_key, _normalize(question)),
+            ).fetchone()
+
+            if row is None:
+                rows = conn.execute(
+                    "SELECT id, answer, chunk_ids, embedding FROM answers WHERE filter_key = ?",
+                    (filter_key,),
+                ).fetchall()
+                if not rows:
+                    return None
+                matrix = np.stack([np.frombuffer(r[3], dtype=np.float32) for r in rows])
+                scores = matrix @ self._embed(question)
+                best = int(np.argmax(scores))
+                if scores[best] < self.similarity:
+                    return None
+                row = rows[best][:3]
+
+            conn.execute("UPDATE answers SET last_hit = ? WHERE id = ?", (now, row[0]))
+            return row[1], json.loads(row[2])
+
+    def store(self, question: str, filter_key: str, answer: str, chunk_ids: List):
+        now = time.time()
+        embedding = self._embed(question).tobytes()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM answers WHERE filter_key = ? AND question = ?",
+                (filter_key, _normalize(question)),
+            )
+            conn.execute(
+                "INSERT INTO answers (filter_key, question, embedding, answer, chunk_ids, created, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filter_key, _normalize(question), embedding, answer, json.dumps(chunk_ids), now, now),
+            )
+            # Size bound: drop the least recently hit entries
+            conn.execute(
+                "DELETE FROM answers WHERE id NOT IN"
+                " (SELECT id FROM answers ORDER BY last_hit DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+def with_answer_cache(chain, answer_cache: AnswerCache, query_constructor, vectorstore, rules=None):
+    """
+    Put `answer_cache` in front of `chain` (which expects `standalone_question`).
+    A hit returns the stored answer and source chunks without running retrieval,
+    reranking or generation; a miss runs `chain` and stores its result.
+    Follow-ups (non-empty `chat_history`, which the answer prompt sees) bypass it.
+    """
+
+    def _resolve(inputs: dict, structured_query):
+        question = inputs["standalone_question"]
+        filter_key = cache_key(question, structured_query, rules)
+
+        hit = answer_cache.lookup(question, filter_key)
+        if hit is not None:
+            ANSWER_CACHE_STATS["hit"] += 1
+            answer, chunk_ids = hit
+            return {
+                **inputs,
+                "context": vectorstore.get_by_chunk_ids(chunk_ids),
+                "answer": answer,
+                "cached": True,
+            }
+
+        ANSWER_CACHE_STATS["miss"] += 1
+
+        def _store(response: dict):
+            if response.get("answer"):
+                chunk_ids = [
+                    doc.metadata["chunk_id"] for doc in response.get("context", [])
+                    if "chunk_id" in doc.metadata
+                ]
+                answer_cache.store(question, filter_key, response["answer"], chunk_ids)
+
+        # Pass chunks straight through so answer tokens still stream,
+        # and store the aggregated response once the stream ends.
+        # Token deltas are AddableDicts, so `+=` concatenates the answer
+        def _store_stream(chunks):
+            response = AddableDict()
+            for chunk in chunks:
+                response += AddableDict(chunk)
+                yield AddableDict(chunk)
+            _store(response)
+            yield AddableDict(cached=False)
+
+        async def _astore_stream(chunks):
+            response = AddableDict()
+            async for chunk in chunks:
+                response += AddableDict(chunk)
+                yield AddableDict(chunk)
+            _store(response)
+            yield AddableDict(cached=False)
+
+        return chain | RunnableGenerator(_store_stream, _astore_stream, name="store_answer")
+
+    def _route(inputs: dict, config=None):
+        if inputs.get("chat_history"):
+            ANSWER_CACHE_STATS["bypass"] += 1
+            return chain
+        # Under this run, so a self-query LLM call made here is traced with the request
+        structured_query = query_constructor.invoke({"query": inputs["standalone_question"]}, config=config)
+        return _resolve(inputs, structured_query)
+
+    async def _aroute(inputs: dict, config=None):
+        if inputs.get("chat_history"):
+            ANSWER_CACHE_STATS["bypass"] += 1
+            return chain
+        # The self-query LLM call is awaited rather than holding an executor thread;
+        # only the embedding and SQLite lookup run on one
+        structured_query = await query_constructor.ainvoke({"query": inputs["standalone_question"]}, config=config)
+        return await run_in_executor(config, _resolve, inputs, structured_query)
+
+    return RunnableLambda(_route, afunc=_aroute, name="answer_cache")
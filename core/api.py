@@ -0,0 +1,124 @@
+# core/api.py
+# Wire format of the query service (core/service.py) and its HTTP client.
+# Light like core.warmup: the thin Streamlit client imports it without LangChain.
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from domain.config import SERVICE_TIMEOUT, SOURCE_SNIPPET_CHARS, SNIPPET_CACHE_SIZE
+from core.cache import LRUCache
+
+# chunk_id -> snippet, shared by every session in the process
+SNIPPETS = LRUCache(SNIPPET_CACHE_SIZE)
+
+
+# --- WIRE FORMAT ---
+def source_records(docs) -> List[Dict]:
+    """The retrieved chunks as streamed to the app: references plus a snippet to show."""
+    return [
+        {
+            "chunk_id": doc.metadata.get("chunk_id"),
+            "corpus": doc.metadata.get("corpus"),
+            "regulation_id": doc.metadata.get("regulation_id", "N/A"),
+            "page": doc.metadata.get("page_number", "N/A"),
+            "snippet": doc.page_content[:SOURCE_SNIPPET_CHARS],
+        }
+        for doc in docs
+    ]
+
+
+def source_refs(records: Iterable[Dict]) -> List[Dict]:
+    """
+    What a chat message keeps of its sources: the snippet goes to the shared
+    cache and only the chunk_id reference is stored (chunks without one keep
+    their snippet).
+    """
+    refs = []
+    for record in records:
+        if record.get("chunk_id") is None:
+            refs.append(record)
+            continue
+        SNIPPETS.put(record["chunk_id"], record["snippet"])
+        refs.append({key: value for key, value in record.items() if key != "snippet"})
+    return refs
+
+
+def docstore_snippets(vectorstore, chunk_ids: Iterable[int]) -> Dict[int, str]:
+    return {
+        doc.metadata["chunk_id"]: doc.page_content[:SOURCE_SNIPPET_CHARS]
+        for doc in vectorstore.get_by_chunk_ids(list(chunk_ids))
+    }
+
+
+def source_snippets(refs: Iterable[Dict], fetch: Callable[[List[int]], Dict[int, str]]) -> List[str]:
+    """The snippet of each source, from the record, the shared cache or `fetch(missing chunk_ids)`."""
+    refs = list(refs)
+    missing = [ref["chunk_id"] for ref in refs
+               if "snippet" not in ref and ref.get("chunk_id") is not None and ref["chunk_id"] not in SNIPPETS]
+    if missing:
+        for chunk_id, snippet in fetch(missing).items():
+            SNIPPETS.put(chunk_id, snippet)
+    return [ref.get("snippet") or SNIPPETS.get(ref.get("chunk_id"), "") for ref in refs]
+
+
+def chain_events(chunks: Iterable[dict]) -> Iterator[Dict]:
+    """
+    RAG chain stream chunks -> service events:
+    {"sources": [...]}, then {"answer": "<delta>"} per token, and {"cached": true} on a cache hit.
+    """
+    for chunk in chunks:
+        if "context" in chunk:
+            yield {"sources": source_records(chunk["context"])}
+        if chunk.get("answer"):
+            yield {"answer": chunk["answer"]}
+        if chunk.get("cached"):
+            yield {"cached": True}
+
+
+def history_messages(records: Iterable[Dict]) -> list:
+    """App chat messages ({"role", "content"}) -> LangChain messages."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    messages = []
+    for record in records:
+        if record["role"] == "user":
+            messages.append(HumanMessage(content=record["content"]))
+        elif record["role"] == "assistant":
+            messages.append(AIMessage(content=record["content"]))
+    return messages
+
+
+# --- CLIENT ---
+def stream_query(url: str, question: str, messages: Iterable[Dict], memory: Optional[Dict] = None,
+                 session_id: Optional[str] = None, timeout: float = SERVICE_TIMEOUT) -> Iterator[Dict]:
+    """
+    POSTs a question to the service's /query and yields its events as they
+    stream in, ending with {"done": true, "memory": ..., "coalesced": ..., "trace": ...}.
+    Raises RuntimeError for an error reported mid-stream.
+    """
+    import requests
+
+    payload = {
+        "input": question,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "memory": memory,
+        "session_id": session_id,
+    }
+    with requests.post(f"{url.rstrip('/')}/query", json=payload, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            yield event
+
+
+def fetch_snippets(url: str, chunk_ids: Iterable[int], timeout: float = SERVICE_TIMEOUT) -> Dict[int, str]:
+    """Snippets of `chunk_ids` from the service's /sources."""
+    import requests
+
+    response = requests.get(f"{url.rstrip('/')}/sources", params={"chunk_ids": ",".join(map(str, chunk_ids))},
+                            timeout=timeout)
+    response.raise_for_status()
+    return {int(chunk_id): snippet for chunk_id, snippet in response.json().items()}
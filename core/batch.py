@@ -0,0 +1,271 @@
+# core/batch.py
+"""
+Offline batch question answering: runs every question of a JSONL file through
+get_rag_chain() and streams the answers to an output JSONL.
+
+    python -m core.batch checklist.jsonl --output answers.jsonl
+    python -m core.batch checklist.jsonl --output answers.jsonl --rpm 200 --concurrency 32
+
+Input lines are {"question": ..., "id": ..., "chat_history": [{"role", "content"}]}
+("id" defaults to the line number, "chat_history" to none); any other fields,
+e.g. the plot a checklist item is about, are copied to the output line. Each
+output line adds "answer", "sources" (as in core.api), "cached", "attempts"
+and "seconds", or "error" once a question has failed BATCH_MAX_RETRIES times.
+
+Up to BATCH_CONCURRENCY questions run at once on the chain's async path, so
+throughput is set by the LLM rate limit rather than by serial round-trips:
+LLM calls share one request-rate limiter (BATCH_LLM_REQUESTS_PER_MINUTE) and
+a failed question is retried with exponential backoff. The blocking stages
+of the questions in flight are gathered into shared model calls: query
+embeddings into one embed_documents batch, cross-encoder pairs into one
+scoring batch (MicroBatcher).
+
+The output file is the checkpoint: answers are flushed as they finish, and a
+re-run skips the ids already answered there (failed ones are retried).
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_community.cross_encoders import BaseCrossEncoder
+
+from domain.config import (
+    BATCH_CONCURRENCY, BATCH_LLM_REQUESTS_PER_MINUTE, BATCH_LLM_BURST, BATCH_MAX_RETRIES,
+    BATCH_BACKOFF_SECONDS, BATCH_BACKOFF_MAX_SECONDS, BATCH_EMBED_MAX_BATCH, BATCH_RERANK_MAX_PAIRS,
+    BATCH_MAX_WAIT_SECONDS
+)
+from core.api import history_messages, source_records
+from core.telemetry import TracedCounter, trace
+from core.warmup import load_embeddings, load_index, load_llm, load_reranker_model
+
+# Model calls made by the questions vs. batched calls actually run (per process)
+MICRO_BATCH_STATS = TracedCounter("micro_batch")
+
+
+# --- MICRO-BATCHING ---
+class MicroBatcher:
+    """
+    Gathers the calls that concurrent threads make within `max_wait` seconds
+    into one `fn(items) -> results` call of at most about `max_batch` items.
+    The first caller of a batch runs it; the others wait for their slice.
+    """
+
+    def __init__(self, name: str, fn: Callable[[list], list], max_batch: int,
+                 max_wait: float = BATCH_MAX_WAIT_SECONDS):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[list, Future]] = []
+        self._size = 0
+        self._changed = threading.Condition()
+
+    def __call__(self, items: list) -> list:
+        if not items:
+            return []
+        future = Future()
+        with self._changed:
+            self._pending.append((items, future))
+            self._size += len(items)
+            leader = len(self._pending) == 1
+            self._changed.notify_all()
+        if leader:
+            self._run_batch()
+        return future.result()
+
+    def _run_batch(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self._size >= self.max_batch, timeout=self.max_wait)
+            batch, self._pending, self._size = self._pending, [], 0
+        MICRO_BATCH_STATS[f"{self.name}_calls"] += len(batch)
+        MICRO_BATCH_STATS[f"{self.name}_batches"] += 1
+        try:
+            results = self.fn([item for items, _ in batch for item in items])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for items, future in batch:
+            future.set_result(results[start:start + len(items)])
+            start += len(items)
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Query embeddings of concurrent questions computed as one embed_documents
+    batch (HuggingFaceEmbeddings embeds queries and documents alike).
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int = BATCH_EMBED_MAX_BATCH):
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher("embedding", embeddings.embed_documents, max_batch)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher([text])[0]
+
+
+class BatchedCrossEncoder(BaseCrossEncoder):
+    """The (question, chunk) pairs of concurrent reranks scored as one cross-encoder batch."""
+
+    def __init__(self, model: BaseCrossEncoder, max_pairs: int = BATCH_RERANK_MAX_PAIRS):
+        self.model = model
+        self.batcher = MicroBatcher("rerank", model.score, max_pairs)
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        return self.batcher(list(text_pairs))
+
+
+# --- CHECKPOINT ---
+def read_questions(path: str) -> List[Dict]:
+    questions = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "question" not in record:
+                raise ValueError(f"{path}:{number}: expected a \"question\" field.")
+            record.setdefault("id", number)
+            questions.append(record)
+    return questions
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict]:
+    """
+    id -> answered record of an earlier run's output, which is rewritten
+    without its failed and truncated lines so their questions run again.
+    """
+    if not os.path.exists(path):
+        return {}
+    answered = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run
+                continue
+            if "error" not in record:
+                answered[str(record["id"])] = record
+    with open(path + ".tmp", "w") as f:
+        for record in answered.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(path + ".tmp", path)
+    return answered
+
+
+# --- RUNNER ---
+def backoff_seconds(attempt: int, base: float = BATCH_BACKOFF_SECONDS,
+                    cap: float = BATCH_BACKOFF_MAX_SECONDS) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def answer_question(chain, record: Dict, slots: asyncio.Semaphore,
+                          max_retries: int = BATCH_MAX_RETRIES) -> Dict:
+    """The output record for one input record, retrying failed runs with backoff."""
+    inputs = {"input": record["question"], "chat_history": history_messages(record.get("chat_history") or [])}
+    fields = {key: value for key, value in record.items() if key != "chat_history"}
+    started = time.perf_counter()
+    for attempt in range(1, max_retries + 2):
+        try:
+            async with slots:
+                with trace(question_id=record["id"]):
+                    response = await chain.ainvoke(inputs)
+            return {
+                **fields,
+                "answer": response["answer"],
+                "sources": source_records(response.get("context", [])),
+                "cached": bool(response.get("cached")),
+                "attempts": attempt,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+        except Exception as e:
+            if attempt > max_retries:
+                return {**fields, "error": f"{type(e).__name__}: {e}", "attempts": attempt}
+            delay = backoff_seconds(attempt)
+            print(f"Question {record['id']} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+
+def build_batch_chain(requests_per_minute: float = BATCH_LLM_REQUESTS_PER_MINUTE, burst: int = BATCH_LLM_BURST):
+    """
+    get_rag_chain() with micro-batched embedder / cross-encoder and a
+    rate-limited LLM. Speculative retrieval is left off: it trades extra CPU
+    for single-question latency, and a batch is bound by throughput.
+    """
+    from core.retrieval import get_rag_chain
+
+    llm = load_llm()
+    if requests_per_minute:
+        llm.rate_limiter = InMemoryRateLimiter(
+            requests_per_second=requests_per_minute / 60, check_every_n_seconds=0.05, max_bucket_size=burst,
+        )
+    return get_rag_chain(
+        embeddings=BatchedEmbeddings(load_embeddings()),
+        vectorstore=load_index(),
+        llm=llm,
+        reranker_model=BatchedCrossEncoder(load_reranker_model()),
+    )
+
+
+async def run_batch(chain, questions: List[Dict], output_path: str,
+                    concurrency: int = BATCH_CONCURRENCY) -> Dict[str, int]:
+    """Answers `questions`, appending each result to `output_path` as it finishes."""
+    loop = asyncio.get_running_loop()
+    # One thread per question in flight, so their blocking stages can meet in a batch
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-cpu"))
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"answered": 0, "failed": 0, "cached": 0}
+
+    with open(output_path, "a") as f:
+        tasks = [asyncio.create_task(answer_question(chain, record, slots)) for record in questions]
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            counts["failed" if "error" in result else "answered"] += 1
+            counts["cached"] += bool(result.get("cached"))
+            done = counts["answered"] + counts["failed"]
+            if done % 10 == 0 or done == len(questions):
+                print(f"{done}/{len(questions)} questions done ({counts['failed']} failed)")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("--output", required=True, help="JSONL answers file (resumed if it exists)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Questions in flight")
+    parser.add_argument("--rpm", type=float, default=BATCH_LLM_REQUESTS_PER_MINUTE,
+                        help="LLM requests per minute (0 = unlimited)")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    answered = load_checkpoint(args.output)
+    pending = [record for record in questions if str(record["id"]) not in answered]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered in {args.output}.")
+
+    if pending:
+        chain = build_batch_chain(args.rpm)
+        started = time.perf_counter()
+        counts = asyncio.run(run_batch(chain, pending, args.output, args.concurrency))
+        seconds = time.perf_counter() - started
+        print(json.dumps({
+            **counts,
+            "seconds": round(seconds, 1),
+            "questions_per_minute": round(60 * len(pending) / seconds, 1),
+            "micro_batches": dict(MICRO_BATCH_STATS),
+        }, indent=2))
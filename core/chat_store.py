@@ -0,0 +1,142 @@
+# core/chat_store.py
+import os
+import json
+import time
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Tuple
+
+from domain.config import CHAT_STORE_PATH, CHAT_STORE_TTL_SECONDS, SESSION_MAX_CHATS, CHAT_MAX_MESSAGES
+
+
+class ChatStore:
+    """
+    Local SQLite spill area for the Streamlit chat state, so a session's
+    `st.session_state` stays the same size however long the tab is open.
+
+    A chat's messages live at fixed positions: the first `chat["spilled"]`
+    are here, the rest in the session. Whole chats that are spilled keep their
+    metadata (title, conversation memory) here until they are opened again.
+    Every access marks the session as seen; all rows of a session not seen
+    for `ttl_seconds` (an abandoned one) are deleted, however old they are.
+    """
+
+    def __init__(self, path: str = CHAT_STORE_PATH, ttl_seconds: float = CHAT_STORE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                " session_id TEXT NOT NULL, chat_id TEXT NOT NULL, title TEXT NOT NULL,"
+                " chat TEXT NOT NULL, updated REAL NOT NULL,"
+                " PRIMARY KEY (session_id, chat_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " session_id TEXT NOT NULL, chat_id TEXT NOT NULL, position INTEGER NOT NULL,"
+                " message TEXT NOT NULL, updated REAL NOT NULL,"
+                " PRIMARY KEY (session_id, chat_id, position))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, seen REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _seen(self, conn, session_id: str):
+        conn.execute("INSERT OR REPLACE INTO sessions (session_id, seen) VALUES (?, ?)", (session_id, time.time()))
+
+    def _write_messages(self, conn, session_id: str, chat_id: str, start: int, messages: List[Dict]):
+        now = time.time()
+        self._seen(conn, session_id)
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages (session_id, chat_id, position, message, updated) VALUES (?, ?, ?, ?, ?)",
+            [(session_id, chat_id, start + i, json.dumps(message), now) for i, message in enumerate(messages)],
+        )
+        # Expire by session: the spilled rows of an open chat are written once and never rewritten
+        live = "SELECT session_id FROM sessions WHERE seen >= ?"
+        cutoff = now - self.ttl_seconds
+        conn.execute(f"DELETE FROM messages WHERE session_id NOT IN ({live})", (cutoff,))
+        conn.execute(f"DELETE FROM chats WHERE session_id NOT IN ({live})", (cutoff,))
+        conn.execute("DELETE FROM sessions WHERE seen < ?", (cutoff,))
+
+    def spill_messages(self, session_id: str, chat_id: str, chat: Dict, count: int):
+        """Moves the oldest `count` in-session messages of `chat` here."""
+        spilled = chat.get("spilled", 0)
+        with closing(self._connect()) as conn, conn:
+            self._write_messages(conn, session_id, chat_id, spilled, chat["messages"][:count])
+        del chat["messages"][:count]
+        chat["spilled"] = spilled + count
+
+    def earlier_messages(self, session_id: str, chat_id: str, end: int) -> List[Dict]:
+        """The spilled messages before position `end`, oldest first."""
+        with closing(self._connect()) as conn, conn:
+            self._seen(conn, session_id)
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? AND chat_id = ? AND position < ? ORDER BY position",
+                (session_id, chat_id, end),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_chat(self, session_id: str, chat_id: str, chat: Dict):
+        """Spills a whole chat (its remaining messages and its metadata)."""
+        meta = {key: value for key, value in chat.items() if key != "messages"}
+        with closing(self._connect()) as conn, conn:
+            self._write_messages(conn, session_id, chat_id, chat.get("spilled", 0), chat["messages"])
+            conn.execute(
+                "INSERT OR REPLACE INTO chats (session_id, chat_id, title, chat, updated) VALUES (?, ?, ?, ?, ?)",
+                (session_id, chat_id, chat["title"], json.dumps(meta), time.time()),
+            )
+
+    def load_chat(self, session_id: str, chat_id: str) -> Dict:
+        """Takes a spilled chat back: its metadata and the messages it had in the session."""
+        with closing(self._connect()) as conn, conn:
+            self._seen(conn, session_id)
+            row = conn.execute(
+                "SELECT chat FROM chats WHERE session_id = ? AND chat_id = ?", (session_id, chat_id)
+            ).fetchone()
+            if row is None:
+                raise KeyError(chat_id)
+            chat = json.loads(row[0])
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? AND chat_id = ? AND position >= ? ORDER BY position",
+                (session_id, chat_id, chat.get("spilled", 0)),
+            ).fetchall()
+            conn.execute("DELETE FROM chats WHERE session_id = ? AND chat_id = ?", (session_id, chat_id))
+        chat["messages"] = [json.loads(row[0]) for row in rows]
+        return chat
+
+    def list_chats(self, session_id: str) -> List[Tuple[str, str]]:
+        """(chat_id, title) of the session's spilled chats, most recently used first."""
+        with closing(self._connect()) as conn, conn:
+            self._seen(conn, session_id)
+            return conn.execute(
+                "SELECT chat_id, title FROM chats WHERE session_id = ? ORDER BY updated DESC", (session_id,)
+            ).fetchall()
+
+    def delete_chat(self, session_id: str, chat_id: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ? AND chat_id = ?", (session_id, chat_id))
+            conn.execute("DELETE FROM chats WHERE session_id = ? AND chat_id = ?", (session_id, chat_id))
+
+
+def compact_session(chats: Dict[str, Dict], current_chat_id: str, session_id: str, store: ChatStore,
+                    max_chats: int = SESSION_MAX_CHATS, max_messages: int = CHAT_MAX_MESSAGES):
+    """
+    Bounds a session's chat state in place. Messages of the current chat that
+    the conversation memory has already folded into its summary spill once
+    the chat holds more than `max_messages` (the memory's offset moves with
+    them), and the least recently opened chats spill beyond `max_chats`.
+    """
+    chat = chats[current_chat_id]
+    memory = chat.get("memory")
+    if memory:
+        count = min(memory.get("folded", 0), len(chat["messages"]) - max_messages)
+        if count > 0:
+            store.spill_messages(session_id, current_chat_id, chat, count)
+            memory["folded"] -= count
+
+    while len(chats) > max_chats:
+        oldest = min((chat_id for chat_id in chats if chat_id != current_chat_id),
+                     key=lambda chat_id: chats[chat_id].get("opened", 0))
+        store.save_chat(session_id, oldest, chats.pop(oldest))
@@ -0,0 +1,305 @@
+# core/chunking.py
+import re
+from itertools import chain
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from domain.config import CHUNKER, CHUNK_SIZE, CHUNK_OVERLAP, SECTION_SPLIT_OVERLAP, TABLE_MAX_SIZE
+from core.metadata_extraction import REGULATION_STEP
+
+# Heading titles stored in chunk metadata are cut to this length (some parsed
+# headings run straight into a table)
+_TITLE_CHARS = 120
+
+_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+_ROW_BREAK = re.compile(r"(?<=\|)(?=\|)")
+
+# Outline markers at the start of a heading, most specific first. Regulations
+# are "37 Requirements of ...", "41. Open Spaces", "33(19)", "17 (2) Redevelopment"
+_MARKERS = [
+    ("part", re.compile(r"(?:part|chapter)\s+[ivxlc\d]+\b", re.IGNORECASE)),
+    ("table", re.compile(r"table\b", re.IGNORECASE)),
+    ("regulation", re.compile(
+        r"(?:regulations?\s*(?:no\.?\s*)?)?(\d{1,3})[A-Z]?(?:\s*\(\s*[0-9a-z]{1,5}\s*\))*\.?(?=\s|$)",
+        re.IGNORECASE,
+    )),
+    ("decimal", re.compile(r"\d{1,3}(?:\.\d{1,3})+\.?(?=\s|$)")),
+    ("number", re.compile(r"\(\s*\d{1,3}\s*\)")),
+    ("roman", re.compile(r"\(\s*[ivx]{1,5}\s*\)")),
+    ("upper_roman", re.compile(r"\(\s*[IVX]{1,5}\s*\)")),
+    ("lower", re.compile(r"\(\s*[a-z]{1,2}\s*\)")),
+    ("upper", re.compile(r"\(\s*[A-Z]{1,2}\s*\)")),
+]
+
+# Kinds that open a new top-level unit: chunks never span two of them
+_BOUNDARIES = ("part", "regulation", "table")
+
+
+class Chunk(NamedTuple):
+    text: str
+    section: str          # Innermost heading the chunk starts in ("" before the first heading)
+    parent_section: str   # Its enclosing headings, outermost first, joined by " > "
+
+
+class _Section(NamedTuple):
+    blocks: List[Tuple[str, str]]   # (kind, text): "heading", "table" or "text"
+    path: List[str]                 # Heading titles, outermost first
+    unit: int                       # Top-level unit the section belongs to
+
+
+def _pages(text: Union[str, Iterable[str]]) -> Iterable[str]:
+    return [text] if isinstance(text, str) else text
+
+
+def markdown_blocks(text: Union[str, Iterable[str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Headings (one line each), tables (runs of `|` lines) and paragraphs, in
+    order. `text` may be an iterable of pages; a page break ends a block.
+    """
+    kind, lines = None, []
+    for line in chain.from_iterable(chain(page.splitlines(), [""]) for page in _pages(text)):
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            line_kind = "heading"
+        elif stripped.startswith("|"):
+            line_kind = "table"
+        elif not stripped:
+            line_kind = None
+        else:
+            line_kind = "text"
+
+        if lines and (line_kind != kind or kind == "heading"):
+            yield kind, "\n".join(lines)
+            lines = []
+        if line_kind is not None:
+            kind = line_kind
+            lines.append(line)
+    if lines:
+        yield kind, "\n".join(lines)
+
+
+class StructureChunker:
+    """
+    Splits the parsed markdown along its own structure instead of at fixed
+    character counts.
+
+    Every heading opens a section. Its depth comes from the outline marker it
+    starts with (regulation "37", clause "(1)", item "(a)", "(i)" ...): a
+    marker kind already open closes everything below it, a new kind nests.
+    Consecutive sections of the same regulation (or table, or part) are packed
+    into one chunk up to `chunk_size`; a chunk never spans two regulations.
+
+    Only a section longer than `chunk_size` is split, at paragraph boundaries
+    first, and only paragraphs that are themselves too long are cut with
+    `overlap`. Tables are kept whole up to `table_max_size`; larger ones are
+    split by rows, repeating their header row.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, overlap: int = SECTION_SPLIT_OVERLAP,
+                 table_max_size: int = TABLE_MAX_SIZE):
+        self.chunk_size = chunk_size
+        self.table_max_size = table_max_size
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=overlap, separators=_SEPARATORS
+        )
+
+    # --- OUTLINE ---
+    @staticmethod
+    def _marker(title: str, stack: List[Tuple[str, str]], regulation: Optional[int]) -> Tuple[str, Optional[int]]:
+        """(kind, regulation number) of a heading's leading outline marker."""
+        for kind, pattern in _MARKERS:
+            match = pattern.match(title)
+            if not match:
+                continue
+            if kind == "regulation":
+                number = int(match.group(1))
+                # "# 2. Conditions" numbers items inside a regulation; a bare number
+                # only opens a regulation if it continues the sequence
+                if "(" in match.group(0) or regulation is None or regulation < number <= regulation + REGULATION_STEP:
+                    return kind, number
+                return "item", None
+            if kind == "decimal":
+                # "4.1" and "4.1.2" are different levels
+                return f"decimal{match.group(0).rstrip('.').count('.')}", None
+            if kind == "roman" and stack and stack[-1][0] == "lower" and re.match(r"\(\s*h\s*\)", stack[-1][1]):
+                # "(i)" right after "(h)" is a letter
+                return "lower", None
+            return kind, None
+        return "title", None
+
+    def sections(self, text: Union[str, Iterable[str]]) -> Iterator[_Section]:
+        """The sections of `text` (or of an iterable of pages), each yielded once complete."""
+        current: Optional[_Section] = None
+        stack: List[Tuple[str, str]] = []   # (kind, title) of the open headings
+        regulation: Optional[int] = None
+        unit = 0
+        for kind, block in markdown_blocks(text):
+            if kind != "heading":
+                if current is None:
+                    current = _Section([], [], unit)
+                current.blocks.append((kind, block))
+                continue
+            if current is not None:
+                yield current
+
+            title = block.strip().lstrip("#").strip()[:_TITLE_CHARS]
+            marker, number = self._marker(title, stack, regulation)
+            if marker in _BOUNDARIES:
+                unit += 1
+                # Regulations sit inside a part, tables inside the regulation that references them
+                keep = {"part": (), "regulation": ("part",), "table": ("part", "regulation")}[marker]
+                stack = [entry for entry in stack if entry[0] in keep]
+                if number is not None:
+                    regulation = number
+            elif marker == "title" and stack and stack[-1][0] == "title":
+                stack.pop()
+            else:
+                kinds = [entry[0] for entry in stack]
+                if marker in kinds and marker != "title":
+                    del stack[kinds.index(marker):]
+            stack.append((marker, title))
+            current = _Section([("heading", block)], [entry[1] for entry in stack], unit)
+        if current is not None:
+            yield current
+
+    # --- SPLITTING ---
+    def _split_table(self, table: str) -> List[str]:
+        if len(table) <= self.table_max_size:
+            return [table]
+        # The parser sometimes runs rows together on one line ("...||...")
+        lines = [row for line in table.splitlines() for row in _ROW_BREAK.split(line)]
+        if len(lines) < 3 or not set(lines[1]) <= set("|-: "):
+            # No header row to repeat
+            return self.splitter.split_text(table)
+        header, rows = "\n".join(lines[:2]), lines[2:]
+        pieces, current = [], []
+        for row in rows:
+            if len(header) + len(row) > self.table_max_size:
+                # A single row too long for a chunk
+                if current:
+                    pieces.append("\n".join([header] + current))
+                    current = []
+                pieces.extend(self.splitter.split_text(row))
+                continue
+            if current and len(header) + sum(len(r) + 1 for r in current) + len(row) > self.table_max_size:
+                pieces.append("\n".join([header] + current))
+                current = []
+            current.append(row)
+        if current:
+            pieces.append("\n".join([header] + current))
+        return pieces
+
+    def _split_section(self, blocks: List[Tuple[str, str]]) -> List[str]:
+        """
+        A section too long for one chunk, packed block by block. Headings are
+        never a piece of their own: they lead the piece of the text that
+        follows them (which may then run over chunk_size by their length).
+        """
+        pieces, current = [], ""
+        headings_only = False   # Whether `current` holds nothing but headings
+        for kind, block in blocks:
+            if kind == "heading" and len(block) > self.chunk_size:
+                # The parser ran a table into the heading line: cut it like a paragraph
+                kind = "text"
+            if kind == "table":
+                parts, whole = self._split_table(block), True
+            elif len(block) > self.chunk_size:
+                parts, whole = self.splitter.split_text(block), False
+            else:
+                parts, whole = [block], False
+            for part in parts:
+                if current and not headings_only and len(current) + 2 + len(part) > self.chunk_size:
+                    pieces.append(current)
+                    current = ""
+                if whole and len(part) > self.chunk_size:
+                    # An oversized table (or table piece) is a chunk of its own, after its headings
+                    if current and not headings_only:
+                        pieces.append(current)
+                        current = ""
+                    pieces.append(f"{current}\n\n{part}" if current else part)
+                    current, headings_only = "", False
+                    continue
+                current = f"{current}\n\n{part}" if current else part
+                headings_only = (headings_only or current == part) and kind == "heading"
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def split(self, text: str) -> List[Chunk]:
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, pages: Union[str, Iterable[str]]) -> Iterator[Chunk]:
+        """Chunks in document order, yielded as soon as the section after them starts."""
+        pending, first, length = [], None, 0
+        has_body = False   # Whether `pending` holds more than bare headings
+
+        for section in self.sections(pages):
+            body = "\n\n".join(block for _, block in section.blocks)
+            if not body.strip():
+                continue
+            # Bare headings (e.g. a part title right before its first regulation)
+            # go with the text that follows them
+            new_unit = first is not None and first.unit != section.unit
+            if has_body and (new_unit or length + 2 + len(body) > self.chunk_size):
+                yield _chunk("\n\n".join(pending), first.path)
+                pending, first, length, has_body = [], None, 0, False
+            if first is None or not has_body:
+                first = section
+
+            if len(body) > self.chunk_size:
+                pieces = self._split_section(section.blocks)
+                pieces[0] = "\n\n".join(pending + [pieces[0]])
+                for piece in pieces[:-1]:
+                    yield _chunk(piece, first.path)
+                    first = section
+                # The tail stays open for the next sections of the same unit
+                pending, length = [pieces[-1]], len(pieces[-1]) + 2
+            else:
+                pending.append(body)
+                length += len(body) + 2
+            has_body = has_body or any(kind != "heading" for kind, _ in section.blocks)
+        if pending:
+            yield _chunk("\n\n".join(pending), first.path)
+
+
+def _chunk(text: str, path: List[str]) -> Chunk:
+    return Chunk(text.strip(), path[-1] if path else "", " > ".join(path[:-1]))
+
+
+class RecursiveChunker:
+    """The previous fixed-size splitter (CHUNK_SIZE characters, CHUNK_OVERLAP overlap), without sections."""
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=overlap, length_function=len, separators=_SEPARATORS
+        )
+
+    def split(self, text: str) -> List[Chunk]:
+        return [Chunk(chunk, "", "") for chunk in self.splitter.split_text(text)]
+
+    def iter_chunks(self, pages: Union[str, Iterable[str]]) -> Iterator[Chunk]:
+        """
+        Splits page by page: the last chunk of each window is held back and
+        re-split with the next page, so only chunks no later page can change
+        are yielded.
+        """
+        carry = ""
+        for page in _pages(pages):
+            chunks = self.splitter.split_text(f"{carry}\n\n{page}" if carry else page)
+            if not chunks:
+                continue
+            for chunk in chunks[:-1]:
+                yield Chunk(chunk, "", "")
+            carry = chunks[-1]
+        if carry:
+            yield Chunk(carry, "", "")
+
+
+CHUNKERS = {"structure": StructureChunker, "recursive": RecursiveChunker}
+
+
+def get_chunker(name: str = CHUNKER):
+    if name not in CHUNKERS:
+        raise ValueError(f"Unknown chunker {name!r}, expected one of {tuple(CHUNKERS)}.")
+    return CHUNKERS[name]()
@@ -0,0 +1,145 @@
+# core/context_packer.py
+import math
+from typing import Dict, Sequence
+
+from langchain_core.documents import Document
+
+from domain.config import CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_TOKENS, CHARS_PER_TOKEN, CHUNK_OVERLAP
+from core.telemetry import span
+
+# Characters of the next chunk's head used to find where it starts repeating the previous one
+_PROBE_CHARS = 64
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def overlap_length(previous: str, following: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """Length of the longest suffix of `previous` that `following` starts with."""
+    tail = previous[-max_overlap:] if max_overlap else ""
+    probe = following[:_PROBE_CHARS]
+    if not tail or not probe:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        # The earliest match is the longest overlap
+        if following.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+def _chunk_id(doc: Document, rank: int):
+    chunk_id = doc.metadata.get("chunk_id")
+    # Chunks without an id never merge with anything
+    return chunk_id if chunk_id is not None else ("rank", rank)
+
+
+def _regulation(doc: Document, rank: int):
+    # Reg 33(7) of two corpora is two regulations
+    regulation_id = doc.metadata.get("regulation_id")
+    return (doc.metadata.get("corpus"), regulation_id) if regulation_id else ("chunk", _chunk_id(doc, rank))
+
+
+class ContextPacker:
+    """
+    Builds the answer prompt's `{context}` from the reranked chunks:
+
+    - chunks with consecutive `chunk_id`s are merged into one passage, with the
+      text the splitter repeated between them (CHUNK_OVERLAP) removed;
+    - chunks are added in rerank order until `budget` tokens are used, the
+      last one truncated if at least `min_tokens` of it fit;
+    - every regulation among the chunks keeps at least the head of its best
+      chunk, so packing never changes which regulations the answer can cite.
+
+    Passages are emitted best-first, each headed by the regulations it covers
+    (and its corpus, when the chunks come from more than one).
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, min_tokens: int = CONTEXT_MIN_TOKENS):
+        self.budget = budget
+        self.min_tokens = min_tokens
+
+    def render(self, docs: Sequence[Document], keep: Dict[int, int]) -> str:
+        """The context for `keep` (rank -> characters kept from the head of that chunk)."""
+        by_id = {_chunk_id(docs[rank], rank): rank for rank in keep}
+        passages = []   # [best rank, [ranks in document order]]
+        previous_id = None
+        for chunk_id in sorted(by_id, key=lambda key: (isinstance(key, tuple), key)):
+            rank = by_id[chunk_id]
+            adjacent = isinstance(chunk_id, int) and isinstance(previous_id, int) and chunk_id == previous_id + 1
+            if adjacent:
+                passages[-1][1].append(rank)
+                passages[-1][0] = min(passages[-1][0], rank)
+            else:
+                passages.append([rank, [rank]])
+            previous_id = chunk_id
+
+        # Name the corpus of each passage once the sources come from more than one
+        corpora = {docs[rank].metadata.get("corpus") for rank in keep}
+        blocks = []
+        for number, (_, ranks) in enumerate(sorted(passages), start=1):
+            text = ""
+            for rank in ranks:
+                piece = docs[rank].page_content[:keep[rank]]
+                text += piece[overlap_length(text, piece):] if text else piece
+            regulations = []
+            for rank in ranks:
+                regulation_id = docs[rank].metadata.get("regulation_id")
+                if regulation_id and regulation_id not in regulations:
+                    regulations.append(regulation_id)
+            if len(corpora) > 1 and docs[ranks[0]].metadata.get("corpus"):
+                regulations.insert(0, docs[ranks[0]].metadata["corpus"])
+            header = f"[Source {number}: {', '.join(regulations)}]" if regulations else f"[Source {number}]"
+            blocks.append(f"{header}\n{text.strip()}")
+        return "\n\n".join(blocks)
+
+    def _fit(self, docs, keep: Dict[int, int], rank: int, limit: int) -> int:
+        """Most characters of chunk `rank` that keep the context within `limit` tokens (0 if none)."""
+        text = docs[rank].page_content
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_tokens(self.render(docs, {**keep, rank: middle})) <= limit:
+                low = middle
+            else:
+                high = middle - 1
+        if low < len(text):
+            # Cut at a word boundary
+            space = text.rfind(" ", 0, low)
+            low = space if space > 0 else low
+        return low
+
+    def select(self, docs: Sequence[Document]) -> Dict[int, int]:
+        """rank -> characters kept, for docs in rerank order."""
+        keep: Dict[int, int] = {}
+
+        # Coverage first: the head of each regulation's best chunk, sharing the budget fairly
+        best = {}
+        for rank, doc in enumerate(docs):
+            best.setdefault(_regulation(doc, rank), rank)
+        leaders = sorted(best.values())
+        for position, rank in enumerate(leaders):
+            used = estimate_tokens(self.render(docs, keep)) if keep else 0
+            share = (self.budget - used) // (len(leaders) - position)
+            kept = self._fit(docs, keep, rank, used + share)
+            if kept:
+                keep[rank] = kept
+
+        # Then whole chunks in rerank order (extending truncated leaders first)
+        for rank in range(len(docs)):
+            full = len(docs[rank].page_content)
+            if keep.get(rank) == full:
+                continue
+            kept = self._fit(docs, keep, rank, self.budget)
+            grown = kept - keep.get(rank, 0)
+            if kept == full or estimate_tokens(docs[rank].page_content[:grown]) >= self.min_tokens:
+                keep[rank] = max(kept, keep.get(rank, 0))
+        return keep
+
+    def pack(self, docs: Sequence[Document]) -> str:
+        if not docs:
+            return ""
+        with span("context_packing", chunks=len(docs)):
+            return self.render(docs, self.select(docs))
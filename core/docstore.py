@@ -0,0 +1,216 @@
+# core/docstore.py
+import os
+import sys
+import json
+import time
+import pickle
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+from domain.config import VECTOR_DB_PATH
+
+DOCSTORE_DIR = "docstore"
+FAISS_FILE = "index.faiss"
+PICKLE_FILE = "index.pkl"
+_LOAD_ATTEMPTS = 5   # Reads of an index / docstore pair caught mid-save before giving up
+
+
+class MmapDocstore(Docstore, AddableMixin):
+    """
+    Read-mostly docstore backed by three flat files, memory-mapped on load:
+
+    - `texts.bin` / `metadatas.bin`: the page contents and JSON metadata of every
+      chunk, concatenated in FAISS row order (UTF-8).
+    - `offsets.npy`: (n + 1, 2) int64 byte offsets into the two blobs.
+    - `meta.json`: the docstore ids (row order) and the FAISS settings.
+
+    Only the Documents a search returns are decoded. Adds and deletes (ingestion
+    only) are kept in memory until `write_docstore` compacts them into new files.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.ids: List[str] = []
+        self.settings: Dict = {}
+        self._offsets = np.zeros((1, 2), dtype=np.int64)
+        self._texts = self._metadatas = np.zeros(0, dtype=np.uint8)
+        if path is not None:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            self.ids = meta["ids"]
+            self.settings = meta.get("settings", {})
+            self._offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+            self._texts = _mmap(os.path.join(path, "texts.bin"))
+            self._metadatas = _mmap(os.path.join(path, "metadatas.bin"))
+        self._rows = {_id: row for row, _id in enumerate(self.ids)}
+        self._added: Dict[str, Document] = {}
+        self._deleted = set()
+
+    def __len__(self) -> int:
+        return len(self._rows) - len(self._deleted) + len(self._added)
+
+    def _read(self, row: int) -> Document:
+        (text_start, meta_start), (text_end, meta_end) = self._offsets[row], self._offsets[row + 1]
+        return Document(
+            page_content=self._texts[text_start:text_end].tobytes().decode("utf-8"),
+            metadata=json.loads(self._metadatas[meta_start:meta_end].tobytes().decode("utf-8")),
+        )
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        row = self._rows.get(search)
+        if row is None or search in self._deleted:
+            return f"ID {search} not found."
+        return self._read(row)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [_id for _id in texts if _id in self._added or (_id in self._rows and _id not in self._deleted)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        missing = [_id for _id in ids if isinstance(self.search(_id), str)]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for _id in ids:
+            if self._added.pop(_id, None) is None:
+                self._deleted.add(_id)
+
+
+def _mmap(path: str) -> np.ndarray:
+    # np.memmap cannot map an empty file
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def write_docstore(path: str, documents: Iterable[Tuple[str, Document]], settings: Dict):
+    """Write (id, Document) pairs, in FAISS row order, as a fresh MmapDocstore."""
+    os.makedirs(path, exist_ok=True)
+    ids = []
+    offsets = [(0, 0)]
+    # Written next to the live files and renamed over them, so an open mmap keeps its old data
+    with open(os.path.join(path, "texts.bin.tmp"), "wb") as texts, \
+            open(os.path.join(path, "metadatas.bin.tmp"), "wb") as metadatas:
+        for _id, doc in documents:
+            text = doc.page_content.encode("utf-8")
+            metadata = json.dumps(doc.metadata, default=str).encode("utf-8")
+            texts.write(text)
+            metadatas.write(metadata)
+            offsets.append((offsets[-1][0] + len(text), offsets[-1][1] + len(metadata)))
+            ids.append(_id)
+    with open(os.path.join(path, "offsets.npy.tmp"), "wb") as f:
+        np.save(f, np.array(offsets, dtype=np.int64))
+    with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+        json.dump({"ids": ids, "settings": settings}, f)
+
+    # meta.json last: it is what marks the directory as a complete docstore
+    for name in ("texts.bin", "metadatas.bin", "offsets.npy", "meta.json"):
+        os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+
+
+# --- VECTORSTORE PERSISTENCE ---
+def write_index(index, path: str):
+    """
+    faiss.write_index via a temporary file renamed over `path`: serving
+    processes map the live file, which must never be rewritten in place.
+    """
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def save_vectorstore(vectorstore: FAISS, folder_path: str):
+    """`save_local` without the pickle: index.faiss plus an MmapDocstore directory."""
+    os.makedirs(folder_path, exist_ok=True)
+    index_path = os.path.join(folder_path, FAISS_FILE)
+    # Written first, renamed into place last; load_faiss retries while the two disagree
+    faiss.write_index(vectorstore.index, index_path + ".tmp")
+
+    rows = sorted(vectorstore.index_to_docstore_id)
+    documents = (
+        (vectorstore.index_to_docstore_id[row], vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]))
+        for row in rows
+    )
+    settings = {
+        "normalize_L2": vectorstore._normalize_L2,
+        "distance_strategy": str(vectorstore.distance_strategy.value),
+    }
+    write_docstore(os.path.join(folder_path, DOCSTORE_DIR), documents, settings)
+    os.replace(index_path + ".tmp", index_path)
+
+    # A leftover pickle would only be stale from now on
+    pickle_path = os.path.join(folder_path, PICKLE_FILE)
+    if os.path.exists(pickle_path):
+        os.remove(pickle_path)
+
+
+def load_faiss(folder_path: str, embeddings, cls=FAISS, mmap: bool = False) -> FAISS:
+    """
+    Load a vectorstore saved by `save_vectorstore`. With `mmap=True` the FAISS
+    vectors are memory-mapped too (read-only: serving, not ingestion).
+    Falls back to the legacy pickle format when no docstore directory exists.
+    """
+    docstore_path = os.path.join(folder_path, DOCSTORE_DIR)
+    if not os.path.exists(os.path.join(docstore_path, "meta.json")):
+        print(f"No docstore in {folder_path}, loading the legacy pickle (convert with `python -m core.docstore`)...")
+        return cls.load_local(folder_path, embeddings, allow_dangerous_deserialization=True)
+
+    index_path = os.path.join(folder_path, FAISS_FILE)
+    for attempt in range(_LOAD_ATTEMPTS):
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC)
+            except RuntimeError:
+                # Not every index type can be mapped
+                index = None
+        if index is None:
+            index = faiss.read_index(index_path)
+        docstore = MmapDocstore(docstore_path)
+        if index.ntotal == len(docstore.ids):
+            break
+        # Caught between save_vectorstore's renames; the pair is consistent again within moments
+        if attempt == _LOAD_ATTEMPTS - 1:
+            raise RuntimeError(
+                f"{index_path} has {index.ntotal} vectors but its docstore {len(docstore.ids)} documents; "
+                "re-run ingestion."
+            )
+        time.sleep(0.5)
+
+    settings = docstore.settings
+    return cls(
+        embeddings, index, docstore, dict(enumerate(docstore.ids)),
+        normalize_L2=settings.get("normalize_L2", False),
+        distance_strategy=DistanceStrategy(settings.get("distance_strategy", DistanceStrategy.EUCLIDEAN_DISTANCE.value)),
+    )
+
+
+def convert_pickle(folder_path: str):
+    """
+    Convert a legacy `index.pkl` docstore into an MmapDocstore and delete the
+    pickle. The chunks keep their old metadata and the shard has no side
+    indexes yet: `python -m core.ingestion --retag` converts and adds both.
+    """
+    with open(os.path.join(folder_path, PICKLE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    rows = sorted(index_to_docstore_id)
+    documents = ((index_to_docstore_id[row], docstore.search(index_to_docstore_id[row])) for row in rows)
+    # save_local never stored these; FAISS' defaults are what the pickle was built with
+    settings = {"normalize_L2": False, "distance_strategy": DistanceStrategy.EUCLIDEAN_DISTANCE.value}
+    write_docstore(os.path.join(folder_path, DOCSTORE_DIR), documents, settings)
+    os.remove(os.path.join(folder_path, PICKLE_FILE))
+    print(f"Converted {len(rows)} documents to {os.path.join(folder_path, DOCSTORE_DIR)}.")
+
+
+if __name__ == "__main__":
+    # python -m core.docstore [faiss_index]
+    convert_pickle(sys.argv[1] if len(sys.argv) > 1 else VECTOR_DB_PATH)
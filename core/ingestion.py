@@ -1,93 +1,428 @@
 # core/ingestion.py
 import os
-from llama_parse import LlamaParse
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import io
+import json
+import argparse
+import tempfile
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from types import SimpleNamespace
+
+import numpy as np
+from pypdf import PdfReader, PdfWriter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 from domain.config import (
-    PDF_PATH, VECTOR_DB_PATH, CHUNK_SIZE, CHUNK_OVERLAP, 
-    EMBEDDING_MODEL, LLAMA_CLOUD_API_KEY
+    CORPORA, CORPUS_CHUNK_ID_SPAN, CHUNKER,
+    EMBEDDING_MODEL, LLAMA_CLOUD_API_KEY, PARSER_BACKEND, PARSE_CACHE_DIR,
+    EMBEDDING_CACHE_PATH, METADATA_INDEX_FILE, SPARSE_INDEX_FILE, REGULATION_MAP_FILE,
+    INGEST_PARSE_BATCH, INGEST_PARSE_WORKERS, INGEST_EMBED_BATCH, INGEST_EMBED_WORKERS, FAISS_INDEX_TYPE
 )
+from core.metadata_index import MetadataIndex
+from core.sparse_index import BM25Index
+from core.metadata_extraction import MetadataExtractor, RegulationMap
+from core.docstore import DOCSTORE_DIR, PICKLE_FILE, convert_pickle, load_faiss, save_vectorstore, write_docstore
+from core.ann_index import index_spec, save_ann_index
+from core.ingest_cache import ParseCache, EmbeddingCache, content_hash
+from core.chunking import get_chunker
+from core.vectorstore import PendingEmbeddings
+from core.warmup import load_embeddings
 
-def inject_metadata(text):
-    """
-    Simple keyword-based metadata injection for Zone and Category.
-    In a real production system, this could be an LLM call.
-    """
-    metadata = {
-        "zone": "General", # Default
-        "category": "General"
-    }
-    
-    # Zone Heuristics
-    if "Island City" in text:
-        metadata["zone"] = "Island City"
-    elif "Suburbs" in text or "Suburban" in text:
-        metadata["zone"] = "Suburbs"
-        
-    # Category Heuristics
-    if "Residential" in text:
-        metadata["category"] = "Residential"
-    elif "Commercial" in text:
-        metadata["category"] = "Commercial"
-    elif "Industrial" in text:
-        metadata["category"] = "Industrial"
-        
-    return metadata
-
-def ingest_documents():
-    if not os.path.exists(PDF_PATH):
-        print(f"Error: File {PDF_PATH} not found.")
-        return
+MANIFEST_FILE = "manifest.json"
+
+# The ingestion pipeline streams pages -> chunks -> embedding batches -> index,
+# so memory is bounded by the batch sizes and jobs in flight, not the corpus:
+#
+#   parse    INGEST_PARSE_BATCH pages per parser job, INGEST_PARSE_WORKERS threads
+#   chunk    chunked and tagged in the main process as pages arrive (stateful)
+#   embed    INGEST_EMBED_BATCH chunks per job, INGEST_EMBED_WORKERS processes
+#   index    each embedded batch is added to the FAISS index as it completes
+#
+# Every corpus in CORPORA is a separate run into its own shard directory.
 
-    print(f"Loading {PDF_PATH} using LlamaParse...")
-    parser = LlamaParse(
+# --- PARSING ---
+class StubParser:
+    """
+    Offline stand-in for LlamaParse (PARSER_BACKEND = "stub").
+    Plain pypdf text extraction, one document per page, no API calls.
+    """
+
+    def load_data(self, file_path):
+        reader = PdfReader(file_path)
+        return [SimpleNamespace(text=page.extract_text() or "") for page in reader.pages]
+
+def get_parser():
+    if PARSER_BACKEND == "stub":
+        return StubParser()
+
+    from llama_parse import LlamaParse
+    return LlamaParse(
         result_type="markdown",
         api_key=LLAMA_CLOUD_API_KEY,
         verbose=True
     )
-    
-    llama_documents = parser.load_data(PDF_PATH)
-    print(f"Loaded {len(llama_documents)} pages via LlamaParse.")
-
-    print("Merging pages into a single text stream...")
-    full_text = "\n\n".join([doc.text for doc in llama_documents])
-    
-    # Note: We are creating ONE big document first, then splitting.
-    # The metadata extraction ideally happens AT THE CHUNK LEVEL.
-    # So we split the text first, then iterate through chunks to add metadata.
-    
-    print("Splitting text into context-aware chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    
-    # Split the raw text directly
-    raw_chunks = text_splitter.split_text(full_text)
-    
-    final_documents = []
-    print("Injecting metadata into chunks...")
-    for i, chunk_text in enumerate(raw_chunks):
-        meta = inject_metadata(chunk_text)
-        meta["source"] = PDF_PATH
-        meta["chunk_id"] = i
-        doc = Document(page_content=chunk_text, metadata=meta)
-        final_documents.append(doc)
-        
-    print(f"Created {len(final_documents)} semantic chunks with metadata.")
-
-    print(f"Creating embeddings using {EMBEDDING_MODEL}...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    
-    vectorstore = FAISS.from_documents(final_documents, embeddings)
-    
-    print(f"Saving vector store to {VECTOR_DB_PATH}...")
-    vectorstore.save_local(VECTOR_DB_PATH)
+
+def _page_pdf(page) -> bytes:
+    """A page as a standalone single-page PDF (its bytes key the parse cache)."""
+    writer = PdfWriter()
+    writer.add_page(page)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def _parse_file(parser, pdf_bytes: bytes):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+    try:
+        return parser.load_data(f.name)
+    finally:
+        os.remove(f.name)
+
+def parse_batch(page_bytes, parser, parse_cache):
+    """
+    (texts, pages parsed) for a batch of single-page PDFs. Pages in the parse
+    cache are not sent; the others go to the parser as one multi-page job, or
+    one job per page when the parser does not return one document per page.
+    """
+    keys = [content_hash(PARSER_BACKEND, data) for data in page_bytes]
+    texts = [parse_cache.get(key) for key in keys]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    parsed = len(missing)
+
+    if len(missing) > 1:
+        writer = PdfWriter()
+        for i in missing:
+            writer.append(PdfReader(io.BytesIO(page_bytes[i])))
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        documents = _parse_file(parser, buffer.getvalue())
+        if len(documents) == len(missing):
+            for i, doc in zip(missing, documents):
+                texts[i] = doc.text
+                parse_cache.put(keys[i], doc.text)
+            missing = []
+
+    for i in missing:
+        texts[i] = "\n\n".join(doc.text for doc in _parse_file(parser, page_bytes[i]))
+        parse_cache.put(keys[i], texts[i])
+    return texts, parsed
+
+def iter_page_texts(pdf_path, parser, parse_cache, stats: Counter,
+                    batch_size=INGEST_PARSE_BATCH, workers=INGEST_PARSE_WORKERS):
+    """
+    Parsed text of every page, in page order. Batches are parsed concurrently
+    on `workers` threads, with at most 2 x `workers` batches in flight.
+    """
+    reader = PdfReader(pdf_path)
+
+    def collect(future):
+        texts, parsed = future.result()
+        stats["parsed"] += parsed
+        stats["cached"] += len(texts) - parsed
+        return texts
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse") as pool:
+        in_flight = deque()
+        for start in range(0, len(reader.pages), batch_size):
+            # pypdf is not thread-safe: pages are cut out here, only parsing runs on the pool
+            page_bytes = [_page_pdf(page) for page in reader.pages[start:start + batch_size]]
+            in_flight.append(pool.submit(parse_batch, page_bytes, parser, parse_cache))
+            if len(in_flight) >= 2 * workers:
+                yield from collect(in_flight.popleft())
+        while in_flight:
+            yield from collect(in_flight.popleft())
+
+# --- CHUNKING ---
+def iter_documents(page_texts, chunker, extractor, sections, corpus):
+    """
+    (docstore id, Document) per chunk of `corpus`, tagged with metadata as the
+    pages arrive. Appends (chunk_id, section_ids) to `sections` for the regulation map.
+    """
+    seen = Counter()
+    # chunk_ids are unique across corpora, so shards can be searched as one store
+    base = corpus["id"] * CORPUS_CHUNK_ID_SPAN
+    for i, chunk in enumerate(chunker.iter_chunks(page_texts)):
+        # zone, category, scheme_type, regulation_id, min_road_width, min_plot_area in one pass
+        meta, section_ids = extractor.extract(chunk.text)
+        sections.append((base + i, section_ids))
+        meta["source"] = corpus["pdf"]
+        meta["corpus"] = corpus["name"]
+        meta["chunk_id"] = base + i
+        # Heading the chunk starts in and its enclosing headings ("" for the recursive chunker)
+        meta["section"] = chunk.section
+        meta["parent_section"] = chunk.parent_section
+
+        # Stable docstore ids: content hash of the chunk, disambiguated for repeated text
+        key = content_hash(chunk.text)
+        yield f"{key}-{seen[key]}", Document(page_content=chunk.text, metadata=meta)
+        seen[key] += 1
+
+# --- EMBEDDING ---
+_worker_embeddings = None
+
+def _init_embed_worker(threads: int):
+    global _worker_embeddings
+    import torch
+    # Workers share the cores: one torch thread pool each would oversubscribe them
+    torch.set_num_threads(threads)
+    _worker_embeddings = load_embeddings()
+
+def _embed_in_worker(texts):
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+class Embedder:
+    """
+    Embeds batches of chunk texts, skipping those already in the embedding
+    cache. With more than one worker the model runs in a pool of spawned
+    processes (one model copy each); otherwise in this process.
+    """
+
+    def __init__(self, embedding_cache, workers=INGEST_EMBED_WORKERS):
+        self.embedding_cache = embedding_cache
+        self.workers = workers
+        self.stats = Counter()
+        self._pool = None
+        self._embeddings = None
+        if workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embed_worker, initargs=(threads,),
+            )
+        else:
+            self._embeddings = load_embeddings()
+
+    def submit(self, texts):
+        """Starts embedding a batch; call `result` on the returned job (in submission order)."""
+        keys = [content_hash(EMBEDDING_MODEL, text) for text in texts]
+        cached = self.embedding_cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing[key] = text
+        self.stats["cached"] += len(texts) - len(missing)
+        self.stats["embedded"] += len(missing)
+
+        future = None
+        if missing and self._pool is not None:
+            future = self._pool.submit(_embed_in_worker, list(missing.values()))
+        elif missing:
+            self._store(cached, missing, self._embeddings.embed_documents(list(missing.values())))
+        return keys, cached, missing, future
+
+    def _store(self, cached, missing, vectors):
+        fresh = dict(zip(missing.keys(), vectors))
+        self.embedding_cache.put_many(fresh)
+        cached.update(fresh)
+
+    def result(self, job):
+        keys, cached, missing, future = job
+        if future is not None:
+            self._store(cached, missing, future.result().tolist())
+        return [cached[key] for key in keys]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+def iter_embedded(documents, embedder, batch_size=INGEST_EMBED_BATCH):
+    """
+    (ids, Documents, vectors) per batch of `batch_size` chunks, in order. Up to
+    2 x workers batches are embedded while the next ones are chunked.
+    """
+    in_flight = deque()
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if batch:
+            ids, docs = zip(*batch)
+            in_flight.append((ids, docs, embedder.submit([doc.page_content for doc in docs])))
+        if in_flight and (not batch or len(in_flight) >= 2 * max(embedder.workers, 1)):
+            ids, docs, job = in_flight.popleft()
+            yield list(ids), list(docs), embedder.result(job)
+        elif not batch:
+            return
+
+# --- INDEX UPDATE ---
+def _load_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+class IndexWriter:
+    """
+    Applies the streamed chunk batches to the FAISS index: new chunks are
+    added, kept ones get their metadata refreshed, and `finish` removes the
+    chunks no batch contained. Starts a fresh index when none exists or the
+    embedding model changed.
+    """
+
+    def __init__(self, path):
+        self.vectorstore = None
+        self.existing = set()
+        if os.path.exists(path) and _load_manifest(path).get("embedding_model") == EMBEDDING_MODEL:
+            # Only precomputed vectors are added, so the embedder is never needed here
+            self.vectorstore = load_faiss(path, PendingEmbeddings())
+            self.existing = set(self.vectorstore.index_to_docstore_id.values())
+        else:
+            print("Building a new FAISS index...")
+        self.seen = set()
+        self.counts = Counter()
+
+    def add(self, ids, documents, vectors):
+        self.seen.update(ids)
+        new_rows = [i for i, _id in enumerate(ids) if _id not in self.existing]
+        kept = [i for i, _id in enumerate(ids) if _id in self.existing]
+        if kept:
+            # chunk_id is positional, so unchanged text can still need new metadata
+            self.vectorstore.docstore.delete([ids[i] for i in kept])
+            self.vectorstore.docstore.add({ids[i]: documents[i] for i in kept})
+        if new_rows:
+            text_embeddings = [(documents[i].page_content, vectors[i]) for i in new_rows]
+            metadatas = [documents[i].metadata for i in new_rows]
+            new_ids = [ids[i] for i in new_rows]
+            if self.vectorstore is None:
+                self.vectorstore = FAISS.from_embeddings(
+                    text_embeddings, PendingEmbeddings(), metadatas=metadatas, ids=new_ids
+                )
+            else:
+                self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=new_ids)
+        self.counts["added"] += len(new_rows)
+        self.counts["kept"] += len(kept)
+
+    def finish(self):
+        stale = list(self.existing - self.seen)
+        if stale:
+            self.vectorstore.delete(stale)
+        print(f"Index updated: {self.counts['added']} added, {len(stale)} removed, {self.counts['kept']} kept.")
+        return self.vectorstore
+
+def ingest_corpus(corpus, embedder, parse_cache):
+    """Brings the shard of `corpus` up to date with its PDF (the other shards are not touched)."""
+    pdf_path, path = corpus["pdf"], corpus["path"]
+    if not os.path.exists(pdf_path):
+        print(f"Error: File {pdf_path} not found.")
+        return
+
+    print(f"Streaming {pdf_path} ({corpus['name']}) through {PARSER_BACKEND} parsing, {CHUNKER} chunking and {EMBEDDING_MODEL}...")
+    parse_stats = Counter()
+    page_texts = iter_page_texts(pdf_path, get_parser(), parse_cache, parse_stats)
+
+    sections = []
+    documents = iter_documents(page_texts, get_chunker(), MetadataExtractor(), sections, corpus)
+
+    embed_stats = Counter(embedder.stats)
+    writer = IndexWriter(path)
+    for ids, docs, vectors in iter_embedded(documents, embedder):
+        writer.add(ids, docs, vectors)
+        print(f"Indexed {sum(writer.counts.values())} chunks...")
+    vectorstore = writer.finish()
+    if vectorstore is None:
+        print("Error: no text was extracted from the PDF.")
+        return
+
+    embed_stats = Counter(embedder.stats) - embed_stats
+    print(f"Pages: {parse_stats['cached']} cached, {parse_stats['parsed']} parsed.")
+    print(f"Chunks: {len(sections)}, {embed_stats['cached']} cached embeddings, {embed_stats['embedded']} embedded.")
+
+    print(f"Saving vector store to {path}...")
+    save_vectorstore(vectorstore, path)
+    if FAISS_INDEX_TYPE != "flat":
+        print(f"Building the {FAISS_INDEX_TYPE} serving index ({index_spec(FAISS_INDEX_TYPE, vectorstore.index.ntotal)})...")
+    save_ann_index(vectorstore.index, path)
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump({"embedding_model": EMBEDDING_MODEL, "corpus": corpus["name"]}, f)
+
+    save_side_indexes(vectorstore, path, sections)
+    print(f"{corpus['name']} ingested.")
+
+def save_side_indexes(vectorstore, path, sections):
+    """Writes the shard's columnar metadata, BM25 and regulation indexes next to its FAISS index."""
+    print(f"Saving columnar metadata index to {os.path.join(path, METADATA_INDEX_FILE)}...")
+    MetadataIndex.from_vectorstore(vectorstore).save(os.path.join(path, METADATA_INDEX_FILE))
+
+    print(f"Saving BM25 sparse index to {os.path.join(path, SPARSE_INDEX_FILE)}...")
+    BM25Index.from_vectorstore(vectorstore).save(os.path.join(path, SPARSE_INDEX_FILE))
+
+    print(f"Saving regulation map to {os.path.join(path, REGULATION_MAP_FILE)}...")
+    RegulationMap.from_sections(sections).save(os.path.join(path, REGULATION_MAP_FILE))
+
+# --- RETAGGING ---
+def retag_corpus(corpus):
+    """
+    Re-derives the metadata and side indexes of an existing shard from its
+    chunk texts, without parsing or embedding (chunks and vectors are kept).
+    Upgrades shards built by an older pipeline, e.g. a converted legacy pickle.
+    """
+    path = corpus["path"]
+    if os.path.exists(os.path.join(path, PICKLE_FILE)):
+        convert_pickle(path)
+    if not os.path.exists(os.path.join(path, DOCSTORE_DIR)):
+        print(f"Error: no index shard at {path}; ingest {corpus['name']} first.")
+        return
+
+    vectorstore = load_faiss(path, PendingEmbeddings())
+    ids = [vectorstore.index_to_docstore_id[row] for row in range(vectorstore.index.ntotal)]
+    docs = [vectorstore.docstore.search(_id) for _id in ids]
+    base = corpus["id"] * CORPUS_CHUNK_ID_SPAN
+
+    # The extractor follows the running section, so chunks are replayed in document order
+    extractor = MetadataExtractor()
+    sections = []
+    order = sorted(range(len(docs)), key=lambda row: docs[row].metadata.get("chunk_id", row))
+    for i, row in enumerate(order):
+        old = docs[row].metadata
+        meta, section_ids = extractor.extract(docs[row].page_content)
+        sections.append((base + i, section_ids))
+        meta["source"] = corpus["pdf"]
+        meta["corpus"] = corpus["name"]
+        meta["chunk_id"] = base + i
+        meta["section"] = old.get("section", "")
+        meta["parent_section"] = old.get("parent_section", "")
+        docs[row] = Document(page_content=docs[row].page_content, metadata=meta)
+
+    print(f"Retagged {len(docs)} chunks of {corpus['name']}, saving to {path}...")
+    write_docstore(os.path.join(path, DOCSTORE_DIR), zip(ids, docs), vectorstore.docstore.settings)
+    vectorstore = load_faiss(path, PendingEmbeddings())
+    save_side_indexes(vectorstore, path, sections)
+    print(f"{corpus['name']} retagged.")
+
+def _select_corpora(names):
+    corpora = [corpus for corpus in CORPORA if names is None or corpus["name"] in names]
+    unknown = set(names or []) - {corpus["name"] for corpus in corpora}
+    if unknown:
+        print(f"Error: unknown corpus {', '.join(sorted(unknown))}; expected one of {[c['name'] for c in CORPORA]}.")
+        return None
+    return corpora
+
+def ingest_documents(names=None):
+    """Ingests the corpora named in `names` (all of CORPORA by default), one shard each."""
+    corpora = _select_corpora(names)
+    if corpora is None:
+        return
+
+    # One parse cache and one embedder (and its worker processes) for every corpus
+    parse_cache = ParseCache(PARSE_CACHE_DIR)
+    embedder = Embedder(EmbeddingCache(EMBEDDING_CACHE_PATH))
+    try:
+        for corpus in corpora:
+            ingest_corpus(corpus, embedder, parse_cache)
+    finally:
+        embedder.close()
     print("Ingestion complete!")
 
 if __name__ == "__main__":
-    ingest_documents()
+    parser = argparse.ArgumentParser(description="Build or update the index shard of each corpus in CORPORA.")
+    parser.add_argument("--corpus", nargs="+", help="Only these corpora (by name); the other shards are left as they are")
+    parser.add_argument("--retag", action="store_true",
+                        help="Only re-derive metadata and side indexes of the existing shards (no parsing or embedding)")
+    args = parser.parse_args()
+    if args.retag:
+        for corpus in _select_corpora(args.corpus) or []:
+            retag_corpus(corpus)
+    else:
+        ingest_documents(args.corpus)
@@ -0,0 +1,155 @@
+# core/memory.py
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from domain.config import (
+    MEMORY_RECENT_TURNS, MEMORY_FOLD_TURNS, MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_TOKENS, CHARS_PER_TOKEN
+)
+from domain.prompts import MEMORY_SUMMARY_PROMPT
+from core.context_packer import estimate_tokens
+from core.telemetry import TelemetryCallbackHandler, TracedCounter, span
+
+# Folds into the running summary, and turns that had to be dropped unsummarized (per process)
+MEMORY_STATS = TracedCounter("memory")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+_summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", MEMORY_SUMMARY_PROMPT),
+    ("human", "Current summary:\n{summary}\n\nTurns to add:\n{turns}"),
+])
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit] + " …"
+
+
+def _fit(messages: List[BaseMessage], budget: int) -> List[BaseMessage]:
+    """Cuts the longest messages (to their head) until the list fits in `budget` tokens."""
+    sizes = sorted(estimate_tokens(str(message.content)) for message in messages)
+    if sum(sizes) <= budget:
+        return messages
+    # Largest per-message cap that fits: short messages stay whole
+    cap, remaining = 0, budget
+    for position, size in enumerate(sizes):
+        share = remaining // (len(sizes) - position)
+        if size > share:
+            cap = share
+            break
+        remaining -= size
+    return [
+        message.model_copy(update={"content": _truncate(str(message.content), cap)})
+        if estimate_tokens(str(message.content)) > cap else message
+        for message in messages
+    ]
+
+
+def _turn_starts(messages: Sequence[BaseMessage]) -> List[int]:
+    """Indices of the messages that open a turn (each user question)."""
+    starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    return starts if starts and starts[0] == 0 else [0] + starts
+
+
+class ConversationMemory:
+    """
+    Bounded chat history for one conversation.
+
+    The last turns go to the prompts verbatim, older ones only as a running
+    summary. Folding happens in `update` (after an answer) once
+    `recent_turns + fold_turns` turns are verbatim: everything but the last
+    `recent_turns` turns is folded into the summary with a single LLM call, so
+    the summary is rewritten once every `fold_turns` turns, not every turn.
+
+    `history` never exceeds `budget` + `summary_tokens` estimated tokens: the
+    longest messages (usually old answers) are cut to their head to fit, and
+    if folding fell behind (or failed) the oldest unsummarized turns are left out.
+
+    Holds only the summary and a message offset (`state()`), so it is cheap
+    to keep per chat in the Streamlit session state or send to the query service.
+    """
+
+    def __init__(self, recent_turns: int = MEMORY_RECENT_TURNS, fold_turns: int = MEMORY_FOLD_TURNS,
+                 budget: int = MEMORY_TOKEN_BUDGET, summary_tokens: int = MEMORY_SUMMARY_TOKENS):
+        self.recent_turns = recent_turns
+        self.fold_turns = fold_turns
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.folded = 0   # Leading messages already folded into the summary
+
+    def state(self) -> dict:
+        return {"summary": self.summary, "folded": self.folded}
+
+    @classmethod
+    def from_state(cls, state: Optional[dict]) -> "ConversationMemory":
+        memory = cls()
+        if state:
+            memory.summary, memory.folded = state.get("summary", ""), state.get("folded", 0)
+        return memory
+
+    def history(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """The chat_history to send with the next question (`messages`: the whole conversation so far)."""
+        recent = list(messages[self.folded:])
+        starts = _turn_starts(recent)
+        excess = len(starts) - (self.recent_turns + self.fold_turns)
+        if excess > 0:
+            MEMORY_STATS["dropped_turns"] += excess
+            recent = recent[starts[excess]:]
+        recent = _fit(recent, self.budget)
+        if self.summary:
+            recent.insert(0, HumanMessage(content=SUMMARY_PREFIX + self.summary))
+        return recent
+
+    def needs_fold(self, messages: Sequence[BaseMessage]) -> bool:
+        return len(_turn_starts(messages[self.folded:])) >= self.recent_turns + self.fold_turns
+
+    def _fold_inputs(self, messages: Sequence[BaseMessage]):
+        """(messages folded, span attributes, summary prompt inputs) for the turns before the last `recent_turns`."""
+        recent = messages[self.folded:]
+        starts = _turn_starts(recent)
+        end = starts[-self.recent_turns] if self.recent_turns else len(recent)
+        # The summarizer's input is bounded too: long answers are cut to their head
+        share = max(self.budget // end, 1)
+        turns = "\n\n".join(
+            f"{message.type.upper()}: {_truncate(str(message.content), share)}" for message in recent[:end]
+        )
+
+        return end, {"turns": len([s for s in starts if s < end])}, {"summary": self.summary or "(none)", "turns": turns}
+
+    def _fold(self, end: int, summary: str):
+        self.summary = _truncate(summary.strip(), self.summary_tokens)
+        self.folded += end
+        MEMORY_STATS["folds"] += 1
+
+    @staticmethod
+    def _chain(llm):
+        return (_summary_prompt | llm | StrOutputParser()).with_config(
+            run_name="summarize_memory", callbacks=[TelemetryCallbackHandler()],
+        )
+
+    def update(self, messages: Sequence[BaseMessage], llm, config=None) -> bool:
+        """Folds the turns before the last `recent_turns` into the summary if due; True if it did."""
+        if not self.needs_fold(messages):
+            return False
+        end, attrs, inputs = self._fold_inputs(messages)
+        with span("memory_fold", **attrs):
+            summary = self._chain(llm).invoke(inputs, config=config)
+        self._fold(end, summary)
+        return True
+
+    async def aupdate(self, messages: Sequence[BaseMessage], llm, config=None) -> bool:
+        """Async `update`, for the query service (the LLM call does not hold a thread)."""
+        if not self.needs_fold(messages):
+            return False
+        end, attrs, inputs = self._fold_inputs(messages)
+        with span("memory_fold", **attrs):
+            summary = await self._chain(llm).ainvoke(inputs, config=config)
+        self._fold(end, summary)
+        return True
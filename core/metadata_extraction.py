@@ -0,0 +1,235 @@
+# core/metadata_extraction.py
+import os
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+from domain.metadata_schema import METADATA_FIELD_INFO, FIELD_SYNONYMS
+from core.query_constructor import NUMERIC_PATTERNS, format_regulation_id
+from core.telemetry import TracedCounter
+
+# Questions answered straight from the regulation map vs. via search (per process)
+REGULATION_LOOKUP_STATS = TracedCounter("regulation_lookup")
+
+_CLAUSE = r"\d{1,3}[a-z]?(?:\s*\(\s*[0-9a-z]{1,5}\s*\))+"
+
+# Markdown headings that open a regulation or a table:
+# - clauses, always trusted: "# 33(19)", "# 17 (2) Redevelopment of ...", "# Regulations 10(3) (ix)"
+# - bare numbers with a title, e.g. "# 27. Layout/Plot ...". The PDF numbers its
+#   sub-items the same way ("# 2. Conditions"), so these only count when they
+#   continue the regulation sequence (see REGULATION_STEP)
+# - tables: "# Table No - 12A", "TABLE No 9"
+HEADING_PATTERNS = [
+    (r"^#+[ \t]*(?:regulations?\s*(?:no\.?\s*)?)?(" + _CLAUSE + r")(?![\w.)])", "clause"),
+    (r"^#+[ \t]*(?:regulations?\s*(?:no\.?\s*)?)?(\d{1,2})(?=\.?[ \t]+[a-z]{3,})", "regulation"),
+    (r"^#*[ \t]*table\s*(?:no\b\.?)?\s*[-–:]?\s*(\d{1,3}\s*[a-z]?)(?!\w|\.\d)", "table"),
+]
+TEMPLATES = {"clause": "Reg {}", "regulation": "Reg {}", "table": "Table {}"}
+
+# A bare numbered heading opens a new regulation only within this many numbers
+# after the current one
+REGULATION_STEP = 3
+
+# A chunk opening more sections than this is a table of contents, not a section start
+CONTENTS_HEADINGS = 4
+
+# Tables have no closing marker; after this many chunks the text is assumed to
+# be back in the regulation around the table
+TABLE_CHUNKS = 4
+
+
+def _regulation_number(section_id: Optional[str]) -> Optional[int]:
+    match = re.match(r"Reg (\d+)", section_id or "")
+    return int(match.group(1)) if match else None
+
+
+DEFAULTS = {"zone": "General", "category": "General", "scheme_type": "General"}
+
+
+class MetadataExtractor:
+    """
+    Fills every METADATA_FIELD_INFO field for a chunk in a single regex pass.
+
+    All synonym, numeric and heading patterns are compiled into one
+    alternation with a named group per pattern, so each chunk is scanned once.
+    Headings are matched as lookaheads so they do not hide the synonyms
+    inside them (e.g. the "33(7)" scheme in a "# 33(7)" heading).
+
+    A regulation usually spans several chunks, so the extractor remembers the
+    section the previous chunk ended in: feed it the chunks in document order.
+    """
+
+    def __init__(self):
+        fields = {info.name: info.type for info in METADATA_FIELD_INFO}
+        # group name -> (kind, field, value or template)
+        self.groups: Dict[str, Tuple[str, str, str]] = {}
+        # Earlier values win when a chunk matches several (table order = priority)
+        self.priority: Dict[str, List[str]] = {}
+
+        alternatives = []
+
+        def add(kind, field, payload, pattern, lookahead=False):
+            name = f"p{len(self.groups)}"
+            self.groups[name] = (kind, field, payload)
+            group = f"(?P<{name}>{pattern})"
+            alternatives.append(f"(?={group})" if lookahead else group)
+
+        for pattern, heading_kind in HEADING_PATTERNS:
+            add("heading", "regulation_id", heading_kind, pattern, lookahead=True)
+        for field, patterns in NUMERIC_PATTERNS.items():
+            if fields.get(field) == "float":
+                for pattern in patterns:
+                    add("numeric", field, None, pattern)
+        for field, values in FIELD_SYNONYMS.items():
+            if fields.get(field) != "string":
+                continue
+            self.priority[field] = list(values)
+            for value, patterns in values.items():
+                for pattern in patterns:
+                    add("synonym", field, value, pattern)
+
+        self.pattern = re.compile("|".join(alternatives), re.IGNORECASE | re.MULTILINE)
+        self.reset()
+
+    def reset(self):
+        """Forget the running section (call before a new document)."""
+        self.section: Optional[str] = None     # Regulation / table the last chunk ended in
+        self.regulation: Optional[str] = None  # Last regulation opened (tables sit inside it)
+        self.table_chunks = 0                  # Chunks the running table has spanned
+
+    def extract(self, text: str) -> Tuple[Dict, List[str]]:
+        """
+        Returns (metadata, section_ids). `section_ids` are the regulations /
+        tables the chunk belongs to in order: the running section (unless the
+        chunk opens with a heading), then every section heading inside it.
+        `metadata["regulation_id"]` is the first one.
+        """
+        values: Dict[str, set] = {}
+        numbers: Dict[str, List[float]] = {}
+        headings: List[Tuple[int, str, str]] = []
+
+        for match in self.pattern.finditer(text):
+            name = match.lastgroup
+            kind, field, payload = self.groups[name]
+            if kind == "synonym":
+                values.setdefault(field, set()).add(payload)
+                continue
+            # Heading / numeric patterns capture one value, right after their named group
+            inner = match.group(self.pattern.groupindex[name] + 1)
+            if kind == "heading":
+                headings.append((match.start(), payload, format_regulation_id(TEMPLATES[payload], inner)))
+            else:
+                numbers.setdefault(field, []).append(float(inner.replace(",", "")))
+
+        metadata = dict(DEFAULTS)
+        for field, found in values.items():
+            metadata[field] = next(value for value in self.priority[field] if value in found)
+        for field, found in numbers.items():
+            # The rule applies from the smallest threshold the chunk mentions
+            metadata[field] = min(found)
+
+        regulation = self.regulation
+        opened = []
+        for start, heading_kind, section_id in headings:
+            if heading_kind == "regulation":
+                number, candidate = _regulation_number(regulation), _regulation_number(section_id)
+                if number is not None and not number < candidate <= number + REGULATION_STEP:
+                    continue
+            if heading_kind != "table":
+                regulation = section_id
+            opened.append((start, section_id))
+
+        if len(opened) > CONTENTS_HEADINGS:
+            # Table of contents: the headings are not where the text is
+            self.reset()
+            return metadata, []
+
+        running = self.section
+        if running is not None and running.startswith("Table"):
+            self.table_chunks += 1
+            if self.table_chunks > TABLE_CHUNKS:
+                running = self.regulation
+
+        section_ids = []
+        if running and (not opened or text[:opened[0][0]].strip()):
+            section_ids.append(running)
+        for _, section_id in opened:
+            if section_id not in section_ids:
+                section_ids.append(section_id)
+        if opened:
+            self.table_chunks = 0
+        self.section = section_ids[-1] if section_ids else None
+        self.regulation = regulation
+        if section_ids:
+            metadata["regulation_id"] = section_ids[0]
+        return metadata, section_ids
+
+
+class RegulationMap:
+    """
+    Persisted regulation_id -> [chunk_id] map (chunks in document order), so a
+    question naming "Reg 33(7)" or "Table 12" can skip embedding and ANN search.
+    """
+
+    def __init__(self, chunks: Dict[str, List[int]], n_chunks: int):
+        self.chunks = chunks
+        self.n_chunks = n_chunks
+
+    @classmethod
+    def from_sections(cls, sections: List[Tuple[int, List[str]]]) -> "RegulationMap":
+        """`sections` is [(chunk_id, section_ids)] as returned by MetadataExtractor.extract."""
+        chunks: Dict[str, List[int]] = {}
+        for chunk_id, section_ids in sections:
+            for section_id in section_ids:
+                chunks.setdefault(section_id, []).append(chunk_id)
+        return cls(chunks, len(sections))
+
+    @classmethod
+    def merge(cls, maps: List["RegulationMap"]) -> "RegulationMap":
+        """One map over several shards' chunks (their chunk_ids never collide), in the order given."""
+        chunks: Dict[str, List[int]] = {}
+        for regulation_map in maps:
+            for regulation_id, chunk_ids in regulation_map.chunks.items():
+                chunks.setdefault(regulation_id, []).extend(chunk_ids)
+        return cls(chunks, sum(regulation_map.n_chunks for regulation_map in maps))
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, extractor: Optional[MetadataExtractor] = None) -> "RegulationMap":
+        """Re-derive the sections from the docstore (chunks replayed in chunk_id order)."""
+        extractor = extractor or MetadataExtractor()
+        docs = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+            for row in range(vectorstore.index.ntotal)
+        ]
+        docs.sort(key=lambda doc: doc.metadata.get("chunk_id", 0))
+
+        extractor.reset()
+        sections = []
+        for doc in docs:
+            _, section_ids = extractor.extract(doc.page_content)
+            sections.append((doc.metadata.get("chunk_id"), section_ids))
+        return cls.from_sections(sections)
+
+    # --- PERSISTENCE ---
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"n_chunks": self.n_chunks, "chunks": self.chunks}, f)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RegulationMap"]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["chunks"], data["n_chunks"])
+
+    # --- LOOKUP ---
+    def lookup(self, regulation_ids: List[str], limit: Optional[int] = None) -> List[int]:
+        """chunk_ids for the given ids in document order (unknown ids are skipped), at most `limit`."""
+        chunk_ids = []
+        for regulation_id in regulation_ids:
+            for chunk_id in self.chunks.get(regulation_id, []):
+                if chunk_id not in chunk_ids:
+                    chunk_ids.append(chunk_id)
+        return chunk_ids[:limit]
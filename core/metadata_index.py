@@ -0,0 +1,154 @@
+# core/metadata_index.py
+import os
+import json
+from numbers import Number
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Sentinel code for "field missing on this chunk" in categorical columns
+MISSING = -1
+
+
+def _is_numeric(value) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+class MetadataIndex:
+    """
+    Columnar copy of the chunk metadata, aligned with the FAISS row ids.
+
+    Numeric fields are stored as float64 arrays (NaN = missing).
+    Every other field is stored as int32 codes into a small vocabulary,
+    so a filter is evaluated once per distinct value instead of once per chunk.
+    """
+
+    def __init__(self, n_rows: int, numeric: Dict[str, np.ndarray],
+                 codes: Dict[str, np.ndarray], vocabs: Dict[str, List]):
+        self.n_rows = n_rows
+        self.numeric = numeric
+        self.codes = codes
+        self.vocabs = vocabs
+
+    @property
+    def fields(self) -> List[str]:
+        return sorted(list(self.numeric) + list(self.codes))
+
+    @classmethod
+    def from_metadatas(cls, metadatas: List[Dict]) -> "MetadataIndex":
+        """Build the columns from a list of metadata dicts (row i = FAISS id i)."""
+        n_rows = len(metadatas)
+        keys = sorted({key for meta in metadatas for key in meta})
+
+        numeric, codes, vocabs = {}, {}, {}
+        for key in keys:
+            values = [meta.get(key) for meta in metadatas]
+            present = [v for v in values if v is not None]
+
+            if present and all(_is_numeric(v) for v in present):
+                numeric[key] = np.array(
+                    [np.nan if v is None else float(v) for v in values], dtype=np.float64
+                )
+                continue
+
+            vocab, lookup = [], {}
+            column = np.full(n_rows, MISSING, dtype=np.int32)
+            for row, value in enumerate(values):
+                if value is None:
+                    continue
+                # Lists/dicts are not filterable; keep them as their JSON form
+                if not isinstance(value, (str, Number)):
+                    value = json.dumps(value, sort_keys=True)
+                if value not in lookup:
+                    lookup[value] = len(vocab)
+                    vocab.append(value)
+                column[row] = lookup[value]
+            codes[key] = column
+            vocabs[key] = vocab
+
+        return cls(n_rows, numeric, codes, vocabs)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "MetadataIndex":
+        """Build the columns from a loaded LangChain FAISS vectorstore."""
+        metadatas = []
+        for row in range(vectorstore.index.ntotal):
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+            metadatas.append(getattr(doc, "metadata", {}) or {})
+        return cls.from_metadatas(metadatas)
+
+    @classmethod
+    def concat(cls, indexes: List["MetadataIndex"]) -> "MetadataIndex":
+        """One index over the rows of `indexes` in order (fields missing from one are missing on its rows)."""
+        numeric, codes, vocabs = {}, {}, {}
+        for key in sorted({key for index in indexes for key in index.numeric}):
+            numeric[key] = np.concatenate([
+                index.numeric.get(key, np.full(index.n_rows, np.nan)) for index in indexes
+            ])
+        for key in sorted({key for index in indexes for key in index.codes}):
+            vocab, lookup, columns = [], {}, []
+            for index in indexes:
+                if key not in index.codes:
+                    columns.append(np.full(index.n_rows, MISSING, dtype=np.int32))
+                    continue
+                for value in index.vocabs[key]:
+                    if value not in lookup:
+                        lookup[value] = len(vocab)
+                        vocab.append(value)
+                # Re-code through the merged vocabulary (MISSING maps to the extra last slot)
+                recode = np.array([lookup[value] for value in index.vocabs[key]] + [MISSING], dtype=np.int32)
+                columns.append(recode[index.codes[key]])
+            codes[key] = np.concatenate(columns)
+            vocabs[key] = vocab
+        return cls(sum(index.n_rows for index in indexes), numeric, codes, vocabs)
+
+    # --- PERSISTENCE ---
+    def save(self, path: str):
+        arrays = {"n_rows": np.array(self.n_rows, dtype=np.int64)}
+        for key, column in self.numeric.items():
+            arrays[f"num__{key}"] = column
+        for key, column in self.codes.items():
+            arrays[f"cat__{key}"] = column
+            # Stored as a plain unicode scalar so loading never needs pickle
+            arrays[f"vocab__{key}"] = np.array(json.dumps(self.vocabs[key]))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["MetadataIndex"]:
+        if not os.path.exists(path):
+            return None
+        numeric, codes, vocabs = {}, {}, {}
+        with np.load(path, allow_pickle=False) as data:
+            n_rows = int(data["n_rows"])
+            for name in data.files:
+                if name.startswith("num__"):
+                    numeric[name[5:]] = data[name]
+                elif name.startswith("cat__"):
+                    key = name[5:]
+                    codes[key] = data[name]
+                    vocabs[key] = json.loads(str(data[f"vocab__{key}"]))
+        return cls(n_rows, numeric, codes, vocabs)
+
+    # --- VECTORIZED PREDICATES ---
+    def none(self) -> np.ndarray:
+        return np.zeros(self.n_rows, dtype=bool)
+
+    def all(self) -> np.ndarray:
+        return np.ones(self.n_rows, dtype=bool)
+
+    def numeric_mask(self, field: str, op, target) -> np.ndarray:
+        """Apply `op` (e.g. operator.ge) to a numeric column. Missing rows never match."""
+        if not _is_numeric(target):
+            return self.none()
+        column = self.numeric[field]
+        with np.errstate(invalid="ignore"):
+            mask = op(column, float(target))
+        return mask & ~np.isnan(column)
+
+    def categorical_mask(self, field: str, predicate) -> np.ndarray:
+        """Evaluate `predicate` once per vocabulary entry, then broadcast to rows."""
+        matching = [code for code, value in enumerate(self.vocabs[field]) if predicate(value)]
+        if not matching:
+            return self.none()
+        return np.isin(self.codes[field], np.array(matching, dtype=np.int32))
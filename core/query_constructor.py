@@ -0,0 +1,239 @@
+# core/query_constructor.py
+import re
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.structured_query import (
+    StructuredQuery, Operation, Comparison, Comparator, Operator
+)
+
+from domain.config import QUERY_CONSTRUCTOR_CACHE_SIZE
+from domain.metadata_schema import METADATA_FIELD_INFO, FIELD_SYNONYMS
+from core.cache import LRUCache
+from core.telemetry import TracedCounter
+
+# How often each path produced the StructuredQuery (per process)
+QUERY_CONSTRUCTOR_STATS = TracedCounter("query_constructor")
+
+_NUMBER = r"(\d[\d,]*(?:\.\d+)?)"
+_METRES = r"(?:m|mt|mtr|mtrs|metres?|meters?)\b\.?"
+_SQ_METRES = r"(?:sq\.?\s*m(?:t|tr|trs|etres?|eters?)?\b\.?|sqm\b|square\s+met(?:re|er)s?\b|m2\b|m²)"
+
+# A user stating "my road is 12 m" means rules with min_road_width <= 12 apply
+NUMERIC_PATTERNS = {
+    "min_road_width": [
+        _NUMBER + r"\s*" + _METRES + r"\s*(?:wide\s+)?(?:road|street|r\.?o\.?w\.?)",
+        r"road\s*(?:width)?\s*(?:of|is|=|:)?\s*" + _NUMBER + r"\s*" + _METRES,
+    ],
+    "min_plot_area": [
+        _NUMBER + r"\s*" + _SQ_METRES + r"\s*(?:plot|land)",
+        r"plot\s*(?:area|size)?\s*(?:of|is|=|:)?\s*" + _NUMBER + r"\s*" + _SQ_METRES,
+    ],
+}
+
+# "DCPR 2034" is the document, not a regulation: the year is skipped and
+# regulation / table numbers have at most three digits
+REGULATION_PATTERNS = [
+    (r"\b(?:reg(?:ulation)?|dcr|dcpr(?!\s*[-–]?\s*(?:19|20)\d\d\b))\.?\s*(?:no\.?\s*)?"
+     r"(\d{1,3}(?!\d)(?:\s*\(\s*[0-9a-z]+\s*\))*)", "Reg {}"),
+    (r"\btable\s*(?:no\.?\s*)?(\d{1,3}[a-z]?)\b", "Table {}"),
+]
+
+# Bare clause references ("FSI under 33(7)") also name a regulation. extract()
+# leaves them to the scheme synonyms; only regulation_ids() uses this
+CLAUSE_PATTERN = r"\b(\d{1,3}\s*\(\s*[0-9a-z]{1,5}\s*\)(?:\s*\(\s*[0-9a-z]{1,5}\s*\))*)"
+
+
+def format_regulation_id(template: str, ident: str) -> str:
+    """Canonical regulation id ("Reg 33(7)(A)", "Table 12A"), shared with ingestion."""
+    return template.format(re.sub(r"\s+", "", ident).upper())
+
+
+# Parsed spans are blanked out with this marker before the cue scan
+_CONSUMED = "\x00"
+
+# Anything that still matches one of these after parsing means the question
+# carries a constraint the rules did not understand -> let the LLM handle it
+UNRESOLVED_CUES = [
+    # Quantities that no numeric pattern claimed
+    _NUMBER + r"\s*(?:" + _SQ_METRES + r"|" + _METRES + r")",
+    r"\b(?:hectares?|acres?|sq\.?\s*f(?:ee)?t|square\s+f(?:ee|oo)t)\b",
+    # Negations / comparatives applied to something we parsed as an equality
+    r"\b(?:not|except|excluding|other\s+than|apart\s+from|more\s+than|less\s+than|"
+    r"at\s+least|at\s+most|above|below|exceeding|up\s*to)\s+(?:in\s+|for\s+|the\s+|a\s+)?" + _CONSUMED,
+    # A land-use zone we have no synonym for (e.g. "green zone")
+    r"\b\w+\s+zone\b",
+]
+
+
+class RuleBasedQueryConstructor:
+    """
+    Deterministic StructuredQuery builder driven by METADATA_FIELD_INFO.
+
+    String fields are matched through FIELD_SYNONYMS, float fields through
+    NUMERIC_PATTERNS and `regulation_id` through REGULATION_PATTERNS.
+    Only fields (and values) that actually exist in the metadata index are
+    emitted, so a fast-path filter can never silently match nothing.
+    """
+
+    def __init__(self, metadata_index=None):
+        self.metadata_index = metadata_index
+        self.fields = {info.name: info.type for info in METADATA_FIELD_INFO}
+
+        self.synonyms: Dict[str, List[Tuple[re.Pattern, str]]] = {}
+        for field, values in FIELD_SYNONYMS.items():
+            if self.fields.get(field) != "string":
+                continue
+            self.synonyms[field] = [
+                (re.compile(pattern, re.IGNORECASE), value)
+                for value, patterns in values.items()
+                for pattern in patterns
+            ]
+        self.numeric = {
+            field: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+            for field, patterns in NUMERIC_PATTERNS.items()
+            if self.fields.get(field) == "float"
+        }
+        self.regulations = [
+            (re.compile(pattern, re.IGNORECASE), template)
+            for pattern, template in REGULATION_PATTERNS
+        ] if "regulation_id" in self.fields else []
+        self.clause = re.compile(CLAUSE_PATTERN, re.IGNORECASE)
+        self.cues = [re.compile(pattern, re.IGNORECASE) for pattern in UNRESOLVED_CUES]
+
+    def _indexed(self, field: str, value=None) -> bool:
+        index = self.metadata_index
+        if index is None:
+            return True
+        if field in index.numeric:
+            return True
+        if field in index.codes:
+            return value is None or value in index.vocabs[field]
+        return False
+
+    def extract(self, question: str) -> Tuple[Dict[str, List], List[str]]:
+        """
+        Returns ({field: [values]}, unresolved_cues) for everything the rules
+        recognise in the question, whether or not the field is indexed.
+        """
+        text = question
+        found: Dict[str, List] = {}
+
+        def consume(match):
+            # Blank out the match so later patterns (and the cue scan) skip it
+            nonlocal text
+            start, end = match.span()
+            text = text[:start] + _CONSUMED * (end - start) + text[end:]
+
+        for pattern, template in self.regulations:
+            for match in list(pattern.finditer(text)):
+                found.setdefault("regulation_id", []).append(
+                    format_regulation_id(template, match.group(1))
+                )
+                consume(match)
+
+        for field, patterns in self.numeric.items():
+            for pattern in patterns:
+                for match in list(pattern.finditer(text)):
+                    found.setdefault(field, []).append(float(match.group(1).replace(",", "")))
+                    consume(match)
+
+        for field, patterns in self.synonyms.items():
+            for pattern, value in patterns:
+                for match in list(pattern.finditer(text)):
+                    if value not in found.get(field, []):
+                        found.setdefault(field, []).append(value)
+                    consume(match)
+
+        unresolved = [m.group(0).strip(_CONSUMED) for cue in self.cues for m in cue.finditer(text)]
+        return found, unresolved
+
+    def regulation_ids(self, question: str) -> List[str]:
+        """Every regulation / table the question names, explicitly or as a bare clause."""
+        found, _ = self.extract(question)
+        ids = found.get("regulation_id", [])
+        for match in self.clause.finditer(question):
+            regulation_id = format_regulation_id("Reg {}", match.group(1))
+            if regulation_id not in ids:
+                ids.append(regulation_id)
+        return ids
+
+    def corpora(self, question: str) -> List[str]:
+        """The corpora the question names ([] = the default ones)."""
+        found, _ = self.extract(question)
+        return found.get("corpus", [])
+
+    def parse(self, question: str) -> Tuple[Optional[StructuredQuery], List[str]]:
+        """
+        Returns (structured_query, unresolved_cues).
+        The query is only trustworthy when `unresolved_cues` is empty.
+        """
+        found, unresolved = self.extract(question)
+
+        comparisons = []
+        for field, values in found.items():
+            if self.fields[field] == "float":
+                if len(set(values)) > 1:
+                    unresolved.append(f"conflicting {field}")
+                    continue
+                if self._indexed(field, values[0]):
+                    comparisons.append(Comparison(
+                        comparator=Comparator.LTE, attribute=field, value=values[0]
+                    ))
+                continue
+
+            matches = [
+                Comparison(comparator=Comparator.EQ, attribute=field, value=value)
+                for value in values if self._indexed(field, value)
+            ]
+            if len(matches) == 1:
+                comparisons.append(matches[0])
+            elif matches:
+                # "Island City vs Suburbs" style questions want either value
+                comparisons.append(Operation(operator=Operator.OR, arguments=matches))
+
+        if not comparisons:
+            query_filter = None
+        elif len(comparisons) == 1:
+            query_filter = comparisons[0]
+        else:
+            query_filter = Operation(operator=Operator.AND, arguments=comparisons)
+
+        return StructuredQuery(query=question, filter=query_filter, limit=None), unresolved
+
+
+def build_query_constructor(rules: RuleBasedQueryConstructor, llm_constructor: Runnable) -> Runnable:
+    """
+    Wrap the LLM query constructor with the rule-based fast path.
+    LLM results are cached per question, so resolving the same question
+    twice (answer cache lookup, then retrieval) costs one LLM call at most.
+    """
+    cache = LRUCache(QUERY_CONSTRUCTOR_CACHE_SIZE)
+
+    def _fast_path(inputs: dict):
+        structured_query, unresolved = rules.parse(inputs["query"])
+        if not unresolved:
+            QUERY_CONSTRUCTOR_STATS["fast_path"] += 1
+            return structured_query
+        structured_query = cache.get(inputs["query"])
+        if structured_query is not None:
+            QUERY_CONSTRUCTOR_STATS["llm_cache_hit"] += 1
+            return structured_query
+        QUERY_CONSTRUCTOR_STATS["llm_fallback"] += 1
+        return None
+
+    def _construct(inputs: dict, config=None) -> StructuredQuery:
+        structured_query = _fast_path(inputs)
+        if structured_query is None:
+            structured_query = llm_constructor.invoke(inputs, config=config)
+            cache.put(inputs["query"], structured_query)
+        return structured_query
+
+    async def _aconstruct(inputs: dict, config=None) -> StructuredQuery:
+        structured_query = _fast_path(inputs)
+        if structured_query is None:
+            structured_query = await llm_constructor.ainvoke(inputs, config=config)
+            cache.put(inputs["query"], structured_query)
+        return structured_query
+
+    return RunnableLambda(_construct, afunc=_aconstruct, name="query_constructor")
@@ -0,0 +1,87 @@
+# core/rephrase.py
+import re
+import hashlib
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from domain.config import REPHRASE_CACHE_SIZE, REPHRASE_HISTORY_MESSAGES
+from core.cache import LRUCache
+from core.query_constructor import RuleBasedQueryConstructor
+from core.telemetry import TracedCounter
+
+# How each follow-up question was made standalone (per process)
+REPHRASE_STATS = TracedCounter("rephrase")
+
+# Words that only make sense with the previous turns in view
+ANAPHORA = re.compile(
+    r"\b(?:it|its|this|that|these|those|they|them|their|such|same|"
+    r"former|latter|aforesaid|said|previous|earlier|mentioned)\b"
+    r"|^\s*(?:and|also|but|so|then|what\s+about|how\s+about|what\s+if)\b",
+    re.IGNORECASE,
+)
+
+# A question naming one of these fields explicitly carries its own context
+ANCHOR_FIELDS = ("regulation_id", "zone", "scheme_type")
+
+
+def is_standalone(question: str, rules: RuleBasedQueryConstructor) -> bool:
+    """Cheap check: no anaphora and an explicit regulation, scheme or zone is named."""
+    if ANAPHORA.search(question):
+        return False
+    found, _ = rules.extract(question)
+    return any(field in found for field in ANCHOR_FIELDS)
+
+
+def _history_digest(chat_history) -> str:
+    digest = hashlib.sha256()
+    for message in chat_history[-REPHRASE_HISTORY_MESSAGES:]:
+        digest.update(message.type.encode())
+        digest.update(b"\0")
+        digest.update(str(message.content).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def create_rephrase_runnable(llm, prompt, rules: RuleBasedQueryConstructor) -> Runnable:
+    """
+    Turns {"input", "chat_history"} into a standalone question.
+
+    The LLM rewrite is skipped on the first turn and for questions that are
+    already standalone; rewrites that do run are cached on
+    (recent history digest, question).
+    """
+    rewrite_chain = prompt | llm | StrOutputParser()
+    cache = LRUCache(REPHRASE_CACHE_SIZE)
+
+    def _shortcut(inputs: dict):
+        question, chat_history = inputs["input"], inputs.get("chat_history") or []
+        if not chat_history:
+            return question, None
+        if is_standalone(question, rules):
+            REPHRASE_STATS["skipped"] += 1
+            return question, None
+        key = (_history_digest(chat_history), question)
+        cached = cache.get(key)
+        if cached is not None:
+            REPHRASE_STATS["cache_hit"] += 1
+            return cached, None
+        REPHRASE_STATS["llm"] += 1
+        return None, key
+
+    def _rephrase(inputs: dict, config=None) -> str:
+        question, key = _shortcut(inputs)
+        if question is None:
+            question = rewrite_chain.invoke(inputs, config=config)
+            cache.put(key, question)
+        return question
+
+    async def _arephrase(inputs: dict, config=None) -> str:
+        question, key = _shortcut(inputs)
+        if question is None:
+            question = await rewrite_chain.ainvoke(inputs, config=config)
+            cache.put(key, question)
+        return question
+
+    return RunnableLambda(_rephrase, afunc=_arephrase, name="rephrase_question")
+
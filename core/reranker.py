@@ -0,0 +1,146 @@
+# core/reranker.py
+import re
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import Field
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain.retrievers.document_compressors import CrossEncoderReranker
+from langchain_community.cross_encoders import BaseCrossEncoder
+
+from domain.config import (
+    RERANKER_MODEL, RERANKER_BACKEND, RERANKER_BATCH_SIZE, RERANKER_MAX_LENGTH,
+    RERANKER_CACHE_SIZE
+)
+from core.cache import LRUCache
+from core.retrieval_policy import RetrievalPolicy
+from core.telemetry import TracedCounter, span
+
+# Cross-encoder pairs served from the score cache vs. actually scored (per process)
+RERANKER_STATS = TracedCounter("reranker")
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class FastCrossEncoder(BaseCrossEncoder):
+    """
+    CPU cross-encoder with a selectable inference backend:
+
+    - "torch": the stock sentence-transformers CrossEncoder (full precision).
+    - "int8":  the same model with its Linear layers dynamically quantized to int8.
+    - "onnx":  the model exported to ONNX and run with ONNX Runtime (needs `optimum[onnxruntime]`).
+
+    All backends return sigmoid scores, like sentence-transformers does for
+    single-logit rerankers, so scores are comparable across backends.
+    """
+
+    def __init__(self, model_name: str = RERANKER_MODEL, backend: str = RERANKER_BACKEND,
+                 batch_size: int = RERANKER_BATCH_SIZE, max_length: int = RERANKER_MAX_LENGTH):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown reranker backend {backend!r}, expected one of {BACKENDS}.")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        if backend == "onnx":
+            try:
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+                from transformers import AutoTokenizer
+            except ImportError as exc:
+                raise ImportError(
+                    "The onnx reranker backend needs optimum with ONNX Runtime. "
+                    "Please install it with `pip install optimum[onnxruntime]`."
+                ) from exc
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+            self.client = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+            return
+
+        from sentence_transformers import CrossEncoder
+        self.client = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        if backend == "int8":
+            import torch
+            # In place: swaps the Linear submodules without re-wiring the CrossEncoder
+            torch.quantization.quantize_dynamic(
+                self.client.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        if not text_pairs:
+            return []
+        if self.backend != "onnx":
+            scores = np.asarray(self.client.predict(
+                text_pairs, batch_size=self.batch_size, show_progress_bar=False
+            ))
+            # Two-label models give (not_relevant, relevant); keep the relevant score
+            return (scores[:, 1] if scores.ndim > 1 else scores).tolist()
+
+        scores = []
+        for start in range(0, len(text_pairs), self.batch_size):
+            batch = text_pairs[start:start + self.batch_size]
+            features = self.tokenizer(
+                [query for query, _ in batch], [text for _, text in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np",
+            )
+            logits = self.client(**features).logits
+            logits = np.asarray(logits)
+            scores.extend(_sigmoid(logits[:, 1] if logits.shape[1] > 1 else logits[:, 0]).tolist())
+        return scores
+
+
+def _query_key(query: str) -> str:
+    # Case and whitespace differences should not defeat the cache
+    normalized = re.sub(r"\s+", " ", query).strip().lower()
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def _chunk_key(doc: Document):
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id is not None:
+        return chunk_id
+    return hashlib.sha1(doc.page_content.encode()).hexdigest()
+
+
+class CachedCrossEncoderReranker(CrossEncoderReranker):
+    """
+    CrossEncoderReranker with an LRU of (query hash, chunk_id) -> score. How
+    many candidates are scored and kept is up to the retrieval policy.
+    """
+
+    score_cache: LRUCache = Field(default_factory=lambda: LRUCache(RERANKER_CACHE_SIZE))
+    policy: RetrievalPolicy = Field(default_factory=RetrievalPolicy)
+
+    def score_documents(self, query: str, documents: Sequence[Document]) -> List[float]:
+        """Scores every document for `query`, only running the model on uncached pairs."""
+        query_key = _query_key(query)
+        keys = [(query_key, _chunk_key(doc)) for doc in documents]
+        scores: List[Optional[float]] = [self.score_cache.get(key) for key in keys]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        RERANKER_STATS["cached_pairs"] += len(documents) - len(missing)
+        RERANKER_STATS["scored_pairs"] += len(missing)
+        if missing:
+            with span("cross_encoder", pairs=len(missing)):
+                fresh = self.model.score([(query, documents[i].page_content) for i in missing])
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                self.score_cache.put(keys[i], scores[i])
+        return scores
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        return self.rerank(query, documents)
+
+    def rerank(self, query: str, documents: Sequence[Document]) -> List[Document]:
+        """The chunks kept for `query`, best first (at most top_n)."""
+        return self.policy.rerank(lambda batch: self.score_documents(query, batch), documents, self.top_n)
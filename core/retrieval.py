@@ -1,33 +1,41 @@
 # core/retrieval.py
-import os
-from typing import Tuple, Dict, Callable
-
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_anthropic import ChatAnthropic
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_history_aware_retriever
+import operator
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import Field
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from langchain_core.runnables.config import run_in_executor
 from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import CrossEncoderReranker
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
 from langchain.retrievers.self_query.base import SelfQueryRetriever
 from langchain.chains.query_constructor.base import AttributeInfo
 from langchain_core.structured_query import (
     StructuredQuery, Operation, Comparison, Comparator, Operator, Visitor
 )
 
-from domain.config import (
-    VECTOR_DB_PATH, EMBEDDING_MODEL, RERANKER_MODEL, 
-    LLM_MODEL, ANTHROPIC_API_KEY
-)
+from domain.config import RERANKER_TOP_N, RRF_K, REGULATION_LOOKUP_MAX_CHUNKS
 from domain.prompts import SYSTEM_PROMPT
 from domain.metadata_schema import METADATA_FIELD_INFO
+from core.metadata_index import MetadataIndex
+from core.sparse_index import reciprocal_rank_fusion
+from core.query_constructor import RuleBasedQueryConstructor, build_query_constructor
+from core.metadata_extraction import REGULATION_LOOKUP_STATS
+from core.rephrase import create_rephrase_runnable
+from core.answer_cache import AnswerCache, index_fingerprint, with_answer_cache
+from core.speculative import SpeculativeRetriever
+from core.reranker import CachedCrossEncoderReranker
+from core.retrieval_policy import RetrievalPolicy
+from core.context_packer import ContextPacker
+from core.warmup import load_embeddings, load_index, load_llm, load_reranker_model
+from core.telemetry import TelemetryCallbackHandler, span
 
-# --- Custom Translator for FAISS (which expects a Callable filter) ---
-class FunctionalTranslator(Visitor):
-    """Translate structure queries to a callable filter function for FAISS."""
+# --- Custom Translator for FAISS (compiles filters to an allowed-row mask) ---
+class ColumnarTranslator(Visitor):
+    """Translate structured queries to a boolean row mask over the metadata index."""
     allowed_operators = [Operator.AND, Operator.OR]
     allowed_comparators = [
         Comparator.EQ,
@@ -38,75 +46,214 @@ class FunctionalTranslator(Visitor):
         Comparator.LTE,
     ]
 
+    _ops = {
+        Comparator.EQ: operator.eq,
+        Comparator.NE: operator.ne,
+        Comparator.GT: operator.gt,
+        Comparator.GTE: operator.ge,
+        Comparator.LT: operator.lt,
+        Comparator.LTE: operator.le,
+    }
+
+    def __init__(self, metadata_index: MetadataIndex, default_mask: Optional[np.ndarray] = None):
+        self.metadata_index = metadata_index
+        # Rows of the default corpora, for queries whose filter names no corpus
+        self.default_mask = default_mask
+
     def _compare(self, value, comparator, target):
         try:
-            if comparator == Comparator.EQ: return value == target
-            if comparator == Comparator.NE: return value != target
-            if comparator == Comparator.GT: return value > target
-            if comparator == Comparator.GTE: return value >= target
-            if comparator == Comparator.LT: return value < target
-            if comparator == Comparator.LTE: return value <= target
+            return bool(self._ops[comparator](value, target))
         except TypeError:
             # Handle mixed types (e.g. string vs float) gracefully
             return False
-        return False
-
-    def visit_operation(self, operation: Operation) -> Callable:
-        args = [arg.accept(self) for arg in operation.arguments]
-        def _filter(metadata: Dict) -> bool:
-            results = [f(metadata) for f in args]
-            if operation.operator == Operator.AND:
-                return all(results)
-            elif operation.operator == Operator.OR:
-                return any(results)
-            return False
-        return _filter
 
-    def visit_comparison(self, comparison: Comparison) -> Callable:
-        def _filter(metadata: Dict) -> bool:
-            val = metadata.get(comparison.attribute)
-            if val is None: return False
-            return self._compare(val, comparison.comparator, comparison.value)
-        return _filter
+    def visit_operation(self, operation: Operation) -> np.ndarray:
+        masks = [arg.accept(self) for arg in operation.arguments]
+        if operation.operator == Operator.AND:
+            return np.logical_and.reduce(masks)
+        elif operation.operator == Operator.OR:
+            return np.logical_or.reduce(masks)
+        return self.metadata_index.none()
+
+    def visit_comparison(self, comparison: Comparison) -> np.ndarray:
+        index = self.metadata_index
+        field, target = comparison.attribute, comparison.value
+        if field in index.numeric:
+            return index.numeric_mask(field, self._ops[comparison.comparator], target)
+        if field in index.codes:
+            return index.categorical_mask(
+                field, lambda value: self._compare(value, comparison.comparator, target)
+            )
+        # Field never populated at ingestion: nothing can match
+        return index.none()
 
     def visit_structured_query(
         self, structured_query: StructuredQuery
     ) -> Tuple[str, dict]:
-        if structured_query.filter is None:
-            kwargs = {}
-        else:
-            kwargs = {"filter": structured_query.filter.accept(self)}
-        return structured_query.query, kwargs
+        mask = None
+        if structured_query.filter is not None:
+            with span("filtering"):
+                mask = structured_query.filter.accept(self)
+        if self.default_mask is not None and "corpus" not in filter_fields(structured_query.filter):
+            mask = self.default_mask if mask is None else mask & self.default_mask
+        return structured_query.query, {} if mask is None else {"filter": mask}
+
+
+def filter_fields(query_filter) -> set:
+    """The attributes a structured filter compares."""
+    if isinstance(query_filter, Comparison):
+        return {query_filter.attribute}
+    if isinstance(query_filter, Operation):
+        return set().union(*(filter_fields(argument) for argument in query_filter.arguments))
+    return set()
+
+def without_fields(query_filter, fields: set):
+    """`query_filter` minus its comparisons on `fields` (None if nothing is left)."""
+    if isinstance(query_filter, Comparison):
+        return None if query_filter.attribute in fields else query_filter
+    if isinstance(query_filter, Operation):
+        arguments = [without_fields(argument, fields) for argument in query_filter.arguments]
+        kept = [argument for argument in arguments if argument is not None]
+        if query_filter.operator == Operator.OR and len(kept) < len(arguments):
+            # One branch no longer constrains anything, so neither does the OR
+            return None
+        if not kept:
+            return None
+        return kept[0] if len(kept) == 1 else Operation(operator=query_filter.operator, arguments=kept)
+    return query_filter
+
+# --- Hybrid Retriever (dense FAISS + sparse BM25, fused with RRF) ---
+class HybridSelfQueryRetriever(SelfQueryRetriever):
+    """
+    SelfQueryRetriever that runs the (filtered) query against both FAISS and
+    the BM25 index and merges the two rankings with reciprocal rank fusion.
+    Exact-token lookups like "Reg 33(9)" or "Table 12" are carried by BM25.
+
+    Questions that name a regulation or table found in the vectorstore's
+    regulation map skip the query constructor and both searches entirely.
+    How many hits each search fetches and how many fused candidates go on
+    to the reranker is set per question by `policy`.
+    """
+
+    rrf_k: int = RRF_K
+    rules: Optional[RuleBasedQueryConstructor] = None
+    policy: RetrievalPolicy = Field(default_factory=RetrievalPolicy)
+
+    def lookup_regulations(self, query: str) -> List[Document]:
+        """
+        Chunks of the regulations / tables named in `query`, in the corpora it
+        names, that also meet its other constraints (zone, road width, ...),
+        best BM25 match first and at most REGULATION_LOOKUP_MAX_CHUNKS.
+        [] when none are mapped or left, or when the question has constraints
+        only the LLM query constructor can read: those go through the search.
+        """
+        vectorstore = self.vectorstore
+        if self.rules is None or getattr(vectorstore, "regulation_map", None) is None:
+            return []
+        regulation_ids = self.rules.regulation_ids(query)
+        if not regulation_ids:
+            return []
+        chunk_ids = vectorstore.regulation_chunks(regulation_ids, self.rules.corpora(query))
+        if not chunk_ids:
+            return []
+        structured_query, unresolved = self.rules.parse(query)
+        if unresolved:
+            return []
 
-def get_rag_chain():
-    if not os.path.exists(VECTOR_DB_PATH):
-        raise FileNotFoundError(f"Vector store not found at {VECTOR_DB_PATH}.")
+        mask = vectorstore.chunk_mask(chunk_ids)
+        # The map already picked the regulations and corpora; apply what else the question asks
+        constraints = without_fields(structured_query.filter, {"regulation_id", "corpus"})
+        if constraints is not None:
+            with span("filtering"):
+                mask &= constraints.accept(self.structured_query_translator)
+        ranked = vectorstore.sparse_index.search(query, REGULATION_LOOKUP_MAX_CHUNKS, mask)
+        if len(ranked) < REGULATION_LOOKUP_MAX_CHUNKS:
+            # Chunks sharing no term with the question follow in document order
+            seen = set(ranked)
+            ranked += [int(row) for row in np.flatnonzero(mask) if row not in seen][:REGULATION_LOOKUP_MAX_CHUNKS - len(ranked)]
+        return vectorstore.docs_for_rows(ranked)
 
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    vectorstore = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
+    def _get_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        docs = self.lookup_regulations(query)
+        if docs:
+            REGULATION_LOOKUP_STATS["direct"] += 1
+            return docs
+        REGULATION_LOOKUP_STATS["search"] += 1
+        return super()._get_relevant_documents(query, run_manager=run_manager)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        docs = self.lookup_regulations(query)
+        if docs:
+            REGULATION_LOOKUP_STATS["direct"] += 1
+            return docs
+        REGULATION_LOOKUP_STATS["search"] += 1
+        return await super()._aget_relevant_documents(query, run_manager=run_manager)
+
+    def _get_docs_with_query(self, query: str, search_kwargs: Dict[str, Any]) -> List[Document]:
+        mask = search_kwargs.get("filter")
+        vectorstore = self.vectorstore
+        allowed = vectorstore.n_rows if mask is None else int(mask.sum())
+
+        with span("embedding"):
+            embedding = vectorstore.embedding_function.embed_query(query)
+        dense_rows, dense_scores = vectorstore.search_rows(embedding, self.policy.dense_fetch_k, mask)
+        k = search_kwargs.get("k") or self.policy.candidates(dense_scores, vectorstore.descending, allowed)
+        fetch_k = self.policy.fetch_k(k)
+        sparse_rows = vectorstore.sparse_index.search(query, fetch_k, mask)
+        rows = reciprocal_rank_fusion([dense_rows[:fetch_k], sparse_rows], self.rrf_k)[:k]
+        return vectorstore.docs_for_rows(rows)
+
+    async def _aget_docs_with_query(self, query: str, search_kwargs: Dict[str, Any]) -> List[Document]:
+        return await run_in_executor(None, self._get_docs_with_query, query, search_kwargs)
+
+def get_rag_chain(speculative: bool = False, embeddings=None, vectorstore=None, llm=None, reranker_model=None,
+                  answer_cache: Optional[AnswerCache] = None, retrieval_policy: Optional[RetrievalPolicy] = None):
+    """
+    Builds the RAG chain. With `speculative=True` the async entry points
+    (`ainvoke` / `astream`) start dense retrieval and reranking on the raw
+    question while the rephrase and self-query LLM calls are still running.
+    `retrieval_policy` defaults to the RETRIEVAL_POLICY one.
+
+    Components already loaded elsewhere (see core.warmup) can be passed in;
+    the missing ones are loaded here, one after another.
+    """
+    if vectorstore is None:
+        vectorstore = load_index()
+    if embeddings is None:
+        embeddings = load_embeddings()
+    vectorstore.embedding_function = embeddings
 
     # Setup LLM
-    llm = ChatAnthropic(
-        model_name=LLM_MODEL,
-        temperature=0,
-        api_key=ANTHROPIC_API_KEY
-    )
+    if llm is None:
+        llm = load_llm()
 
     # --- SELF-QUERY RETRIEVER ---
     document_content_description = "DCPR 2034 Regulations for Mumbai"
     
-    self_query_retriever = SelfQueryRetriever.from_llm(
+    if retrieval_policy is None:
+        retrieval_policy = RetrievalPolicy()
+    translator = ColumnarTranslator(vectorstore.metadata_index, vectorstore.default_mask)
+    # Most questions name their filters plainly ("Island City", "12 m road"):
+    # parse those locally and only pay for the LLM call when the rules are unsure
+    rules = RuleBasedQueryConstructor(vectorstore.metadata_index)
+    self_query_retriever = HybridSelfQueryRetriever.from_llm(
         llm,
         vectorstore,
         document_content_description,
         METADATA_FIELD_INFO,
-        structured_query_translator=FunctionalTranslator(), # Use our custom translator
+        structured_query_translator=translator, # Pre-filters via FAISS IDSelector
+        rules=rules, # Direct regulation-id lookups
+        policy=retrieval_policy, # Search depth per question
         verbose=True
     )
+    self_query_retriever.query_constructor = build_query_constructor(
+        rules, self_query_retriever.query_constructor,
+    )
     
-    # --- HYBRID PIPELINE (Self-Query + Reranker) ---
-    reranker_model = HuggingFaceCrossEncoder(model_name=RERANKER_MODEL)
-    compressor = CrossEncoderReranker(model=reranker_model, top_n=7)
+    # --- RERANKING PIPELINE (Hybrid Self-Query + Reranker) ---
+    if reranker_model is None:
+        reranker_model = load_reranker_model()
+    compressor = CachedCrossEncoderReranker(model=reranker_model, top_n=RERANKER_TOP_N, policy=retrieval_policy)
     
     compression_retriever = ContextualCompressionRetriever(
         base_compressor=compressor, 
@@ -133,9 +280,9 @@ def get_rag_chain():
         ]
     )
     
-    history_aware_retriever = create_history_aware_retriever(
-        llm, compression_retriever, contextualize_q_prompt
-    )
+    # Skips the rewrite for first turns and already-standalone questions,
+    # and caches the rewrites that do happen
+    rephrase_question = create_rephrase_runnable(llm, contextualize_q_prompt, rules)
 
     # --- QA CHAIN ---
     qa_prompt = ChatPromptTemplate.from_messages(
@@ -147,7 +294,43 @@ def get_rag_chain():
     )
 
     # Create Chain
-    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+    # The reranked chunks are packed into a token budget (adjacent chunks merged,
+    # splitter overlap removed); the `context` documents themselves are unchanged
+    packer = ContextPacker()
+    question_answer_chain = (
+        RunnableLambda(lambda inputs: {**inputs, "context": packer.pack(inputs["context"])})
+        | qa_prompt
+        | llm
+        | StrOutputParser()
+    ).with_config(run_name="answer_question")
+    if speculative:
+        speculative_retriever = SpeculativeRetriever(
+            vectorstore, translator, self_query_retriever.query_constructor, compressor,
+            compression_retriever, self_query_retriever.lookup_regulations, retrieval_policy,
+        )
+        start_speculation, retrieve_documents = speculative_retriever.as_runnables()
+    else:
+        start_speculation = RunnablePassthrough()
+        retrieve_documents = itemgetter("standalone_question") | compression_retriever
+
+    retrieval_chain = RunnablePassthrough.assign(
+        context=retrieve_documents.with_config(run_name="retrieve_documents")
+    ).assign(answer=question_answer_chain)
+
+    # --- ANSWER CACHE ---
+    # Repeat questions (same standalone question, filter, regulations and numbers) skip retrieval and generation
+    if answer_cache is None:
+        answer_cache = AnswerCache(embeddings, index_fingerprint(*(corpus["path"] for corpus in vectorstore.corpora)))
+    rag_chain = (
+        start_speculation
+        | RunnablePassthrough.assign(standalone_question=rephrase_question)
+        | with_answer_cache(
+            retrieval_chain, answer_cache, self_query_retriever.query_constructor, vectorstore, rules
+        )
+    ).with_config(
+        run_name="retrieval_chain",
+        # Per-stage LLM spans and token counts for the request's trace (core.telemetry)
+        callbacks=[TelemetryCallbackHandler()],
+    )
 
     return rag_chain
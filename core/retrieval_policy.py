@@ -0,0 +1,114 @@
+# core/retrieval_policy.py
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from domain.config import (
+    RETRIEVAL_POLICY, HYBRID_FETCH_K, RERANK_CANDIDATES, ADAPTIVE_MIN_CANDIDATES, ADAPTIVE_MAX_CANDIDATES,
+    ADAPTIVE_MAX_FETCH_K, ADAPTIVE_DENSE_MARGIN, ADAPTIVE_RERANK_STEP, ADAPTIVE_CONFIDENT_SCORE,
+    ADAPTIVE_SCORE_GAP
+)
+from core.telemetry import TracedCounter
+
+# How often each shortcut fired, and the cross-encoder pairs / chunks it saved (per process)
+ADAPTIVE_STATS = TracedCounter("adaptive_retrieval")
+
+POLICIES = ("adaptive", "fixed")
+
+
+class RetrievalPolicy:
+    """
+    How deep one question searches and reranks, and how many chunks it keeps.
+
+    "fixed": RERANK_CANDIDATES fused candidates from HYBRID_FETCH_K hits per
+    search, all cross-encoded, the best top_n kept.
+
+    "adaptive":
+    - Depth: dense hits scoring within ADAPTIVE_DENSE_MARGIN of the best
+      (as a share of the score range of the ADAPTIVE_MAX_FETCH_K hits) are
+      competitive. Their count, between ADAPTIVE_MIN_CANDIDATES and
+      ADAPTIVE_MAX_CANDIDATES, sets how many fused candidates are reranked.
+      A filter keeping fewer rows narrows the pool to them. Each search then
+      fetches twice the depth (at least HYBRID_FETCH_K).
+    - Early exit: candidates are cross-encoded ADAPTIVE_RERANK_STEP at a
+      time in fused order. Scoring stops once one chunk dominates (it scores
+      at least ADAPTIVE_CONFIDENT_SCORE and ADAPTIVE_SCORE_GAP above the
+      next), or once a whole step adds nothing to the top_n.
+    - Trimming: when the best chunk dominates every chunk of other
+      regulations by ADAPTIVE_SCORE_GAP, only its regulation's chunks are kept.
+    """
+
+    def __init__(self, name: str = RETRIEVAL_POLICY):
+        if name not in POLICIES:
+            raise ValueError(f"Unknown retrieval policy {name!r}, expected one of {POLICIES}.")
+        self.name = name
+        self.adaptive = name == "adaptive"
+
+    # --- DEPTH ---
+    @property
+    def dense_fetch_k(self) -> int:
+        """Dense hits to fetch before the depth is known."""
+        return ADAPTIVE_MAX_FETCH_K if self.adaptive else HYBRID_FETCH_K
+
+    def candidates(self, dense_scores: Sequence[float], descending: bool, allowed: int) -> int:
+        """Fused candidates to rerank, from the dense scores (best first) and the rows the filter allows."""
+        if not self.adaptive:
+            return min(RERANK_CANDIDATES, allowed)
+        scores = np.asarray(dense_scores, dtype=np.float64)
+        if len(scores) == 0:
+            return min(ADAPTIVE_MIN_CANDIDATES, allowed)
+        # Distance from the best hit as a share of the whole range (0 = best, 1 = worst)
+        gaps = np.abs(scores - scores[0])
+        spread = gaps.max()
+        competitive = len(scores) if spread == 0 else int((gaps <= ADAPTIVE_DENSE_MARGIN * spread).sum())
+        depth = int(np.clip(competitive, ADAPTIVE_MIN_CANDIDATES, ADAPTIVE_MAX_CANDIDATES))
+        return min(depth, allowed)
+
+    def fetch_k(self, candidates: int) -> int:
+        """Hits taken from each of the dense and BM25 searches for `candidates` fused ones."""
+        if not self.adaptive:
+            return HYBRID_FETCH_K
+        return min(ADAPTIVE_MAX_FETCH_K, max(HYBRID_FETCH_K, 2 * candidates))
+
+    # --- RERANKING ---
+    def _dominates(self, scores: List[float]) -> bool:
+        return scores[0] >= ADAPTIVE_CONFIDENT_SCORE and (len(scores) == 1 or scores[0] - scores[1] >= ADAPTIVE_SCORE_GAP)
+
+    def rerank(self, score: Callable[[Sequence[Document]], List[float]], documents: Sequence[Document],
+               top_n: int) -> List[Document]:
+        """The top_n `documents` by `score` (cross-encoder scores of a batch), best first."""
+        if not self.adaptive:
+            scored = list(zip(documents, score(documents)))
+            return [doc for doc, _ in sorted(scored, key=lambda pair: pair[1], reverse=True)[:top_n]]
+
+        scored: List[Tuple[Document, float]] = []
+        for start in range(0, len(documents), ADAPTIVE_RERANK_STEP):
+            step = documents[start:start + ADAPTIVE_RERANK_STEP]
+            scored.extend(zip(step, score(step)))
+            scored.sort(key=lambda pair: pair[1], reverse=True)
+            remaining = len(documents) - start - len(step)
+            if not remaining:
+                break
+            # Later candidates rank lower in the fusion; stop once they stop mattering
+            kept = {id(doc) for doc, _ in scored[:top_n]}
+            settled = start > 0 and not any(id(doc) in kept for doc in step)
+            if settled or self._dominates([s for _, s in scored]):
+                ADAPTIVE_STATS["early_exit"] += 1
+                ADAPTIVE_STATS["pairs_skipped"] += remaining
+                break
+        return self.trim(scored[:top_n])
+
+    def trim(self, ranked: List[Tuple[Document, float]]) -> List[Document]:
+        """The kept chunks of `ranked` (best first), cut to the best one's regulation when it dominates."""
+        if not ranked:
+            return []
+        best, best_score = ranked[0]
+        regulation_id = best.metadata.get("regulation_id")
+        if regulation_id and best_score >= ADAPTIVE_CONFIDENT_SCORE:
+            others = [score for doc, score in ranked if doc.metadata.get("regulation_id") != regulation_id]
+            if others and best_score - max(others) >= ADAPTIVE_SCORE_GAP:
+                ADAPTIVE_STATS["trimmed"] += 1
+                ADAPTIVE_STATS["chunks_dropped"] += len(others)
+                return [doc for doc, _ in ranked if doc.metadata.get("regulation_id") == regulation_id]
+        return [doc for doc, _ in ranked]
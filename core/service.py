@@ -0,0 +1,237 @@
+# core/service.py
+"""
+Headless query service: the RAG chain behind an async HTTP API, so one
+process (one copy of the embedder, cross-encoder, index and LLM client)
+serves every user, and Streamlit is only a thin client (SERVICE_URL).
+
+    python -m core.service                  # listens on SERVICE_HOST:SERVICE_PORT
+
+    POST /query   {"input", "messages": [{"role", "content"}], "memory", "session_id"}
+                  -> NDJSON stream of core.api events: {"sources"}, {"answer"}..., {"cached"},
+                     then {"done", "memory", "coalesced", "trace"} (or {"error"})
+    GET  /sources?chunk_ids=1,2  source snippets, for messages that store only chunk_id references
+    GET  /health  warm-up state, chain runs in flight and queued
+    GET  /metrics Prometheus text (core.telemetry)
+
+The chain runs on its async path (with speculative retrieval): LLM calls are
+awaited, and the blocking stages (embedding, FAISS, BM25, cross-encoder)
+run on a pool of SERVICE_CPU_WORKERS threads, so slow LLM calls never hold a
+CPU thread. At most SERVICE_MAX_INFLIGHT chain runs go at once; identical
+questions (same bounded history) arriving while one is in flight are
+coalesced onto it and share its retrieval and LLM calls.
+"""
+import json
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+from aiohttp import web
+from langchain_core.messages import AIMessage, HumanMessage
+
+from domain.config import (
+    SERVICE_HOST, SERVICE_PORT, SERVICE_CPU_WORKERS, SERVICE_MAX_INFLIGHT, SERVICE_MAX_QUEUED
+)
+from core.api import chain_events, docstore_snippets, history_messages
+from core.memory import ConversationMemory
+from core.telemetry import TracedCounter, prometheus_text, trace
+from core.warmup import WARMUP
+
+# Chain runs started vs. requests served from one already in flight (per process)
+COALESCING_STATS = TracedCounter("coalescing")
+
+
+def coalescing_key(question: str, history) -> str:
+    """Questions equal up to case and whitespace, with the same history, get the same answer."""
+    digest = hashlib.sha256(" ".join(question.lower().split()).encode())
+    for message in history:
+        digest.update(b"\0" + message.type.encode() + b"\0" + str(message.content).encode())
+    return digest.hexdigest()
+
+
+class Flight:
+    """The events of one chain run, replayed to every request coalesced onto it."""
+
+    def __init__(self):
+        self.events: List[Dict] = []
+        self.done = False
+        self.changed = asyncio.Condition()
+
+    async def publish(self, event: Optional[Dict] = None, done: bool = False):
+        async with self.changed:
+            if event is not None:
+                self.events.append(event)
+            self.done = self.done or done
+            self.changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Dict]:
+        position = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.events) > position or self.done)
+                events, done = self.events[position:], self.done
+            position += len(events)
+            for event in events:
+                yield event
+            if done and position == len(self.events):
+                return
+
+
+class QueryService:
+    def __init__(self, max_inflight: int = SERVICE_MAX_INFLIGHT, max_queued: int = SERVICE_MAX_QUEUED):
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.max_queued = max_queued
+        self.queued = 0
+        self.flights: Dict[str, Flight] = {}
+        self._tasks = set()
+
+    async def chain(self):
+        if not WARMUP.ready:
+            # Only the first requests after a start wait for the models
+            await asyncio.get_running_loop().run_in_executor(None, WARMUP.wait)
+        return WARMUP.chain
+
+    @property
+    def saturated(self) -> bool:
+        return self.slots.locked() and self.queued >= self.max_queued
+
+    def subscribe(self, question: str, history, session_id: Optional[str]):
+        """(the flight answering this question, whether it was already in flight)."""
+        key = coalescing_key(question, history)
+        flight = self.flights.get(key)
+        if flight is not None:
+            COALESCING_STATS["coalesced"] += 1
+            return flight, True
+        COALESCING_STATS["runs"] += 1
+        flight = self.flights[key] = Flight()
+        # A task of its own, so the run finishes (and fills the answer cache)
+        # even if the request that started it disconnects
+        task = asyncio.create_task(self._run(key, flight, question, history, session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return flight, False
+
+    async def _run(self, key: str, flight: Flight, question: str, history, session_id: Optional[str]):
+        try:
+            self.queued += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.queued -= 1
+            try:
+                chain = await self.chain()
+                with trace(session_id=session_id) as request_trace:
+                    async for chunk in chain.astream({"input": question, "chat_history": history}):
+                        for event in chain_events([chunk]):
+                            await flight.publish(event)
+                await flight.publish({"trace": request_trace.record()})
+            finally:
+                self.slots.release()
+        except Exception as e:
+            await flight.publish({"error": str(e)})
+        finally:
+            # Later identical questions start a new run (served by the answer cache)
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            await flight.publish(done=True)
+
+    async def answer(self, request: dict) -> AsyncIterator[Dict]:
+        """The events for one /query request, ending with the updated conversation memory."""
+        question = request["input"]
+        messages = history_messages(request.get("messages") or [])
+        memory = ConversationMemory.from_state(request.get("memory"))
+        history = memory.history(messages)
+
+        flight, coalesced = self.subscribe(question, history, request.get("session_id"))
+        answer, request_trace = "", None
+        async for event in flight.follow():
+            if "trace" in event:
+                request_trace = event["trace"]
+                continue
+            if "error" in event:
+                yield event
+                return
+            answer += event.get("answer", "")
+            yield event
+
+        try:
+            await memory.aupdate(messages + [HumanMessage(content=question), AIMessage(content=answer)],
+                                 WARMUP.components["llm"])
+        except Exception as e:
+            print(f"Conversation memory fold failed: {e}")
+        yield {"done": True, "memory": memory.state(), "coalesced": coalesced, "trace": request_trace}
+
+
+# --- HTTP ---
+async def handle_query(request: web.Request) -> web.StreamResponse:
+    service: QueryService = request.app["service"]
+    try:
+        body = await request.json()
+        body["input"]
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text='Expected a JSON body with an "input" question.')
+    if service.saturated:
+        raise web.HTTPServiceUnavailable(text="Too many questions queued, retry shortly.", headers={"Retry-After": "1"})
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    try:
+        async for event in service.answer(body):
+            await response.write((json.dumps(event) + "\n").encode())
+    except ConnectionResetError:
+        # The client left; a coalesced run carries on for the others
+        pass
+    return response
+
+
+async def handle_sources(request: web.Request) -> web.Response:
+    try:
+        chunk_ids = [int(chunk_id) for chunk_id in request.query.get("chunk_ids", "").split(",") if chunk_id]
+    except ValueError:
+        raise web.HTTPBadRequest(text="chunk_ids must be comma-separated integers.")
+    await request.app["service"].chain()
+    snippets = await asyncio.get_running_loop().run_in_executor(
+        None, docstore_snippets, WARMUP.components["vectorstore"], chunk_ids
+    )
+    return web.json_response({str(chunk_id): snippet for chunk_id, snippet in snippets.items()})
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    service: QueryService = request.app["service"]
+    return web.json_response({
+        "state": WARMUP.state,
+        "in_flight": len(service.flights),
+        "queued": service.queued,
+    })
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=prometheus_text(), content_type="text/plain")
+
+
+async def _startup(app: web.Application):
+    # The chain's blocking stages run on the loop's default executor
+    asyncio.get_running_loop().set_default_executor(app["cpu_pool"])
+    # Speculative retrieval only runs on the async path, which is the only one used here
+    WARMUP.start(speculative=True)
+
+
+async def _cleanup(app: web.Application):
+    app["cpu_pool"].shutdown(wait=False)
+
+
+def create_app(cpu_workers: int = SERVICE_CPU_WORKERS) -> web.Application:
+    app = web.Application()
+    app["service"] = QueryService()
+    app["cpu_pool"] = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="service-cpu")
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    app.router.add_post("/query", handle_query)
+    app.router.add_get("/sources", handle_sources)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=SERVICE_HOST, port=SERVICE_PORT)
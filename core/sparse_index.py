@@ -0,0 +1,158 @@
+# core/sparse_index.py
+import os
+import re
+import json
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.telemetry import span
+
+# Regulation / clause ids like 33(7), 33(7)(a), 30(A) stay single tokens
+_CLAUSE_ID = re.compile(r"\b\d+[a-z]?(?:\s*\(\s*[0-9a-z]{1,5}\s*\))+", re.IGNORECASE)
+# "Table 12", "Reg. No. 30", "Appendix IV" -> "table:12", "reg:30", "appendix:iv"
+_LABELLED_ID = re.compile(
+    r"\b(table|reg(?:ulation)?|dcr|appendix|annexure|schedule)\.?\s*(?:no\.?\s*)?(\d+[a-z]?|[ivx]+)\b",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+_LABELS = {"regulation": "reg", "dcr": "reg"}
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or shall that the this "
+    "to under was what which will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    tokens = []
+    for match in _CLAUSE_ID.finditer(text):
+        ident = re.sub(r"\s+", "", match.group(0))
+        head, *parts = ident.split("(")
+        # 33(7)(a) also indexes its parents 33(7), so broader questions still match
+        for depth in range(1, len(parts) + 1):
+            tokens.append(head + "".join("(" + part for part in parts[:depth]))
+    for match in _LABELLED_ID.finditer(text):
+        label = _LABELS.get(match.group(1), match.group(1))
+        tokens.append(f"{label}:{match.group(2)}")
+    tokens.extend(word for word in _WORD.findall(text) if word not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index over the chunk texts (row i = FAISS id i), stored as
+    CSR-style NumPy arrays so a query is a handful of vectorized slices.
+    """
+
+    def __init__(self, vocab: dict, offsets: np.ndarray, postings: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings = postings
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        self.n_rows = len(doc_lengths)
+        avg_length = float(doc_lengths.mean()) if self.n_rows else 0.0
+        self._length_norm = k1 * (1 - b + b * doc_lengths / (avg_length or 1.0))
+        doc_freqs = np.diff(offsets)
+        self._idf = np.log(1 + (self.n_rows - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "BM25Index":
+        term_rows = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[row] = sum(counts.values())
+            for term, count in counts.items():
+                term_rows.setdefault(term, []).append((row, count))
+
+        vocab = {term: i for i, term in enumerate(sorted(term_rows))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        postings, term_freqs = [], []
+        for term, i in vocab.items():
+            entries = term_rows[term]
+            offsets[i + 1] = offsets[i] + len(entries)
+            postings.extend(row for row, _ in entries)
+            term_freqs.extend(count for _, count in entries)
+
+        return cls(
+            vocab, offsets,
+            np.array(postings, dtype=np.int32),
+            np.array(term_freqs, dtype=np.float32),
+            doc_lengths,
+        )
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "BM25Index":
+        texts = []
+        for row in range(vectorstore.index.ntotal):
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+            texts.append(getattr(doc, "page_content", ""))
+        return cls.from_texts(texts)
+
+    # --- PERSISTENCE ---
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(
+            path,
+            vocab=np.array(json.dumps(self.vocab)),
+            offsets=self.offsets,
+            postings=self.postings,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                json.loads(str(data["vocab"])),
+                data["offsets"], data["postings"], data["term_freqs"], data["doc_lengths"],
+            )
+
+    # --- SEARCH ---
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            rows, tf = self.postings[start:end], self.term_freqs[start:end]
+            scores[rows] += self._idf[i] * tf * (self.k1 + 1) / (tf + self._length_norm[rows])
+        return scores
+
+    def search_scored(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """Top-k (rows, BM25 scores), only rows matching at least one term and allowed by `mask`."""
+        with span("bm25_search", k=k, filtered=mask is not None):
+            scores = self.scores(query)
+            candidates = scores > 0
+            if mask is not None:
+                candidates &= mask
+            rows = np.flatnonzero(candidates)
+            if len(rows) > k:
+                rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+            rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [int(row) for row in rows], [float(score) for score in scores[rows]]
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[int]:
+        """Top-k rows by BM25 (only rows matching at least one term, and allowed by `mask`)."""
+        return self.search_scored(query, k, mask)[0]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], rrf_k: int = 60) -> List[int]:
+    """Merge ranked row lists: score(row) = sum over lists of 1 / (rrf_k + rank)."""
+    fused = Counter()
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] += 1.0 / (rrf_k + rank)
+    return [row for row, _ in sorted(fused.items(), key=lambda item: (-item[1], item[0]))]
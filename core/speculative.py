@@ -0,0 +1,168 @@
+# core/speculative.py
+import re
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from domain.config import SPECULATIVE_FETCH_K, SPECULATIVE_MATCH_THRESHOLD, CPU_POOL_WORKERS, RRF_K
+from core.cache import LRUCache
+from core.sparse_index import reciprocal_rank_fusion
+from core.telemetry import TracedCounter, span
+
+# Whether speculative results were reused or thrown away (per process)
+SPECULATION_STATS = TracedCounter("speculation")
+
+# Embedding, FAISS and cross-encoder work never runs on the event loop
+CPU_POOL = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="dcpr-cpu")
+
+
+class SpeculativeResult(NamedTuple):
+    dense_rows: List[int]      # FAISS row ids for the raw question, in dense-score order
+    dense_scores: List[float]  # ... and their scores
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def question_similarity(a: str, b: str) -> float:
+    """Token Jaccard similarity; 1.0 when the rewrite left the question unchanged."""
+    ta, tb = _tokens(a), _tokens(b)
+    if not ta and not tb:
+        return 1.0
+    return len(ta & tb) / len(ta | tb)
+
+
+class SpeculativeRetriever:
+    """
+    Runs dense retrieval + reranking on the raw user input while the
+    rephrase / self-query LLM calls are still in flight.
+
+    The speculative dense pool is fetched wide (SPECULATIVE_FETCH_K) and only
+    limited to the default corpora, so once the filter is known it can be
+    applied to the pool instead of searching FAISS again; the BM25 side of
+    the hybrid fusion is simply rerun. The pool was embedded from the raw
+    question while the regular retriever embeds the self-query's search
+    text, so it is only reused when both the rewrite and that search text are
+    close to the raw question and the filter leaves enough candidates in it;
+    otherwise the regular retriever runs. Search depth and
+    reranking follow the same retrieval policy as the regular retriever.
+    """
+
+    def __init__(self, vectorstore, translator, query_constructor, reranker,
+                 fallback_retriever, direct_lookup, policy):
+        self.vectorstore = vectorstore
+        self.translator = translator
+        self.query_constructor = query_constructor
+        self.reranker = reranker
+        self.fallback_retriever = fallback_retriever
+        # Questions naming a mapped regulation are answered without any search
+        self.direct_lookup = direct_lookup
+        self.policy = policy
+        # Keyed by the raw question; concurrent identical questions share one speculation
+        self.pending = LRUCache(64)
+
+    def speculate(self, question: str) -> SpeculativeResult:
+        with span("embedding", source="speculative"):
+            embedding = self.vectorstore.embedding_function.embed_query(question)
+        # Within the default corpora, which every filter that names no corpus keeps to
+        default_mask = self.vectorstore.default_mask
+        dense_rows, dense_scores = self.vectorstore.search_rows(embedding, SPECULATIVE_FETCH_K, default_mask)
+
+        # Pre-score the unfiltered hybrid candidates; the filtered ones usually overlap them
+        rows = self.fuse(question, dense_rows, dense_scores, default_mask)
+        self.reranker.score_documents(question, self.vectorstore.docs_for_rows(rows))
+        return SpeculativeResult(dense_rows, dense_scores)
+
+    def fuse(self, query: str, dense_rows: List[int], dense_scores: List[float], mask) -> List[int]:
+        """The fused candidates for `query`, as the regular retriever picks them from the same dense hits."""
+        available = self.vectorstore.n_rows if mask is None else int(mask.sum())
+        k = self.policy.candidates(dense_scores[:self.policy.dense_fetch_k], self.vectorstore.descending, available)
+        fetch_k = self.policy.fetch_k(k)
+        sparse_rows = self.vectorstore.sparse_index.search(query, fetch_k, mask)
+        return reciprocal_rank_fusion([dense_rows[:fetch_k], sparse_rows], RRF_K)[:k]
+
+    def start(self, inputs: dict) -> dict:
+        """Kick off speculation for `inputs["input"]` on the CPU pool (no-op if already running)."""
+        question = inputs["input"]
+        if question not in self.pending and not self.direct_lookup(question):
+            # A concurrent.futures.Future, so any event loop can await it
+            # In the caller's context, so its spans join the request's trace
+            self.pending.put(question, CPU_POOL.submit(contextvars.copy_context().run, self.speculate, question))
+        return inputs
+
+    async def astart(self, inputs: dict) -> dict:
+        return self.start(inputs)
+
+    async def aretrieve(self, inputs: dict) -> List[Document]:
+        raw, standalone = inputs["input"], inputs["standalone_question"]
+        future = self.pending.get(raw)
+        if future is None or question_similarity(raw, standalone) < SPECULATIVE_MATCH_THRESHOLD:
+            SPECULATION_STATS["discarded"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+        if self.direct_lookup(standalone):
+            # The rewrite named a mapped regulation; the direct lookup beats the pool
+            SPECULATION_STATS["discarded"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+
+        # Served from the query constructor cache by now (the answer cache resolved it)
+        structured_query = await self.query_constructor.ainvoke({"query": standalone})
+        if question_similarity(raw, structured_query.query) < SPECULATIVE_MATCH_THRESHOLD:
+            # The constructor stripped the filter words: the pool answers a different search text
+            SPECULATION_STATS["discarded"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+        _, search_kwargs = self.translator.visit_structured_query(structured_query)
+        mask = search_kwargs.get("filter")
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except Exception as e:
+            print(f"Speculative retrieval failed, using the regular retriever: {e}")
+            SPECULATION_STATS["failed"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+
+        default_mask = self.vectorstore.default_mask
+        if mask is not None and default_mask is not None and (mask & ~default_mask).any():
+            # The filter reaches into a corpus the pool was not fetched from
+            SPECULATION_STATS["discarded"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+
+        if mask is None:
+            hits = list(zip(result.dense_rows, result.dense_scores))
+            available = self.vectorstore.n_rows
+        else:
+            hits = [(row, score) for row, score in zip(result.dense_rows, result.dense_scores) if mask[row]]
+            available = int(mask.sum())
+
+        # The filtered dense search would have returned min(dense_fetch_k, available)
+        # hits; the pool must hold as many, or its filtered ranking is cut short
+        if len(hits) < min(self.policy.dense_fetch_k, available):
+            SPECULATION_STATS["discarded"] += 1
+            return await self.fallback_retriever.ainvoke(standalone)
+
+        SPECULATION_STATS["reused"] += 1
+        # BM25 is cheap enough to just run exactly, with the filter applied
+        rows = self.fuse(structured_query.query, [row for row, _ in hits], [score for _, score in hits], mask)
+        docs = self.vectorstore.docs_for_rows(rows)
+        # Reranked against the rewrite, as the regular compressor does; when it equals
+        # the raw question the pre-scored pairs come from the reranker's score cache
+        return await asyncio.get_running_loop().run_in_executor(
+            CPU_POOL, contextvars.copy_context().run, self.reranker.rerank, standalone, docs
+        )
+
+    def as_runnables(self):
+        """
+        (start step for the head of the chain, retrieval step for `standalone_question`).
+        Both only speculate on the async path; sync calls use the regular retriever.
+        """
+        start = RunnableLambda(lambda inputs: inputs, afunc=self.astart, name="start_speculation")
+        retrieve = RunnableLambda(
+            lambda inputs: self.fallback_retriever.invoke(inputs["standalone_question"]),
+            afunc=self.aretrieve,
+            name="speculative_retrieval",
+        )
+        return start, retrieve
@@ -0,0 +1,100 @@
+# core/stub_llm.py
+import re
+import json
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from domain.prompts import SYSTEM_PROMPT
+
+# Everything the QA system prompt renders before the retrieved context
+_CONTEXT_PREFIX = SYSTEM_PROMPT.split("{context}")[0]
+_ANSWER_EXCERPT_CHARS = 300
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic, offline stand-in for ChatAnthropic (LLM_BACKEND = "stub").
+
+    Recognises the three prompts the chain sends and answers each without a
+    network call, so benchmarks and offline runs exercise the real pipeline:
+
+    - query construction: a structured request with the question and no filter
+    - follow-up rewriting: the previous user question followed by the latest one
+    - conversation summary: the previous summary plus the user questions folded in
+    - answering: the question plus an excerpt of the first retrieved chunk
+
+    `latency` (seconds per call) simulates a remote model's response time.
+    Token usage is reported as whitespace-separated word counts.
+    """
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def respond(self, messages: List[BaseMessage]) -> str:
+        system = "\n".join(str(m.content) for m in messages if isinstance(m, SystemMessage))
+        humans = [str(m.content) for m in messages if isinstance(m, HumanMessage)]
+        last = humans[-1] if humans else str(messages[-1].content)
+
+        if last.rstrip().endswith("Structured Request:"):
+            query = re.split(r"User Query:\s*", last)[-1].rsplit("Structured Request:", 1)[0].strip()
+            return "```json\n" + json.dumps({"query": query, "filter": "NO_FILTER"}) + "\n```"
+        if "standalone question" in system:
+            # Crude, but keeps the subject of the conversation in the query
+            return " ".join(humans[-2:])
+        if "running summary" in system:
+            previous = re.search(r"Current summary:\n(.*?)\n\nTurns to add:", last, re.DOTALL)
+            questions = re.findall(r"^HUMAN: (.*)$", last, re.MULTILINE)
+            summary = previous.group(1).strip() if previous and previous.group(1).strip() != "(none)" else ""
+            return " ".join(filter(None, [summary, "The user asked: " + "; ".join(questions) + "."]))
+        context = system[len(_CONTEXT_PREFIX):] if system.startswith(_CONTEXT_PREFIX) else ""
+        excerpt = " ".join(context.split())[:_ANSWER_EXCERPT_CHARS]
+        return f"Stub answer to: {last}\n\n{excerpt}".rstrip()
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], text: str) -> dict:
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(text.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.respond(messages)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.respond(messages)
+        # Word by word, keeping the whitespace, like a streamed API response
+        for token in re.split(r"(\s+)", text):
+            if not token:
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # Usage arrives last, as with the Anthropic API
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, text)))
@@ -0,0 +1,315 @@
+# core/telemetry.py
+import time
+import uuid
+import bisect
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from domain.config import LATENCY_BUCKETS_SECONDS, TELEMETRY_WINDOW
+
+# The trace of the request being served; LangChain's executors copy contextvars
+# into their worker threads, so spans recorded there land in the right trace
+_CURRENT: ContextVar[Optional["Trace"]] = ContextVar("dcpr_trace", default=None)
+
+# LLM calls are attributed to the stage of the chain run they happen in
+LLM_STAGES = {
+    "rephrase_question": "rephrase_llm",
+    "query_constructor": "self_query_llm",
+    "answer_question": "answer_llm",
+    "summarize_memory": "memory_llm",
+}
+
+
+# --- PROCESS-WIDE METRICS ---
+class Histogram:
+    """
+    Prometheus-style latency histogram (cumulative bucket counts since start)
+    plus a window of the most recent samples for rolling quantiles.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS, window: int = TELEMETRY_WINDOW):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # Last slot: above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+            self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            values = sorted(self.recent)
+        if not values:
+            return 0.0
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+STAGE_LATENCY: Dict[str, Histogram] = {}
+LLM_TOKENS = Counter()      # (stage, "input" / "output") -> tokens
+REQUESTS = Counter()        # "ok" / "error" -> requests
+_COUNTERS: Dict[str, "TracedCounter"] = {}
+_lock = threading.Lock()
+
+
+def observe(stage: str, seconds: float):
+    histogram = STAGE_LATENCY.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = STAGE_LATENCY.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+
+class TracedCounter(Counter):
+    """
+    Per-process stats counter whose increments are also recorded in the trace
+    of the request that made them (e.g. the answer cache hit of one question).
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        _COUNTERS[name] = self
+
+    def __setitem__(self, key, value):
+        delta = value - self.get(key, 0)
+        super().__setitem__(key, value)
+        current = _CURRENT.get()
+        if current is not None and delta:
+            current.count(self.name, key, delta)
+
+
+# --- PER-REQUEST TRACES ---
+class Trace:
+    """Spans, LLM token counts and cache events of one request."""
+
+    def __init__(self, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.total_seconds: Optional[float] = None
+        self.status = "ok"
+        self.spans: List[dict] = []
+        self.tokens: Dict[str, Counter] = {}
+        self.events: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, started: float, seconds: float, **attrs):
+        with self._lock:
+            self.spans.append({
+                "stage": stage,
+                "start_ms": round((started - self.started) * 1000, 2),
+                "duration_ms": round(seconds * 1000, 2),
+                **attrs,
+            })
+
+    def add_tokens(self, stage: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            tokens = self.tokens.setdefault(stage, Counter())
+            tokens["input"] += input_tokens
+            tokens["output"] += output_tokens
+
+    def count(self, counter: str, key: str, n: int = 1):
+        with self._lock:
+            self.events.setdefault(counter, Counter())[key] += n
+
+    def record(self) -> dict:
+        """The trace as one JSON-serializable record (spans in start order)."""
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                **self.attrs,
+                "status": self.status,
+                "total_ms": round((self.total_seconds or 0.0) * 1000, 2),
+                "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+                "tokens": {stage: dict(tokens) for stage, tokens in self.tokens.items()},
+                "events": {counter: dict(events) for counter, events in self.events.items()},
+            }
+
+
+@contextmanager
+def trace(**attrs):
+    """Collect the spans of everything run inside the block into a new Trace."""
+    current = Trace(**attrs)
+    token = _CURRENT.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        _CURRENT.reset(token)
+        current.total_seconds = time.perf_counter() - current.started
+        observe("total", current.total_seconds)
+        REQUESTS[current.status] += 1
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time the block into the stage histogram (and the current trace, if any)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe(stage, seconds)
+        current = _CURRENT.get()
+        if current is not None:
+            current.add_span(stage, started, seconds, **attrs)
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """
+    Times every chat model call as a span of the stage it runs in (rephrase,
+    self-query or answer LLM), with time to first token and token usage.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._parents: Dict = {}   # chain run_id -> (run name, parent run_id)
+        self._llm_runs: Dict = {}  # llm run_id -> [stage, trace, started, first token]
+        self._lock = threading.Lock()
+
+    def _stage(self, parent_run_id) -> str:
+        while parent_run_id is not None:
+            name, parent_run_id = self._parents.get(parent_run_id, (None, None))
+            if name in LLM_STAGES:
+                return LLM_STAGES[name]
+        return "llm"
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, name=None, **kwargs):
+        with self._lock:
+            self._parents[run_id] = (name or (serialized or {}).get("name"), parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            self._parents.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._parents.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            self._llm_runs[run_id] = [self._stage(parent_run_id), _CURRENT.get(), time.perf_counter(), None]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._llm_runs.get(run_id)
+        if run is not None and run[3] is None:
+            run[3] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, current, started, first_token = run
+        seconds = time.perf_counter() - started
+        observe(stage, seconds)
+
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or usage
+        input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        LLM_TOKENS[(stage, "input")] += input_tokens
+        LLM_TOKENS[(stage, "output")] += output_tokens
+
+        if current is not None:
+            attrs = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+            if first_token is not None:
+                attrs["first_token_ms"] = round((first_token - started) * 1000, 2)
+            current.add_span(stage, started, seconds, **attrs)
+            current.add_tokens(stage, input_tokens, output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._llm_runs.pop(run_id, None)
+
+
+# --- PROMETHEUS EXPORT ---
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_text() -> str:
+    """All process-wide metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP dcpr_stage_seconds Latency of each pipeline stage.",
+        "# TYPE dcpr_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(STAGE_LATENCY.items()):
+        with histogram._lock:
+            counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"dcpr_stage_seconds_bucket{_labels(stage=stage, le=bound)} {cumulative}")
+        lines.append(f'dcpr_stage_seconds_bucket{_labels(stage=stage, le="+Inf")} {count}')
+        lines.append(f"dcpr_stage_seconds_sum{_labels(stage=stage)} {total}")
+        lines.append(f"dcpr_stage_seconds_count{_labels(stage=stage)} {count}")
+
+    lines += [
+        f"# HELP dcpr_stage_recent_seconds Stage latency quantiles over the last {TELEMETRY_WINDOW} samples.",
+        "# TYPE dcpr_stage_recent_seconds gauge",
+    ]
+    for stage, histogram in sorted(STAGE_LATENCY.items()):
+        for q in (0.5, 0.95, 0.99):
+            lines.append(f"dcpr_stage_recent_seconds{_labels(stage=stage, quantile=q)} {histogram.quantile(q)}")
+
+    lines += ["# HELP dcpr_llm_tokens_total LLM tokens by stage.", "# TYPE dcpr_llm_tokens_total counter"]
+    for (stage, kind), tokens in sorted(LLM_TOKENS.items()):
+        lines.append(f"dcpr_llm_tokens_total{_labels(stage=stage, kind=kind)} {tokens}")
+
+    lines += ["# HELP dcpr_events_total Cache and fast-path events.", "# TYPE dcpr_events_total counter"]
+    for name, counter in sorted(_COUNTERS.items()):
+        for key, value in sorted(counter.items()):
+            lines.append(f"dcpr_events_total{_labels(counter=name, event=key)} {value}")
+
+    lines += ["# HELP dcpr_requests_total Traced requests.", "# TYPE dcpr_requests_total counter"]
+    for status, value in sorted(REQUESTS.items()):
+        lines.append(f"dcpr_requests_total{_labels(status=status)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the JSON event log
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics on `port` from a daemon thread (once per process)."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"Serving Prometheus metrics on :{port}/metrics")
+    return _server
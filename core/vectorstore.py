@@ -0,0 +1,333 @@
+# core/vectorstore.py
+import os
+import operator
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from domain.config import (
+    CORPORA, CORPUS_CHUNK_ID_SPAN, SHARD_SEARCH_WORKERS, METADATA_INDEX_FILE, SPARSE_INDEX_FILE, REGULATION_MAP_FILE
+)
+from core.ann_index import filtered_index, load_ann_index, search_parameters
+from core.metadata_index import MetadataIndex
+from core.sparse_index import BM25Index
+from core.metadata_extraction import RegulationMap
+from core.docstore import load_faiss
+from core.telemetry import span
+
+
+class PrefilteredFAISS(FAISS):
+    """
+    FAISS vectorstore that accepts a boolean row mask as `filter`.
+
+    The mask is handed to FAISS as an IDSelectorBitmap, so the ANN search only
+    ever visits allowed rows instead of over-fetching and filtering in Python.
+    Callable / dict filters fall back to the stock LangChain behaviour.
+    """
+
+    metadata_index: MetadataIndex = None
+    sparse_index: BM25Index = None
+    regulation_map: RegulationMap = None
+    # The exact index when `index` is an approximate one (FAISS_INDEX_TYPE)
+    exact_index = None
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter=None, fetch_k: int = 20, **kwargs
+    ) -> List[Tuple[Document, float]]:
+        if not isinstance(filter, np.ndarray):
+            return super().similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+
+        docs = []
+        for row, score in zip(*self.search_rows(embedding, k, filter)):
+            _id = self.index_to_docstore_id[row]
+            doc = self.docstore.search(_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {_id}, got {doc}")
+            docs.append((doc, score))
+
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            cmp = (
+                operator.ge
+                if self.distance_strategy
+                in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+                else operator.le
+            )
+            docs = [(doc, score) for doc, score in docs if cmp(score, score_threshold)]
+        return docs[:k]
+
+    def search_rows(self, embedding: List[float], k: int, mask: Optional[np.ndarray] = None):
+        """Dense top-k as (FAISS rows, scores), restricted to `mask` when given."""
+        with span("faiss_search", k=k, filtered=mask is not None):
+            vector = np.array([embedding], dtype=np.float32)
+            if self._normalize_L2:
+                faiss.normalize_L2(vector)
+
+            if mask is None:
+                scores, indices = self.index.search(vector, k)
+            else:
+                allowed = int(mask.sum())
+                if allowed == 0:
+                    return [], []
+                # The bitmap must stay referenced until the search returns
+                bitmap = np.packbits(mask, bitorder="little")
+                selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+                index = filtered_index(self.index, self.exact_index, allowed)
+                scores, indices = index.search(
+                    vector, min(k, allowed), params=search_parameters(index, selector)
+                )
+
+        hits = [(int(i), float(score)) for i, score in zip(indices[0], scores[0]) if i != -1]
+        return [row for row, _ in hits], [score for _, score in hits]
+
+    def docs_for_rows(self, rows: List[int]) -> List[Document]:
+        return [self.docstore.search(self.index_to_docstore_id[row]) for row in rows]
+
+    def get_by_chunk_ids(self, chunk_ids: List[int]) -> List[Document]:
+        """Resolve ingestion `chunk_id`s back to their Documents (unknown ids are skipped)."""
+        column = self.metadata_index.numeric.get("chunk_id")
+        if column is None:
+            return []
+        docs = []
+        for chunk_id in chunk_ids:
+            rows = np.flatnonzero(column == float(chunk_id))
+            if len(rows):
+                docs.append(self.docstore.search(self.index_to_docstore_id[int(rows[0])]))
+        return docs
+
+
+class PendingEmbeddings(Embeddings):
+    """Stand-in embedder for an index loaded before its embedding model (see core.warmup)."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise RuntimeError("The embedding model has not been loaded yet.")
+
+    def embed_query(self, text: str) -> List[float]:
+        raise RuntimeError("The embedding model has not been loaded yet.")
+
+
+def load_shard(path: str, embeddings: Optional[Embeddings] = None) -> PrefilteredFAISS:
+    """
+    Load one shard's FAISS index plus its columnar metadata, BM25 and regulation
+    indexes. Without `embeddings` the index loads in parallel with the model;
+    set `embedding_function` before searching by text.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Vector store not found at {path}.")
+    if embeddings is None:
+        embeddings = PendingEmbeddings()
+
+    # Memory-mapped docstore and vectors: only the Documents a search returns are decoded
+    vectorstore = load_faiss(path, embeddings, cls=PrefilteredFAISS, mmap=True)
+
+    # FAISS_INDEX_TYPE: an approximate / compressed index serves instead of the exact one
+    # (the memory-mapped exact one stays for selective filters)
+    ann_index = load_ann_index(vectorstore.index, path)
+    if ann_index is not None:
+        vectorstore.exact_index, vectorstore.index = vectorstore.index, ann_index
+
+    metadata_index = MetadataIndex.load(os.path.join(path, METADATA_INDEX_FILE))
+    if metadata_index is None or metadata_index.n_rows != vectorstore.index.ntotal:
+        # Older (or stale) indexes: rebuild the columns from the docstore in memory
+        print("Metadata index missing or stale, rebuilding from docstore...")
+        metadata_index = MetadataIndex.from_vectorstore(vectorstore)
+    vectorstore.metadata_index = metadata_index
+
+    sparse_index = BM25Index.load(os.path.join(path, SPARSE_INDEX_FILE))
+    if sparse_index is None or sparse_index.n_rows != vectorstore.index.ntotal:
+        print("Sparse index missing or stale, rebuilding from docstore...")
+        sparse_index = BM25Index.from_vectorstore(vectorstore)
+    vectorstore.sparse_index = sparse_index
+
+    regulation_map = RegulationMap.load(os.path.join(path, REGULATION_MAP_FILE))
+    if regulation_map is None or regulation_map.n_chunks != vectorstore.index.ntotal:
+        print("Regulation map missing or stale, rebuilding from docstore...")
+        regulation_map = RegulationMap.from_vectorstore(vectorstore)
+    vectorstore.regulation_map = regulation_map
+    return vectorstore
+
+
+# --- SHARDS ---
+# Shard searches of concurrent questions share these threads
+SHARD_POOL = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="dcpr-shard")
+
+
+def fan_out(search, shards: List[int], merge):
+    """
+    `search(shard)` for every shard, on SHARD_POOL when there is more than one
+    (in the caller's context, so the spans join the request's trace).
+    """
+    if len(shards) <= 1:
+        return merge([search(shard) for shard in shards])
+    futures = [SHARD_POOL.submit(contextvars.copy_context().run, search, shard) for shard in shards]
+    return merge([future.result() for future in futures])
+
+
+def merge_by_score(results: List[Tuple[List[int], List[float]]], k: int, descending: bool):
+    """Per-shard (rows, scores) -> the overall top-k (rows, scores)."""
+    hits = sorted(
+        ((score, row) for rows, scores in results for row, score in zip(rows, scores)),
+        key=lambda hit: -hit[0] if descending else hit[0],
+    )[:k]
+    return [row for _, row in hits], [score for score, _ in hits]
+
+
+class ShardedSparseIndex:
+    """The shards' BM25 indexes behind BM25Index.search, over global rows."""
+
+    def __init__(self, store: "ShardedVectorStore"):
+        self.store = store
+        self.n_rows = store.n_rows
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[int]:
+        """
+        Top-k rows by BM25 over the shards `mask` allows. Each shard scores with
+        its own IDF; on corpora of the same kind the scores are close enough to
+        merge directly (RRF only uses the resulting ranks).
+        """
+        store = self.store
+
+        def search(shard):
+            rows, scores = store.shards[shard].sparse_index.search_scored(query, k, store.shard_mask(mask, shard))
+            return [row + int(store.offsets[shard]) for row in rows], scores
+
+        return fan_out(search, store.searched_shards(mask), lambda results: merge_by_score(results, k, True))[0]
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    The corpora of domain.config.CORPORA, each an independently built
+    PrefilteredFAISS shard, searched as one store.
+
+    Rows are global: shard i's rows follow shard i-1's, so the concatenated
+    metadata index, the row masks built from it and the hybrid fusion work as
+    on a single index. A search fans out over a thread pool to the shards
+    with at least one allowed row and merges their hits by score, so a
+    question filtered to one corpus only searches that shard. Questions that
+    name no corpus are limited to the default ones by `default_mask`.
+    """
+
+    def __init__(self, corpora: List[dict], shards: List[PrefilteredFAISS], embeddings: Optional[Embeddings] = None):
+        self.corpora = corpora
+        self.shards = shards
+        self.embedding_function = embeddings or PendingEmbeddings()
+        sizes = [shard.index.ntotal for shard in shards]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.n_rows = int(self.offsets[-1])
+        # Same embedding model everywhere, so the shards share one distance
+        self.descending = shards[0].distance_strategy in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+
+        metadata_index = MetadataIndex.concat([shard.metadata_index for shard in shards])
+        # The corpus column comes from the shard a row is in (older shards do not store it)
+        metadata_index.codes["corpus"] = np.repeat(np.arange(len(shards), dtype=np.int32), sizes)
+        metadata_index.vocabs["corpus"] = [corpus["name"] for corpus in corpora]
+        self.metadata_index = metadata_index
+        self.sparse_index = ShardedSparseIndex(self)
+
+        defaults = [i for i, corpus in enumerate(corpora) if corpus.get("default", True)]
+        self.default_mask = None
+        if defaults and len(defaults) < len(shards):
+            self.default_mask = np.isin(metadata_index.codes["corpus"], defaults)
+        self.regulation_map = RegulationMap.merge([shards[i].regulation_map for i in defaults or range(len(shards))])
+
+    # --- ROWS ---
+    def shard_of(self, row: int) -> int:
+        return int(np.searchsorted(self.offsets, row, side="right")) - 1
+
+    def shard_mask(self, mask: Optional[np.ndarray], shard: int) -> Optional[np.ndarray]:
+        if mask is None:
+            return None
+        return mask[self.offsets[shard]:self.offsets[shard + 1]]
+
+    def searched_shards(self, mask: Optional[np.ndarray]) -> List[int]:
+        """The shards with at least one row allowed by `mask`."""
+        if mask is None:
+            return list(range(len(self.shards)))
+        return [shard for shard in range(len(self.shards)) if self.shard_mask(mask, shard).any()]
+
+    # --- SEARCH ---
+    def search_rows(self, embedding: List[float], k: int, mask: Optional[np.ndarray] = None):
+        """Dense top-k as (global rows, scores) over the shards `mask` allows, merged by score."""
+
+        def search(shard):
+            rows, scores = self.shards[shard].search_rows(embedding, k, self.shard_mask(mask, shard))
+            return [row + int(self.offsets[shard]) for row in rows], scores
+
+        shards = self.searched_shards(mask)
+        with span("shard_search", shards=len(shards)):
+            return fan_out(search, shards, lambda results: merge_by_score(results, k, self.descending))
+
+    def _tag(self, docs: List[Document], shard: int) -> List[Document]:
+        # Chunks ingested before there were corpora do not record theirs
+        for doc in docs:
+            doc.metadata.setdefault("corpus", self.corpora[shard]["name"])
+        return docs
+
+    def docs_for_rows(self, rows: List[int]) -> List[Document]:
+        docs = []
+        for row in rows:
+            shard = self.shard_of(row)
+            docs.extend(self._tag(self.shards[shard].docs_for_rows([row - int(self.offsets[shard])]), shard))
+        return docs
+
+    def get_by_chunk_ids(self, chunk_ids: List[int]) -> List[Document]:
+        """Resolve chunk_ids through the shard of their corpus (unknown ids are skipped)."""
+        shards = {corpus["id"]: shard for shard, corpus in enumerate(self.corpora)}
+        docs = []
+        for chunk_id in chunk_ids:
+            shard = shards.get(int(chunk_id) // CORPUS_CHUNK_ID_SPAN)
+            if shard is not None:
+                docs.extend(self._tag(self.shards[shard].get_by_chunk_ids([chunk_id]), shard))
+        return docs
+
+    def regulation_chunks(self, regulation_ids: List[str], corpora: Optional[List[str]] = None,
+                          limit: Optional[int] = None) -> List[int]:
+        """Direct lookup: chunk_ids of the regulations in the named `corpora` (default ones if none)."""
+        if not corpora:
+            return self.regulation_map.lookup(regulation_ids, limit)
+        maps = [shard.regulation_map for corpus, shard in zip(self.corpora, self.shards) if corpus["name"] in corpora]
+        return RegulationMap.merge(maps).lookup(regulation_ids, limit) if maps else []
+
+    def chunk_mask(self, chunk_ids: List[int]) -> np.ndarray:
+        """Row mask of the given chunk_ids."""
+        column = self.metadata_index.numeric.get("chunk_id")
+        if column is None:
+            return self.metadata_index.none()
+        return np.isin(column, np.asarray(chunk_ids, dtype=column.dtype))
+
+    # --- VectorStore ---
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        rows, _ = self.search_rows(self.embedding_function.embed_query(query), k, self.default_mask)
+        return self.docs_for_rows(rows)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Shards are built by core.ingestion.")
+
+
+def load_vectorstore(embeddings: Optional[Embeddings] = None, corpora: List[dict] = CORPORA) -> ShardedVectorStore:
+    """
+    Load every ingested corpus as a shard (corpora not ingested yet are
+    skipped). Without `embeddings` the shards load in parallel with the
+    model; set `embedding_function` before searching by text.
+    """
+    loaded, shards = [], []
+    for corpus in corpora:
+        if not os.path.exists(corpus["path"]):
+            print(f"Corpus {corpus['name']} not ingested yet ({corpus['path']} missing), skipping it.")
+            continue
+        loaded.append(corpus)
+        shards.append(load_shard(corpus["path"], embeddings))
+    if not shards:
+        raise FileNotFoundError(f"Vector store not found at {', '.join(corpus['path'] for corpus in corpora)}.")
+    return ShardedVectorStore(loaded, shards, embeddings)
@@ -0,0 +1,168 @@
+# core/warmup.py
+# Deliberately light: importing this module must not pull in LangChain, torch or
+# FAISS, so the Streamlit login page can render while they load in the background.
+import json
+import time
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from domain.config import EMBEDDING_MODEL, LLM_MODEL, LLM_BACKEND, LLM_BASE_URL, ANTHROPIC_API_KEY, WARMUP_WORKERS
+
+IDLE, LOADING, READY, FAILED = "idle", "loading", "ready", "failed"
+
+
+# --- COMPONENT LOADERS (heavy imports happen on first call) ---
+def load_embeddings():
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def load_reranker_model():
+    from core.reranker import FastCrossEncoder
+    # Backend (torch / int8 / onnx), batch size and max length come from domain.config
+    return FastCrossEncoder()
+
+
+def load_index():
+    from core.vectorstore import load_vectorstore
+    # Loaded without the embedder so the two can load concurrently;
+    # get_rag_chain attaches it
+    return load_vectorstore()
+
+
+def load_llm():
+    if LLM_BACKEND == "stub":
+        from core.stub_llm import StubChatModel
+        return StubChatModel()
+
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model_name=LLM_MODEL, temperature=0, api_key=ANTHROPIC_API_KEY, base_url=LLM_BASE_URL)
+
+
+def _components():
+    """name -> (modules to import, loader). Looked up at call time so loaders can be swapped."""
+    return {
+        "embeddings": (("sentence_transformers", "langchain_community.embeddings"), load_embeddings),
+        "reranker_model": (("core.reranker",), load_reranker_model),
+        "vectorstore": (("faiss", "core.vectorstore"), load_index),
+        "llm": (("core.stub_llm",) if LLM_BACKEND == "stub" else ("langchain_anthropic",), load_llm),
+    }
+
+
+def pipeline_stats() -> Dict[str, Dict]:
+    """The per-process counters of the retrieval helpers (imports them on first call)."""
+    from core.query_constructor import QUERY_CONSTRUCTOR_STATS
+    from core.rephrase import REPHRASE_STATS
+    from core.answer_cache import ANSWER_CACHE_STATS
+    from core.metadata_extraction import REGULATION_LOOKUP_STATS
+    from core.memory import MEMORY_STATS
+    from core.retrieval_policy import ADAPTIVE_STATS
+    return {
+        "query_constructor": dict(QUERY_CONSTRUCTOR_STATS),
+        "rephrase": dict(REPHRASE_STATS),
+        "answer_cache": dict(ANSWER_CACHE_STATS),
+        "regulation_lookup": dict(REGULATION_LOOKUP_STATS),
+        "memory": dict(MEMORY_STATS),
+        "adaptive_retrieval": dict(ADAPTIVE_STATS),
+    }
+
+
+class Warmup:
+    """
+    Background, process-wide loader for the RAG chain.
+
+    `start()` (idempotent) loads the embedder, cross-encoder, FAISS index and
+    LLM client concurrently on a small thread pool, then assembles them with
+    `get_rag_chain`. Callers can poll `state` and block on `wait()` only when
+    they actually need the chain.
+
+    `report` records the seconds spent importing each heavy module and loading
+    each component (wall time on overlapping threads), plus `ready_seconds`
+    from `start()` to a usable chain.
+    """
+
+    def __init__(self, workers: int = WARMUP_WORKERS):
+        self.workers = workers
+        self.state = IDLE
+        self.chain = None
+        self.components: Dict = {}   # The loaded embedder, reranker, index and LLM
+        self.error: Optional[BaseException] = None
+        self.report: Dict = {"imports": {}, "loads": {}}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def start(self, speculative: bool = False) -> "Warmup":
+        with self._lock:
+            if self._thread is None:
+                self.state = LOADING
+                self._thread = threading.Thread(
+                    target=self._run, args=(speculative,), name="warmup", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None):
+        """Returns the chain once it is loaded (starting the warm-up if needed); re-raises load errors."""
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Model warm-up did not finish within {timeout} s.")
+        if self.error is not None:
+            raise self.error
+        return self.chain
+
+    # --- LOADING ---
+    def _import(self, module: str):
+        started = time.perf_counter()
+        importlib.import_module(module)
+        elapsed = round(time.perf_counter() - started, 3)
+        with self._lock:
+            self.report["imports"].setdefault(module, elapsed)
+
+    def _load(self, name: str, modules, loader):
+        for module in modules:
+            self._import(module)
+        started = time.perf_counter()
+        component = loader()
+        self.report["loads"][name] = round(time.perf_counter() - started, 3)
+        return component
+
+    def _run(self, speculative: bool):
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="warmup") as pool:
+                futures = {
+                    name: pool.submit(self._load, name, modules, loader)
+                    for name, (modules, loader) in _components().items()
+                }
+                # Mostly shared with the components above, so nearly free by the time it runs
+                chain_imports = pool.submit(self._import, "core.retrieval")
+                components = {name: future.result() for name, future in futures.items()}
+                chain_imports.result()
+
+            self.components = components
+            from core.retrieval import get_rag_chain
+            chain_started = time.perf_counter()
+            self.chain = get_rag_chain(speculative, **components)
+            self.report["loads"]["chain"] = round(time.perf_counter() - chain_started, 3)
+            self.state = READY
+        except Exception as exc:
+            self.error = exc
+            self.state = FAILED
+        finally:
+            self.report["state"] = self.state
+            self.report["ready_seconds"] = round(time.perf_counter() - started, 3)
+            if self.error is not None:
+                self.report["error"] = str(self.error)
+            self._done.set()
+            print(json.dumps({"event_type": "warmup", "data": self.report}))
+
+
+# Shared by every Streamlit session in the process
+WARMUP = Warmup()
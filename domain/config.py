@@ -7,15 +7,168 @@ load_dotenv()
 # File Paths
 PDF_PATH = "PEATA.pdf"
 VECTOR_DB_PATH = "faiss_index"
+# Files next to the FAISS index in every shard directory
+METADATA_INDEX_FILE = "metadata_index.npz"
+SPARSE_INDEX_FILE = "bm25_index.npz"
+ANN_INDEX_FILE = "ann_index.faiss"
+REGULATION_MAP_FILE = "regulation_map.json"
+ANSWER_CACHE_PATH = os.path.join("cache", "answer_cache.sqlite")
+PARSE_CACHE_DIR = os.path.join("cache", "parse")
+EMBEDDING_CACHE_PATH = os.path.join("cache", "embeddings.sqlite")
 
 # Model Configs
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 LLM_MODEL = "claude-sonnet-4-5-20250929"
+# "anthropic" (default) or "stub" for offline runs with a deterministic local model (core/stub_llm.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "anthropic")
+# Anthropic-compatible endpoint to use instead of the public API (e.g. the fake server in bench/fake_llm.py)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")
+
+# Corpora Config
+# Every corpus is ingested into its own index shard (`python -m core.ingestion --corpus <name>`
+# rebuilds one without touching the others) and the shards are searched in parallel.
+#   name     value of the `corpus` metadata field, which questions can filter on
+#   id       fixes the corpus' chunk_id range (id * CORPUS_CHUNK_ID_SPAN onwards); never reuse one
+#   default  searched when a question names no corpus
+#   aliases  regexes that limit a question to the corpus. A default corpus is searched anyway, so its
+#            aliases must be restricting wording ("only DCPR"): a bare "DCPR" is in most questions and
+#            would drop the other default corpora
+CORPORA = [
+    {"name": "DCPR 2034", "id": 0, "pdf": PDF_PATH, "path": VECTOR_DB_PATH, "default": True,
+     "aliases": [r"\bonly\s+(?:in\s+|under\s+)?(?:the\s+)?(?:original\s+)?DCPR\b(?!(?:\s+2034)?\s+amendments?)",
+                 r"\bDCPR(?:\s+2034)?\s+itself\b", r"\boriginal\s+DCPR\b"]},
+    # {"name": "DCPR 2034 Amendments", "id": 1, "pdf": "DCPR_amendments.pdf", "path": "faiss_index_amendments",
+    #  "default": True, "aliases": [r"\bamendments?\b"]},
+    # {"name": "UDCPR 2020", "id": 2, "pdf": "UDCPR.pdf", "path": "faiss_index_udcpr", "default": False,
+    #  "aliases": [r"\bUDCPR\b", r"unified\s+DCPR"]},
+]
+CORPUS_CHUNK_ID_SPAN = 1_000_000   # chunk_ids per corpus
+SHARD_SEARCH_WORKERS = 4           # Threads searching the shards of one question in parallel
+
+# Vector Index Config
+# Serving index: "flat" (exact), "hnsw", "hnsw_sq8", "sq8", "ivf_flat", "ivf_sq8" or "ivf_pq"
+# (compare them with `python -m bench.index`). Ingestion always keeps the exact index too.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+HNSW_M = 32                  # Graph neighbours per node (memory vs. recall)
+HNSW_EF_CONSTRUCTION = 80    # Build-time search width
+HNSW_EF_SEARCH = 64          # Query-time search width (latency vs. recall)
+IVF_NLIST = 0                # Inverted lists; 0 = 4 * sqrt(chunks), at most chunks / 39
+IVF_NPROBE = 8               # Lists visited per query (latency vs. recall)
+PQ_M = 48                    # Product-quantizer sub-vectors (must divide the 384 dimensions)
+PQ_NBITS = 8                 # Bits per sub-vector code
+ANN_EXACT_FILTER_SHARE = 0.1 # Filtered searches keeping at most this share of chunks use the exact index
+
+# Hybrid Retrieval Config
+HYBRID_FETCH_K = 20    # Candidates taken from each of FAISS and BM25 before fusion
+RRF_K = 60             # Reciprocal rank fusion damping constant
+REGULATION_LOOKUP_MAX_CHUNKS = 20   # Chunks handed to the reranker for a direct regulation / table lookup
+
+# Reranker Config
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")   # "torch", "int8" or "onnx"
+RERANKER_BATCH_SIZE = 32
+RERANKER_MAX_LENGTH = 512      # Tokens per (question, chunk) pair
+RERANKER_TOP_N = 7
+RERANKER_CACHE_SIZE = 4096     # Cached (question, chunk_id) scores
+
+# Retrieval Policy Config (core/retrieval_policy.py)
+# "adaptive" (default): search depth, reranking and kept chunks follow the question;
+# "fixed": RERANK_CANDIDATES candidates, all reranked, RERANKER_TOP_N kept
+RETRIEVAL_POLICY = os.getenv("RETRIEVAL_POLICY", "adaptive")
+RERANK_CANDIDATES = 20         # Fixed policy: fused candidates cross-encoded per question
+ADAPTIVE_MIN_CANDIDATES = 8    # Fused candidates reranked for the clearest questions
+ADAPTIVE_MAX_CANDIDATES = 20   # ... and for the least clear ones
+ADAPTIVE_MAX_FETCH_K = 40      # Dense hits whose scores set the depth; widest dense / BM25 fetch
+ADAPTIVE_DENSE_MARGIN = 0.25   # Dense hits this close to the best (share of the score range) are competitive
+ADAPTIVE_RERANK_STEP = 8       # Candidates cross-encoded between early-exit checks
+ADAPTIVE_CONFIDENT_SCORE = 0.9 # Cross-encoder score of a chunk that can dominate
+ADAPTIVE_SCORE_GAP = 0.5       # Lead over the rest that makes it dominate (stop reranking, drop other regulations)
+
+# Parsing Config
+# "llamaparse" (default) or "stub" for offline runs with plain pypdf text extraction
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "llamaparse")
+
+# Ingestion Pipeline Config
+INGEST_PARSE_BATCH = 8         # Pages per parser job
+INGEST_PARSE_WORKERS = 4       # Parser jobs in flight (LlamaParse is network bound)
+INGEST_EMBED_BATCH = 64        # Chunks per embedding batch
+# Embedding processes; 1 embeds in the ingesting process
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", min(4, os.cpu_count() or 1)))
 
 # Chunking Config
+# "structure" (split on headings / regulations, tables kept whole) or "recursive" (fixed size)
+CHUNKER = os.getenv("CHUNKER", "structure")
 CHUNK_SIZE = 2000
-CHUNK_OVERLAP = 500
+CHUNK_OVERLAP = 500            # Recursive chunker: overlap between every pair of chunks
+SECTION_SPLIT_OVERLAP = 200    # Structure chunker: only inside a paragraph too long for one chunk
+TABLE_MAX_SIZE = CHUNK_SIZE    # Larger tables are split by rows, repeating the header (bge-small embeds only 512 tokens)
+
+# Context Packing Config (answer prompt)
+CONTEXT_TOKEN_BUDGET = 3000   # Estimated tokens of retrieved text per answer prompt
+CONTEXT_MIN_TOKENS = 100      # Smallest truncated chunk worth adding
+CHARS_PER_TOKEN = 4           # Token estimate for budgeting (no local Claude tokenizer)
+
+# Conversation Memory Config (chat_history sent with each question)
+MEMORY_RECENT_TURNS = 3       # Question / answer turns always kept verbatim
+MEMORY_FOLD_TURNS = 2         # Older turns folded into the summary together (one LLM call per fold)
+MEMORY_TOKEN_BUDGET = 2000    # Estimated tokens of verbatim history
+MEMORY_SUMMARY_TOKENS = 300   # Cap on the running summary
+
+# Rephrase Config
+REPHRASE_CACHE_SIZE = 256        # Cached follow-up rewrites
+REPHRASE_HISTORY_MESSAGES = 4    # Trailing messages that key a cached rewrite
+
+# Query Constructor Config
+QUERY_CONSTRUCTOR_CACHE_SIZE = 256   # Cached LLM-built structured queries
+
+# Answer Cache Config
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 5000
+ANSWER_CACHE_SIMILARITY = 0.95       # Cosine similarity for a near-duplicate hit
+
+# Speculative Retrieval Config (async chain only)
+SPECULATIVE_FETCH_K = 50              # Unfiltered dense pool fetched for the raw question (> ADAPTIVE_MAX_FETCH_K so filters can be applied to it)
+SPECULATIVE_MATCH_THRESHOLD = 0.9     # Token overlap needed to reuse it for the rewrite
+CPU_POOL_WORKERS = 2                  # Threads for embedding / FAISS / cross-encoder work
+
+# Telemetry Config
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TELEMETRY_WINDOW = 1000    # Recent samples per stage behind the rolling p50 / p95 / p99
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # Prometheus /metrics endpoint (0 = off)
+
+# Warm-up Config
+WARMUP_WORKERS = 4    # Threads loading the embedder, cross-encoder, FAISS index and LLM client at startup
+
+# Query Service Config (core/service.py)
+SERVICE_HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+# Streamlit answers through the service at this URL; empty runs the chain in the Streamlit process
+SERVICE_URL = os.getenv("SERVICE_URL", "")
+# Threads for the blocking stages (embedding, FAISS, BM25, cross-encoder); LLM calls are awaited, not threaded
+SERVICE_CPU_WORKERS = int(os.getenv("SERVICE_CPU_WORKERS", min(4, os.cpu_count() or 1)))
+SERVICE_MAX_INFLIGHT = int(os.getenv("SERVICE_MAX_INFLIGHT", "32"))   # Chain runs at once (coalesced requests share one)
+SERVICE_MAX_QUEUED = 128       # Chain runs waiting for a slot before new questions get a 503
+SERVICE_TIMEOUT = 120          # Seconds the Streamlit client waits for the next streamed line
+
+# Session State Config (app.py)
+SOURCE_SNIPPET_CHARS = 400     # Source text shown per cited chunk (messages store only chunk_id references)
+SNIPPET_CACHE_SIZE = 2048      # Snippets resolved from the docstore, cached per process for all sessions
+SESSION_MAX_CHATS = 5          # Chats kept in st.session_state; the least recently opened spill to the chat store
+CHAT_MAX_MESSAGES = 12         # Messages kept per chat; older ones already in the memory's summary spill
+CHAT_STORE_PATH = os.path.join("cache", "chats.sqlite")
+CHAT_STORE_TTL_SECONDS = 7 * 24 * 3600   # Spilled chats of sessions not seen for this long are deleted
+
+# Batch QA Config (core/batch.py)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))   # Questions in flight at once
+# LLM requests per minute across all questions (your Anthropic tier's limit); 0 = unlimited
+BATCH_LLM_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_LLM_REQUESTS_PER_MINUTE", "50"))
+BATCH_LLM_BURST = 5                 # LLM requests that may start back to back after an idle spell
+BATCH_MAX_RETRIES = 4               # Retries of a failed question before its error is recorded
+BATCH_BACKOFF_SECONDS = 2.0         # First retry waits up to this, doubling per retry (full jitter)
+BATCH_BACKOFF_MAX_SECONDS = 60.0
+BATCH_EMBED_MAX_BATCH = 64          # Query embeddings of concurrent questions run as one batch
+BATCH_RERANK_MAX_PAIRS = 256        # Cross-encoder pairs of concurrent questions scored as one batch
+BATCH_MAX_WAIT_SECONDS = 0.01       # How long a batch waits for more questions' calls to join it
 
 # API Keys
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
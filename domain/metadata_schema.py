@@ -2,6 +2,8 @@
 
 from langchain.chains.query_constructor.base import AttributeInfo
 
+from domain.config import CORPORA
+
 # This schema defines the fields that the LLM can filter by when self-querying.
 # It helps the SelfQueryRetriever understand what metadata is available in the vector store.
 
@@ -36,4 +38,42 @@ METADATA_FIELD_INFO = [
         description="The building category. Examples: 'High-rise', 'Educational', 'Medical', 'IT/Biotech', 'Hospitality'.",
         type="string",
     ),
-]
\ No newline at end of file
+]
+
+# Only worth a filter (and the LLM's attention) once there is more than one corpus
+if len(CORPORA) > 1:
+    METADATA_FIELD_INFO.append(AttributeInfo(
+        name="corpus",
+        description="The document set the text comes from. Only filter on it when the question limits itself to one "
+                    "(e.g. 'only the amendments'), not when it merely mentions DCPR. "
+                    "Values: " + ", ".join(f"'{corpus['name']}'" for corpus in CORPORA) + ".",
+        type="string",
+    ))
+
+# Synonym tables for the rule-based query constructor (core/query_constructor.py).
+# Keys are the canonical values stored in chunk metadata; each one lists the
+# case-insensitive regexes users typically type for it.
+FIELD_SYNONYMS = {
+    "zone": {
+        "Island City": [r"island\s+city", r"south\s+mumbai", r"\bcity\s+limits"],
+        "Suburbs": [r"suburb(?:s|an)?", r"western\s+suburbs", r"eastern\s+suburbs"],
+    },
+    "category": {
+        "Residential": [r"residential", r"\bresi\b", r"\bR[- ]zone"],
+        "Commercial": [r"commercial", r"\bC[- ]zone"],
+        "Industrial": [r"industrial", r"factor(?:y|ies)", r"\bI[- ]zone"],
+        "High-rise": [r"high[- ]?rise"],
+        "Educational": [r"educational", r"schools?", r"colleges?"],
+        "Medical": [r"medical", r"hospitals?"],
+        "IT/Biotech": [r"information\s+technology", r"\bIT\s*/\s*ITES\b", r"biotech"],
+        "Hospitality": [r"hospitality", r"hotels?"],
+    },
+    "scheme_type": {
+        "33(7) Cessed": [r"33\s*\(\s*7\s*\)", r"cessed"],
+        "33(9) Cluster": [r"33\s*\(\s*9\s*\)", r"cluster"],
+        "33(10) SRA": [r"33\s*\(\s*10\s*\)", r"\bSRA\b", r"slum\s+rehab\w*"],
+        "33(5) MHADA": [r"33\s*\(\s*5\s*\)", r"mhada"],
+        "33(11) PTC": [r"33\s*\(\s*11\s*\)", r"\bPTC\b"],
+    },
+    "corpus": {corpus["name"]: corpus.get("aliases", []) for corpus in CORPORA},
+}
@@ -24,4 +24,13 @@ SYSTEM_PROMPT = (
 
     "### 3. CONTEXT\n"
     "{context}"
-)
\ No newline at end of file
+)
+
+# Folds older chat turns into the running conversation summary (core/memory.py)
+MEMORY_SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a DCPR 2034 assistant. "
+    "Update the current summary with the turns provided. Keep every regulation number, zone, scheme, "
+    "road width, plot area and other figure the user gave or was told, and what the user is trying to do. "
+    "Drop pleasantries and the assistant's explanations. Reply with the updated summary only, "
+    "in at most 150 words."
+)